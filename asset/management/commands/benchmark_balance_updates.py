@@ -0,0 +1,112 @@
+import threading
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.utils import timezone
+from asset.models import Asset, AssetGroup
+from book.cache import bump_book_version
+from book.models import Book
+from record.models import Record
+from record.summary import record_summary_deltas, apply_summary_deltas
+
+
+def locking_save(record):
+    """
+    The old Record.save: lock the asset, add in Python and save every
+    column first, then insert the record and its summary while the asset
+    row stays locked.
+    """
+    with transaction.atomic():
+        asset = Asset.objects.select_for_update().get(pk=record.asset_id)
+        asset.balance += record.amount
+        asset.save()
+        models.Model.save(record)
+        apply_summary_deltas(record_summary_deltas([record]))
+        bump_book_version(record.book_id)
+
+
+def record_save(record):
+    """Record.save as it is, with the balance UPDATE last."""
+    record.save()
+
+
+STRATEGIES = {
+    'locking': locking_save,
+    'save': record_save,
+}
+
+
+def with_latency(latency):
+    """Execute wrapper adding a simulated network round-trip to every statement."""
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(latency)
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent record saves on a single asset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--updates', type=int, default=200,
+                            help='Records saved per worker')
+        parser.add_argument('--latency', type=float, default=0.002,
+                            help='Seconds of simulated round-trip added to every statement')
+
+    def handle(self, *args, **options):
+        user = User.objects.create(username=f'benchmark-{time.time_ns()}')
+        try:
+            book = Book.objects.create(user=user, name='Benchmark')
+            group = AssetGroup.objects.create(book=book, name='Benchmark')
+            asset = Asset.objects.create(group=group, name='Benchmark card')
+
+            self.stdout.write(
+                f"{'strategy':<10}{'saves':>10}{'seconds':>10}{'saves/s':>12}"
+                f"{'avg save ms':>14}{'max save ms':>14}")
+            for name, save in STRATEGIES.items():
+                self.run_strategy(name, save, book, asset, options)
+        finally:
+            user.delete()
+
+    def run_strategy(self, name, save, book, asset, options):
+        workers, updates = options['workers'], options['updates']
+        durations = []
+        lock = threading.Lock()
+
+        def worker():
+            local_durations = []
+            try:
+                with connection.execute_wrapper(with_latency(options['latency'])):
+                    for _ in range(updates):
+                        record = Record(book=book, asset=asset, type='income',
+                                        category='Benchmark', amount=Decimal('1.00'),
+                                        date=timezone.now())
+                        started = time.perf_counter()
+                        save(record)
+                        local_durations.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+            with lock:
+                durations.extend(local_durations)
+
+        Asset.objects.filter(pk=asset.pk).update(balance=0)
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        total = workers * updates
+        balance = Asset.objects.get(pk=asset.pk).balance
+        if balance != total:
+            self.stderr.write(
+                f'{name}: expected balance {total}, got {balance}')
+
+        self.stdout.write(
+            f"{name:<10}{total:>10}{elapsed:>10.2f}{total / elapsed:>12.1f}"
+            f"{sum(durations) / len(durations) * 1000:>14.2f}{max(durations) * 1000:>14.2f}")
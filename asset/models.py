@@ -1,11 +1,15 @@
 from django.db import models
-from book.models import Book
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from book.cache import bump_book_version
+from book.models import Book, Tombstone, deletes_books
 
 
 class AssetGroup(models.Model):
     name = models.CharField(max_length=100)
     book = models.ForeignKey(
         Book, on_delete=models.CASCADE, related_name='groups')
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -24,6 +28,41 @@ class Asset(models.Model):
     is_total_asset = models.BooleanField(blank=True, default=True)
     is_no_budget = models.BooleanField(blank=True, default=False)
     note = models.CharField(max_length=500, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
+
+
+def group_book_id(group_id):
+    return AssetGroup.objects.filter(pk=group_id) \
+        .values_list('book_id', flat=True).first()
+
+
+@receiver(post_save, sender=AssetGroup)
+def invalidate_group_book_cache(sender, instance, **kwargs):
+    bump_book_version(instance.book_id)
+
+
+@receiver(post_delete, sender=AssetGroup)
+def record_group_deletion(sender, instance, origin=None, **kwargs):
+    if deletes_books(origin):
+        return
+    bump_book_version(instance.book_id)
+    Tombstone.objects.create(
+        book_id=instance.book_id, kind='asset_group', object_id=instance.pk)
+
+
+@receiver(post_save, sender=Asset)
+def invalidate_asset_book_cache(sender, instance, **kwargs):
+    bump_book_version(group_book_id(instance.group_id))
+
+
+@receiver(post_delete, sender=Asset)
+def record_asset_deletion(sender, instance, origin=None, **kwargs):
+    if deletes_books(origin):
+        return
+    book_id = group_book_id(instance.group_id)
+    bump_book_version(book_id)
+    if book_id:
+        Tombstone.objects.create(book_id=book_id, kind='asset', object_id=instance.pk)
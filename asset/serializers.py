@@ -33,3 +33,10 @@ class AssetGroupSerializer(serializers.ModelSerializer):
             # Ensure 'book' can be omitted in input data
             'book': {'required': False}
         }
+
+
+class AssetGroupSyncSerializer(serializers.ModelSerializer):
+    """An asset group without its assets, for sync, which sends assets on their own."""
+    class Meta:
+        model = AssetGroup
+        fields = ['id', 'name', 'book']
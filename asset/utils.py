@@ -0,0 +1,48 @@
+from decimal import Decimal
+from django.db.models import F, Case, When
+from django.utils import timezone
+from .models import Asset
+
+
+def adjust_balance(asset_id, amount):
+    """
+    Add amount to an asset's balance with a single UPDATE instead of a
+    read-modify-write. The row stays locked until the transaction commits,
+    so callers make it the last statement of their transaction.
+    """
+    if asset_id and amount:
+        Asset.objects.filter(pk=asset_id).update(
+            balance=F('balance') + Decimal(str(amount)),
+            updated_at=timezone.now())
+
+
+def adjust_balances(deltas):
+    """
+    Apply summed balance changes, given as {asset_id: amount}, with one
+    UPDATE per asset.
+    """
+    # Update in primary key order so concurrent writers can't deadlock
+    for pk in sorted(pk for pk in deltas if pk):
+        adjust_balance(pk, deltas[pk])
+
+
+def move_balance(from_asset_id, to_asset_id, amount):
+    """
+    Move amount from one asset to another with a single UPDATE covering
+    both rows. Either side may be None.
+    """
+    if not amount:
+        return
+    amount = Decimal(str(amount))
+    if not from_asset_id or not to_asset_id or from_asset_id == to_asset_id:
+        adjust_balance(from_asset_id, -amount)
+        adjust_balance(to_asset_id, amount)
+        return
+
+    Asset.objects.filter(pk__in=[from_asset_id, to_asset_id]).update(
+        balance=Case(
+            When(pk=from_asset_id, then=F('balance') - amount),
+            When(pk=to_asset_id, then=F('balance') + amount),
+            default=F('balance'),
+        ),
+        updated_at=timezone.now())
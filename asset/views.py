@@ -3,15 +3,17 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import generics, status
 from rest_framework.permissions import IsAuthenticated
+from book.cache import BookCacheMixin, BookETagMixin
 from book.models import Book
 from .models import Asset, AssetGroup
 from .serializers import AssetSerializer, AssetGroupSerializer
 
 
-class AssetGroupList(generics.ListCreateAPIView):
+class AssetGroupList(BookETagMixin, BookCacheMixin, generics.ListCreateAPIView):
     """
     List all Asset groups, or create a new Asset group.
     """
+    cache_endpoint = 'asset-groups'
     permission_classes = [IsAuthenticated]
 
     # queryset = AssetGroup.objects.all()
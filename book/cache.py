@@ -0,0 +1,238 @@
+"""
+Per-book response cache and conditional GETs for the book-scoped endpoints.
+
+Every book has a version counter in the cache, bumped when a write to its
+records, transfers, assets or asset groups commits, and every user one for
+their list of books. Cached responses and ETags are keyed by the versions,
+so a write makes all of the book's cached responses unreachable at once
+and the next request recomputes them.
+"""
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+import logging
+logger = logging.getLogger(__name__)
+
+# Shared by all workers, see CACHES
+cache = ConnectionProxy(caches, 'shared')
+
+
+def version_key(book_id):
+    return f'book:{book_id}:version'
+
+
+def user_books_key(user_id):
+    return f'user:{user_id}:books-version'
+
+
+def stats_key(endpoint, outcome):
+    return f'book-cache:{endpoint}:{outcome}'
+
+
+def incr(key):
+    """Increment a counter that never expires, creating it at 1."""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+
+
+def new_version():
+    # Versions start from the clock, so one evicted from the cache is never reused
+    return time.time_ns()
+
+
+def versions(keys):
+    """Current values of version keys, starting the missing ones."""
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, new_version(), timeout=None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def book_version(book_id):
+    return versions([version_key(book_id)])[0]
+
+
+def bump_versions(keys):
+    """Bump version keys once the current transaction commits."""
+    keys = set(keys)
+    if not keys:
+        return
+
+    def bump():
+        for key in keys:
+            try:
+                try:
+                    cache.incr(key)
+                except ValueError:
+                    cache.set(key, new_version(), timeout=None)
+            except Exception as e:
+                logger.error(f"Failed to bump cache version {key}: {e}")
+
+    transaction.on_commit(bump)
+
+
+def bump_book_versions(book_ids):
+    """
+    Invalidate the cached responses and ETags of the books once the current
+    transaction commits, so a response computed from the old data can't be
+    cached under the new version.
+    """
+    bump_versions(version_key(book_id) for book_id in book_ids if book_id)
+
+
+def bump_book_version(book_id):
+    bump_book_versions([book_id])
+
+
+def bump_user_books_version(user_id):
+    if user_id:
+        bump_versions([user_books_key(user_id)])
+
+
+def response_key(book_id, endpoint, params):
+    """Key of a response, from the book version, query parameters and timezone."""
+    query = '&'.join(f'{key}={value}' for key, values in sorted(params.lists())
+                     for value in values)
+    digest = hashlib.sha256(
+        f'{query}|{timezone.get_current_timezone_name()}'.encode()).hexdigest()
+    return f'book:{book_id}:v{book_version(book_id)}:{endpoint}:{digest}'
+
+
+def record_outcome(endpoint, outcome):
+    try:
+        incr(stats_key(endpoint, outcome))
+    except Exception as e:
+        logger.warning(f"Failed to count cache {outcome} of {endpoint}: {e}")
+
+
+def cache_stats():
+    """
+    Hits and misses of each endpoint using BookCacheMixin, and how many of
+    its misses read the record summaries or had to aggregate the records.
+    """
+    stats = {}
+    for endpoint in sorted(BookCacheMixin.endpoints):
+        counts = cache.get_many([stats_key(endpoint, outcome)
+                                 for outcome in ('hit', 'miss', 'summary', 'records')])
+        hits, misses, summary_reads, record_reads = (
+            counts.get(stats_key(endpoint, outcome), 0)
+            for outcome in ('hit', 'miss', 'summary', 'records'))
+        total = hits + misses
+        stats[endpoint] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else None,
+            'summary_reads': summary_reads,
+            'record_reads': record_reads,
+        }
+    return stats
+
+
+class BookCacheMixin:
+    """
+    Cache the GET responses of a view for a book_id query parameter. Set
+    cache_endpoint to a name unique among the cached views. Requests
+    without a book_id are not cached, and a cache outage only means the
+    response is computed.
+    """
+    cache_endpoint = None
+    endpoints = set()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.cache_endpoint:
+            BookCacheMixin.endpoints.add(cls.cache_endpoint)
+
+    def get(self, request, *args, **kwargs):
+        book_id = request.query_params.get('book_id')
+        if not book_id or not book_id.isdigit():
+            return super().get(request, *args, **kwargs)
+
+        try:
+            key = response_key(book_id, self.cache_endpoint, request.query_params)
+            data = cache.get(key)
+        except Exception as e:
+            logger.warning(f"Book cache unavailable: {e}")
+            return super().get(request, *args, **kwargs)
+
+        if data is not None:
+            record_outcome(self.cache_endpoint, 'hit')
+            return Response(data)
+
+        record_outcome(self.cache_endpoint, 'miss')
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            try:
+                cache.set(key, response.data, timeout=settings.BOOK_CACHE_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"Failed to cache {self.cache_endpoint}: {e}")
+        return response
+
+
+class BookETagMixin:
+    """
+    Conditional GETs for a view whose response only changes with the
+    versions of a book: an ETag is sent with each response, and a request
+    whose If-None-Match still matches gets 304 Not Modified without running
+    the view. The book comes from the book_id_param query parameter. Views
+    with user_scope also answer without it, for all of the user's books.
+    """
+    book_id_param = 'book_id'
+    user_scope = False
+
+    def get_version_keys(self, request):
+        """The version keys the response depends on, or None to skip ETags."""
+        book_id = request.query_params.get(self.book_id_param)
+        if book_id:
+            return [version_key(book_id)] if book_id.isdigit() else None
+        if not self.user_scope or not request.user.is_authenticated:
+            return None
+
+        from .models import Book
+        book_ids = Book.objects.filter(user=request.user) \
+            .order_by('pk').values_list('pk', flat=True)
+        return [user_books_key(request.user.pk),
+                *(version_key(book_id) for book_id in book_ids)]
+
+    def get_etag(self, request):
+        keys = self.get_version_keys(request)
+        if keys is None:
+            return None
+        query = sorted(request.query_params.lists())
+        token = '|'.join(str(part) for part in (
+            request.path, query, timezone.get_current_timezone_name(),
+            request.user.pk, request.accepted_media_type, *versions(keys)))
+        return quote_etag(hashlib.sha256(token.encode()).hexdigest()[:32])
+
+    def get(self, request, *args, **kwargs):
+        try:
+            etag = self.get_etag(request)
+        except Exception as e:
+            logger.warning(f"Book cache unavailable: {e}")
+            etag = None
+
+        if etag and etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().get(request, *args, **kwargs)
+            if etag is None or response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        # Clients may keep the response, but must revalidate it on every use
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
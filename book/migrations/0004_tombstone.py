@@ -0,0 +1,29 @@
+# Generated by Django 5.1 on 2026-10-18 17:52
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0003_book_monthly_goal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('record', 'Record'), ('transfer', 'Transfer'), ('scheduled_record', 'Scheduled record'), ('asset', 'Asset'), ('asset_group', 'Asset group')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('book', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='book.book')),
+            ],
+            options={
+                'db_table': 'book_tombstone',
+                'indexes': [models.Index(fields=['book', 'deleted_at', 'id'], name='tombstone_book_deleted_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1 on 2026-10-19 10:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0004_tombstone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='timezone',
+            field=models.CharField(default=django.utils.timezone.get_current_timezone_name, editable=False, max_length=64),
+        ),
+    ]
@@ -1,5 +1,9 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .cache import bump_user_books_version
 
 
 class Book(models.Model):
@@ -8,6 +12,52 @@ class Book(models.Model):
     note = models.CharField(max_length=500, blank=True, default='')
     monthly_goal = models.DecimalField(
         max_digits=12, decimal_places=2, null=True, blank=True)
+    # Days of the record summaries are kept in, taken from the request
+    # creating the book
+    timezone = models.CharField(
+        max_length=64, default=timezone.get_current_timezone_name, editable=False)
 
     def __str__(self):
         return self.name
+
+
+class Tombstone(models.Model):
+    """
+    A deleted record, transfer, scheduled record, asset or asset group of a
+    book, kept so sync clients can remove their copy. Rows outlive their
+    book and are pruned after SYNC_TOMBSTONE_DAYS.
+    """
+    KIND_CHOICES = [
+        ('record', 'Record'),
+        ('transfer', 'Transfer'),
+        ('scheduled_record', 'Scheduled record'),
+        ('asset', 'Asset'),
+        ('asset_group', 'Asset group'),
+    ]
+
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING,
+                             db_constraint=False, related_name='+')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'book_tombstone'
+        indexes = [
+            models.Index(fields=['book', 'deleted_at', 'id'],
+                         name='tombstone_book_deleted_idx'),
+        ]
+
+
+def deletes_books(origin):
+    """
+    Whether a deletion started from books or their users. The rows it
+    cascades to go with their book, so they need no tombstones.
+    """
+    model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    return model in (Book, User)
+
+
+@receiver([post_save, post_delete], sender=Book)
+def invalidate_user_books_cache(sender, instance, **kwargs):
+    bump_user_books_version(instance.user_id)
@@ -0,0 +1,136 @@
+"""
+Delta sync of a book: everything created, updated or deleted since a cursor.
+
+Each kind of object is read in (updated_at, id) order from its own position,
+so the cursor holds one position per kind and every read is a range scan of
+a (book, updated_at, id) index. Deletions come from Tombstone rows, read the
+same way by (deleted_at, id).
+
+Timestamps are taken when a row is saved, not when its transaction commits,
+so a slow transaction can commit rows older than a cursor already handed
+out. Once a stream is read to the end, its position is set to
+SYNC_CURSOR_GRACE seconds ago, and the last moments are sent again on the
+next sync. Clients apply changes as upserts, so repeats are harmless.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+from asset.models import Asset, AssetGroup
+from asset.serializers import AssetSerializer, AssetGroupSyncSerializer
+from record.models import Record, Transfer, ScheduledRecord
+from record.serializers import RecordSerializer, TransferSerializer, ScheduledRecordSyncSerializer
+from .models import Tombstone
+
+
+class CursorExpired(Exception):
+    """The cursor is older than the kept tombstones, the client must resync."""
+
+
+# Stream name: (changed objects of a book, serializer, tombstone kind)
+STREAMS = {
+    'records': (
+        lambda book: Record.objects.filter(book=book, is_template=False),
+        RecordSerializer, 'record'),
+    'transfers': (
+        lambda book: Transfer.objects.filter(book=book),
+        TransferSerializer, 'transfer'),
+    'scheduled_records': (
+        lambda book: ScheduledRecord.objects.filter(book=book)
+        .annotate(generated_count=Count('generated_records')),
+        ScheduledRecordSyncSerializer, 'scheduled_record'),
+    'assets': (
+        lambda book: Asset.objects.filter(group__book=book),
+        AssetSerializer, 'asset'),
+    'asset_groups': (
+        lambda book: AssetGroup.objects.filter(book=book),
+        AssetGroupSyncSerializer, 'asset_group'),
+}
+DELETED = 'deleted'
+# Position before any row
+START = (datetime(1970, 1, 1, tzinfo=dt_timezone.utc), 0)
+
+
+def encode_cursor(positions):
+    data = {name: [moment.isoformat(), pk] for name, (moment, pk) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """{stream name: (timestamp, id)} from a cursor, ValueError if it is invalid."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        positions = {name: (datetime.fromisoformat(moment), int(pk))
+                     for name, (moment, pk) in data.items()}
+    except (binascii.Error, TypeError, ValueError, AttributeError):
+        raise ValueError('Invalid sync cursor')
+    if set(positions) != {*STREAMS, DELETED} or \
+            any(timezone.is_naive(moment) for moment, _ in positions.values()):
+        raise ValueError('Invalid sync cursor')
+    return positions
+
+
+def after(queryset, field, position):
+    """Rows strictly after a (timestamp, id) position, in that order."""
+    moment, pk = position
+    return queryset.filter(
+        Q(**{f'{field}__gt': moment}) | Q(**{field: moment, 'pk__gt': pk})
+    ).order_by(field, 'pk')
+
+
+def read_stream(queryset, field, position, horizon, limit):
+    """(rows, next position, has more) for one stream."""
+    rows = list(after(queryset, field, position)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if has_more:
+        position = (getattr(rows[-1], field), rows[-1].pk)
+    else:
+        # Everything up to now was read, continue from the grace horizon
+        position = horizon
+    return rows, position, has_more
+
+
+def changes(book, cursor=None, context=None):
+    """
+    Objects of the book changed and deleted after the cursor, at most
+    SYNC_PAGE_SIZE of each kind, with the cursor to continue from. Without
+    a cursor every object is returned, and no deletions. Raises ValueError
+    for a malformed cursor and CursorExpired for one older than the kept
+    tombstones.
+    """
+    now = timezone.now()
+    horizon = (now - timedelta(seconds=settings.SYNC_CURSOR_GRACE), 0)
+    limit = settings.SYNC_PAGE_SIZE
+
+    if cursor:
+        positions = decode_cursor(cursor)
+        if positions[DELETED][0] < now - timedelta(days=settings.SYNC_TOMBSTONE_DAYS):
+            raise CursorExpired()
+    else:
+        # A new client has nothing to delete, only later deletions matter
+        positions = dict.fromkeys(STREAMS, START)
+        positions[DELETED] = horizon
+
+    result, next_positions, has_more = {}, {}, False
+    for name, (get_queryset, serializer_class, _) in STREAMS.items():
+        rows, next_positions[name], more = read_stream(
+            get_queryset(book), 'updated_at', positions[name], horizon, limit)
+        result[name] = serializer_class(rows, many=True, context=context).data
+        has_more |= more
+
+    tombstones, next_positions[DELETED], more = read_stream(
+        Tombstone.objects.filter(book=book), 'deleted_at',
+        positions[DELETED], horizon, limit)
+    has_more |= more
+    kinds = {kind: name for name, (_, _, kind) in STREAMS.items()}
+    result[DELETED] = {name: [] for name in STREAMS}
+    for tombstone in tombstones:
+        result[DELETED][kinds[tombstone.kind]].append(tombstone.object_id)
+
+    result['cursor'] = encode_cursor(next_positions)
+    result['has_more'] = has_more
+    return result
@@ -0,0 +1,16 @@
+from celery import shared_task
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import Tombstone
+
+
+@shared_task
+def prune_tombstones():
+    """
+    Periodic task to delete tombstones older than SYNC_TOMBSTONE_DAYS.
+    Sync cursors from before then are refused and the client resyncs.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_DAYS)
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return f"Pruned {deleted} tombstones"
@@ -1,3 +1,304 @@
-from django.test import TestCase
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from asset.models import Asset, AssetGroup
+from record.models import Record, Transfer
+from .cache import cache_stats
+from .sync import DELETED, STREAMS, decode_cursor, encode_cursor
+from .models import Book, Tombstone
 
-# Create your tests here.
+LOCMEM_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class BookCacheTests(TestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = User.objects.create_user('owner', password='password')
+        self.book = Book.objects.create(user=self.user, name='Daily Life')
+        group = AssetGroup.objects.create(book=self.book, name='Savings')
+        self.asset = Asset.objects.create(group=group, name='Bank')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.add_record('-10.00')
+
+    def add_record(self, amount):
+        with self.captureOnCommitCallbacks(execute=True):
+            Record.objects.create(book=self.book, asset=self.asset, amount=Decimal(amount),
+                                  date=datetime.fromisoformat('2025-01-15T12:00:00Z'),
+                                  type='expense', category='Food')
+
+    def category_total(self, zone='UTC'):
+        response = self.client.get('/record/category/', {
+            'book_id': self.book.pk, 'type': 'expense', 'timeframe': '2025-01'},
+            HTTP_X_TIMEZONE=zone)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['total_amount']
+
+    def stats(self):
+        stats = cache_stats()['category']
+        return stats['hits'], stats['misses']
+
+    def test_second_request_is_a_hit(self):
+        self.assertEqual(self.category_total(), '10.00')
+        self.assertEqual(self.category_total(), '10.00')
+        self.assertEqual(self.stats(), (1, 1))
+
+    def test_write_invalidates_the_book(self):
+        self.category_total()
+        self.add_record('-5.00')
+
+        self.assertEqual(self.category_total(), '15.00')
+        self.assertEqual(self.stats(), (0, 2))
+
+    def test_responses_are_kept_per_timezone(self):
+        self.category_total('UTC')
+        self.category_total('Asia/Tokyo')
+        self.assertEqual(self.stats(), (0, 2))
+
+    def test_other_books_stay_cached(self):
+        other = Book.objects.create(user=self.user, name='Travel')
+        self.category_total()
+        with self.captureOnCommitCallbacks(execute=True):
+            AssetGroup.objects.create(book=other, name='Cash')
+
+        self.category_total()
+        self.assertEqual(self.stats(), (1, 1))
+
+
+@override_settings(CACHES={**LOCMEM_CACHE, 'shared': {
+    'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:1/0'}})
+class SharedCacheDownTests(TestCase):
+    """Requests and writes still work while the shared cache can't be reached."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.book = Book.objects.create(user=self.user, name='Daily Life')
+        group = AssetGroup.objects.create(book=self.book, name='Savings')
+        self.asset = Asset.objects.create(group=group, name='Bank')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cached_endpoints_fall_back_to_the_database(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Record.objects.create(book=self.book, asset=self.asset, amount=Decimal('-10.00'),
+                                  date=datetime.fromisoformat('2025-01-15T12:00:00Z'),
+                                  type='expense', category='Food')
+
+        response = self.client.get('/record/category/', {
+            'book_id': self.book.pk, 'type': 'expense', 'timeframe': '2025-01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_amount'], '10.00')
+        response = self.client.get('/record/combined/', {'book_id': self.book.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class BookETagTests(TestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = User.objects.create_user('owner', password='password')
+        self.book = Book.objects.create(user=self.user, name='Daily Life')
+        group = AssetGroup.objects.create(book=self.book, name='Savings')
+        self.asset = Asset.objects.create(group=group, name='Bank')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, path, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(path, params, **headers)
+
+    def test_unchanged_book_is_not_modified(self):
+        response = self.get('/record/combined/', book_id=self.book.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self.get('/record/combined/', response['ETag'], book_id=self.book.pk)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_write_changes_the_etag(self):
+        etag = self.get('/record/combined/', book_id=self.book.pk)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Record.objects.create(book=self.book, asset=self.asset, amount=Decimal('-10.00'),
+                                  date=datetime.fromisoformat('2025-01-15T12:00:00Z'),
+                                  type='expense', category='Food')
+
+        response = self.get('/record/combined/', etag, book_id=self.book.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_the_query(self):
+        etag = self.get('/record/combined/', book_id=self.book.pk)['ETag']
+        response = self.get('/record/combined/', etag, book_id=self.book.pk, type='expense')
+        self.assertEqual(response.status_code, 200)
+
+    def test_book_list_changes_with_the_users_books(self):
+        etag = self.get('/book/')['ETag']
+        self.assertEqual(self.get('/book/', etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(user=self.user, name='Travel')
+
+        self.assertEqual(self.get('/book/', etag).status_code, 200)
+
+    def test_etag_is_per_user(self):
+        etag = self.get('/record/combined/', book_id=self.book.pk)['ETag']
+        self.client.force_authenticate(User.objects.create_user('other', password='password'))
+
+        response = self.get('/record/combined/', etag, book_id=self.book.pk)
+        self.assertEqual(response.status_code, 200)
+
+
+class TombstoneTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.book = Book.objects.create(user=self.user, name='Daily Life')
+        self.group = AssetGroup.objects.create(book=self.book, name='Savings')
+        self.asset = Asset.objects.create(group=self.group, name='Bank')
+        self.other_asset = Asset.objects.create(group=self.group, name='Cash')
+        self.record = Record.objects.create(
+            book=self.book, asset=self.asset, amount=Decimal('-10.00'),
+            date=datetime.fromisoformat('2025-01-15T12:00:00Z'), type='expense', category='Food')
+        self.transfer = Transfer.objects.create(
+            book=self.book, from_asset=self.other_asset, to_asset=self.asset,
+            amount=Decimal('5.00'), date=datetime.fromisoformat('2025-01-16T12:00:00Z'))
+
+    def kinds(self):
+        return sorted(Tombstone.objects.filter(book_id=self.book.pk).values_list('kind', flat=True))
+
+    def test_deleting_a_record(self):
+        self.record.delete()
+        self.assertEqual(self.kinds(), ['record'])
+
+    def test_deleting_a_group(self):
+        self.group.delete()
+        self.assertEqual(self.kinds(), ['asset', 'asset', 'asset_group'])
+
+    def test_deleting_the_book_leaves_no_tombstones(self):
+        self.book.delete()
+        self.assertEqual(self.kinds(), [])
+
+    def test_deleting_the_user_leaves_no_tombstones(self):
+        self.user.delete()
+        self.assertEqual(self.kinds(), [])
+
+    def test_deleting_an_asset_touches_its_records_and_transfers(self):
+        past = datetime.fromisoformat('2025-01-01T00:00:00Z')
+        Record.objects.update(updated_at=past)
+        Transfer.objects.update(updated_at=past)
+
+        self.asset.delete()
+
+        self.record.refresh_from_db()
+        self.transfer.refresh_from_db()
+        self.assertIsNone(self.record.asset_id)
+        self.assertIsNone(self.transfer.to_asset_id)
+        self.assertGreater(self.record.updated_at, past + timedelta(days=1))
+        self.assertGreater(self.transfer.updated_at, past + timedelta(days=1))
+        self.assertEqual(self.kinds(), ['asset'])
+
+
+@override_settings(SYNC_PAGE_SIZE=500, SYNC_CURSOR_GRACE=0, SYNC_TOMBSTONE_DAYS=90)
+class BookSyncTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.book = Book.objects.create(user=self.user, name='Daily Life')
+        self.group = AssetGroup.objects.create(book=self.book, name='Savings')
+        self.asset = Asset.objects.create(group=self.group, name='Bank')
+        self.records = [self.add_record(day) for day in (1, 2, 3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_record(self, day):
+        return Record.objects.create(
+            book=self.book, asset=self.asset, amount=Decimal('-10.00'),
+            date=datetime.fromisoformat(f'2025-01-0{day}T12:00:00Z'), type='expense', category='Food')
+
+    def sync(self, cursor=None, status=200):
+        params = {'cursor': cursor} if cursor else {}
+        response = self.client.get(f'/book/{self.book.pk}/sync/', params)
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def ids(self, data, name='records'):
+        return sorted(row['id'] for row in data[name])
+
+    def test_first_sync_returns_everything(self):
+        data = self.sync()
+
+        self.assertEqual(self.ids(data), sorted(record.pk for record in self.records))
+        self.assertEqual(self.ids(data, 'assets'), [self.asset.pk])
+        self.assertEqual(self.ids(data, 'asset_groups'), [self.group.pk])
+        self.assertEqual(data[DELETED], {name: [] for name in STREAMS})
+        self.assertFalse(data['has_more'])
+
+    def test_cursor_returns_only_later_changes(self):
+        cursor = self.sync()['cursor']
+        data = self.sync(cursor)
+        self.assertEqual(self.ids(data), [])
+
+        added = self.add_record(4)
+        self.records[0].amount = Decimal('-12.00')
+        self.records[0].save()
+        data = self.sync(data['cursor'])
+        self.assertEqual(self.ids(data), sorted([added.pk, self.records[0].pk]))
+        self.assertEqual(self.ids(data, 'assets'), [self.asset.pk])
+        self.assertEqual(self.ids(self.sync(data['cursor'])), [])
+
+    def test_deletions_come_as_tombstones(self):
+        cursor = self.sync()['cursor']
+        deleted = self.records[1].pk
+        self.records[1].delete()
+
+        data = self.sync(cursor)
+
+        self.assertEqual(data[DELETED]['records'], [deleted])
+        self.assertEqual(self.ids(self.sync(data['cursor'])), [])
+        self.assertEqual(self.sync(data['cursor'])[DELETED]['records'], [])
+
+    def test_pages_until_has_more_is_false(self):
+        seen = []
+        with override_settings(SYNC_PAGE_SIZE=2):
+            data = self.sync()
+            self.assertTrue(data['has_more'])
+            self.assertEqual(len(data['records']), 2)
+            seen += self.ids(data)
+
+            data = self.sync(data['cursor'])
+            self.assertFalse(data['has_more'])
+            seen += self.ids(data)
+
+        self.assertEqual(sorted(seen), sorted(record.pk for record in self.records))
+
+    def test_cursor_round_trips(self):
+        positions = decode_cursor(self.sync()['cursor'])
+        self.assertEqual(set(positions), {*STREAMS, DELETED})
+        self.assertEqual(decode_cursor(encode_cursor(positions)), positions)
+
+    def test_invalid_cursor(self):
+        missing = encode_cursor({'records': (timezone.now(), 0)})
+        for cursor in ('not a cursor', missing):
+            self.assertEqual(self.sync(cursor, status=400), {'error': 'Invalid sync cursor'})
+
+    def test_cursor_older_than_the_tombstones_expires(self):
+        positions = decode_cursor(self.sync()['cursor'])
+        positions[DELETED] = (timezone.now() - timedelta(days=91), 0)
+
+        self.sync(encode_cursor(positions), status=410)
+
+    def test_other_users_books_are_not_found(self):
+        self.client.force_authenticate(User.objects.create_user('other', password='password'))
+        self.sync(status=404)
@@ -5,7 +5,9 @@ from . import views
 urlpatterns = [
     path('', views.BookList.as_view()),
     path('<int:pk>/', views.BookDetail.as_view()),
-    path('with-groups/', views.create_book_with_groups)
+    path('with-groups/', views.create_book_with_groups),
+    path('cache-stats/', views.book_cache_stats),
+    path('<int:pk>/sync/', views.BookSync.as_view(), name='book-sync')
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
@@ -1,10 +1,17 @@
+from django.shortcuts import get_object_or_404
 from rest_framework import generics
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework import status
+from .cache import BookETagMixin, cache_stats, user_books_key
 from .models import Book
+from .sync import CursorExpired, changes
 from .serializers import BookSerializer
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 @api_view(http_method_names=["POST"])
@@ -19,7 +26,18 @@ def create_book_with_groups(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class BookList(generics.ListCreateAPIView):
+@api_view(http_method_names=["GET"])
+@permission_classes([IsAdminUser])
+def book_cache_stats(request):
+    """Hits and misses of the per-book analytics response cache, and summary reads."""
+    try:
+        return Response(cache_stats())
+    except Exception as e:
+        logger.warning(f"Book cache unavailable: {e}")
+        return Response({'error': 'Cache unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class BookList(BookETagMixin, generics.ListCreateAPIView):
     """
     List all Books, or create a new Book.
     """
@@ -27,6 +45,10 @@ class BookList(generics.ListCreateAPIView):
     serializer_class = BookSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_version_keys(self, request):
+        # The list only shows the books' own fields
+        return [user_books_key(request.user.pk)]
+
     def get_queryset(self):
         books = Book.objects.filter(user=self.request.user)
         return books
@@ -47,3 +69,25 @@ class BookDetail(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         books = Book.objects.filter(user=self.request.user)
         return books
+
+
+class BookSync(APIView):
+    """
+    Records, transfers, scheduled records, assets and asset groups of a book
+    changed or deleted since ?cursor=, for clients keeping a local copy.
+    Start without a cursor, then pass the returned one; while has_more is
+    true, request again straight away.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        book = get_object_or_404(Book, pk=pk, user=request.user)
+        try:
+            data = changes(book, request.query_params.get('cursor'),
+                           context={'request': request})
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except CursorExpired:
+            return Response({'error': 'Cursor expired, sync again without a cursor'},
+                            status=status.HTTP_410_GONE)
+        return Response(data)
@@ -16,6 +16,7 @@ from dotenv import load_dotenv
 from datetime import timedelta
 import os
 import mimetypes
+import tempfile
 
 load_dotenv()
 
@@ -104,6 +105,22 @@ DATABASES = {
     }
 }
 
+# The default cache, used by the DRF throttles, stays in each process so
+# requests don't depend on Redis. The shared one, on the Redis server Celery
+# already uses, holds the book responses, JWKS and avatar thumbnails; its
+# users fall back to the database or the provider when it is down.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_CACHE_URL', 'redis://localhost:6379/1'),
+        'KEY_PREFIX': 'moneyplant',
+    },
+}
+BOOK_CACHE_TIMEOUT = 60 * 60 * 24  # Seconds a cached analytics response is kept
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -180,14 +197,31 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_PASSWORD')
 EMAIL_USE_TLS = True
 EMAIL_USE_SSL = False
+EMAIL_RETRY_COUNT = 5  # Retries of a failed email send
+EMAIL_RETRY_DELAY = 30  # Seconds before the first retry, doubled for each later one
 
 
 # Push Notifications
 EXPO_PUSH_RETRY_COUNT = 3  # Number of retries for failed notifications
+EXPO_PUSH_DIGEST_MIN = 2  # Scheduled record pushes to one device sent as a digest from this many
+EXPO_PUSH_CLAIM_TIMEOUT = 5 * 60  # Seconds before pushes claimed by a worker that died are sent again
+EXPO_PUSH_RETENTION_DAYS = 30  # Sent, merged and failed pushes are kept this long
 
 
 # OAuth Login
 SOCIAL_AUTH_GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_SIGNIN_IOS_CLIENT_ID')
+APPLE_JWKS_URL = os.environ.get('APPLE_JWKS_URL', 'https://appleid.apple.com/auth/keys')
+GOOGLE_JWKS_URL = os.environ.get('GOOGLE_JWKS_URL', 'https://www.googleapis.com/oauth2/v3/certs')
+JWKS_TIMEOUT = 5  # Seconds to wait for a provider's public keys
+JWKS_DEFAULT_TTL = 60 * 60  # Seconds keys are kept when the provider sends no max-age
+JWKS_REFRESH_INTERVAL = 60  # Least seconds between refetches for an unknown key id
+AVATAR_DOWNLOAD_TIMEOUT = 10  # Seconds to wait for a provider's profile picture
+AVATAR_DOWNLOAD_MAX = 5 * 1024 * 1024  # Largest profile picture downloaded, in bytes
+AVATAR_MAX_DIMENSION = 512  # Downloaded avatars are shrunk to fit this many pixels
+AVATAR_RETRY_COUNT = 3  # Retries of an avatar download failing to connect
+AVATAR_THUMBNAIL_SIZES = (64, 128, 256)  # Thumbnail sizes served by the avatar endpoint, in pixels
+AVATAR_THUMBNAIL_TIMEOUT = 60 * 60 * 24 * 30  # Seconds a generated thumbnail is cached
+AVATAR_CACHE_MAX_AGE = 60 * 60 * 24 * 365  # Seconds clients may keep an avatar fetched by its hash URL
 
 LOGGING = {
     'version': 1,
@@ -239,5 +273,31 @@ CELERY_BEAT_SCHEDULE = {
     'cleanup-expired-schedules': {
         'task': 'record.tasks.cleanup_expired_schedules',
         'schedule': timedelta(hours=24),  # Run once per day
+    },
+    'dispatch-push-notifications': {
+        'task': 'user.tasks.dispatch_push_notifications',
+        'schedule': timedelta(minutes=1),  # Retries and missed dispatches
+    },
+    'prune-tombstones': {
+        'task': 'book.tasks.prune_tombstones',
+        'schedule': timedelta(hours=24),  # Run once per day
+    },
+    'prune-push-notifications': {
+        'task': 'user.tasks.prune_push_notifications',
+        'schedule': timedelta(hours=24),  # Run once per day
     }
 }
+
+# Scheduled records
+SCHEDULED_RECORD_BATCH_SIZE = 500  # Due schedules claimed per transaction
+SCHEDULED_RECORD_WORKERS = 4  # Drain tasks started per check_due_records run
+
+# Tax reports, rendered by Celery workers on the same host as the web workers
+TAX_REPORT_TEMPLATE = os.path.join(BASE_DIR, 'doc', 'test_file.pdf')
+TAX_REPORT_DIR = os.path.join(tempfile.gettempdir(), 'moneyplant', 'tax-reports')
+TAX_REPORT_TTL = 60 * 60 * 24  # Seconds a rendered report is kept
+
+# Delta sync
+SYNC_PAGE_SIZE = 500  # Changed objects of each kind returned per sync request
+SYNC_CURSOR_GRACE = 60  # Seconds of changes sent again, for writes committing late
+SYNC_TOMBSTONE_DAYS = 90  # Deletions are kept this long, older cursors must resync
@@ -0,0 +1,113 @@
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+from django.db import connection
+from django.db.models import DateField, Q, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+
+# Step between buckets, as a PostgreSQL interval
+GRANULARITIES = {
+    'day': '1 day',
+    'week': '1 week',
+    'month': '1 month',
+    'quarter': '3 months',
+    'year': '1 year',
+}
+# Rough bucket length in days, to bound the size of a series
+GRANULARITY_DAYS = {'day': 1, 'week': 7, 'month': 28, 'quarter': 90, 'year': 365}
+
+
+def bucket_label(bucket, granularity):
+    if granularity == 'month':
+        return f"{bucket.year}-{bucket.month:02d}"
+    if granularity == 'quarter':
+        return f"{bucket.year}-Q{(bucket.month - 1) // 3 + 1}"
+    if granularity == 'year':
+        return str(bucket.year)
+    return bucket.strftime("%Y-%m-%d")
+
+
+def day_start(day):
+    """Aware start of a calendar day in the current timezone."""
+    # By name, as make_aware() gets pytz zones (from the middleware) wrong
+    tz = ZoneInfo(timezone.get_current_timezone_name())
+    return datetime.combine(day, time.min, tzinfo=tz)
+
+
+def day_range(start, end):
+    """Filter for a `date` on the days start..end, inclusive, in the current timezone."""
+    return Q(date__gte=day_start(start), date__lt=day_start(end + timedelta(days=1)))
+
+
+def in_range(queryset, start, end):
+    """Filter a Record or RecordSummary queryset to the days start..end, inclusive."""
+    return queryset.filter(day_range(start, end))
+
+
+def opening_balance(queryset, start):
+    """Net sum of everything before the day start, with one aggregate."""
+    queryset = queryset.filter(date__lt=day_start(start))
+    return queryset.aggregate(total=Sum('amount'))['total'] or 0
+
+
+def grouped_totals(queryset, granularity):
+    """Net, income and expense sums per bucket, as a values queryset."""
+    return queryset \
+        .annotate(bucket=Trunc('date', granularity, output_field=DateField())) \
+        .values('bucket') \
+        .annotate(
+            value=Sum('amount'),
+            income=Sum('amount', filter=Q(type='income')),
+            expense=Sum('amount', filter=Q(type='expense'))
+        ) \
+        .order_by()
+
+
+def bucket_totals(queryset, start, end, granularity):
+    """
+    Net, income and expense sums of a Record or RecordSummary queryset per
+    bucket from start to end, in one query. PostgreSQL generate_series is
+    LEFT JOINed to the grouped aggregate, so empty buckets are returned too,
+    with NULL sums. Returns [(bucket date, value, income, expense)] in order.
+    """
+    grouped = grouped_totals(in_range(queryset, start, end), granularity)
+    sql, params = grouped.query.sql_with_params()
+
+    query = f"""
+        SELECT series.bucket::date, totals.value, totals.income, totals.expense
+        FROM generate_series(
+            date_trunc(%s, %s::timestamp), %s::timestamp, %s::interval
+        ) AS series(bucket)
+        LEFT JOIN ({sql}) totals ON totals.bucket::date = series.bucket::date
+        ORDER BY series.bucket
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query, [granularity, start, end,
+                               GRANULARITIES[granularity], *params])
+        return cursor.fetchall()
+
+
+def cumulative_totals(queryset, granularity):
+    """
+    Like bucket_totals over the whole history of the queryset, from its
+    first bucket to its last, with the running net sum computed by a
+    window function. Returns [(bucket date, value, income, expense,
+    balance)] in order, or [] when there is nothing to sum.
+    """
+    sql, params = grouped_totals(queryset, granularity).query.sql_with_params()
+
+    query = f"""
+        WITH totals AS ({sql})
+        SELECT series.bucket::date, totals.value, totals.income, totals.expense,
+               SUM(COALESCE(totals.value, 0)) OVER (ORDER BY series.bucket)
+        FROM (SELECT min(bucket) AS first, max(bucket) AS last FROM totals) bounds
+        CROSS JOIN generate_series(
+            bounds.first::timestamp, bounds.last::timestamp, %s::interval
+        ) AS series(bucket)
+        LEFT JOIN totals ON totals.bucket::date = series.bucket::date
+        ORDER BY series.bucket
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query, [*params, GRANULARITIES[granularity]])
+        return cursor.fetchall()
@@ -0,0 +1,91 @@
+"""
+Streamed export of a book's records and transfers.
+
+Both tables are read through server-side cursors in date order and merged
+lazily, so an export holds one chunk of rows at a time however long the
+book's history is. Rows have the same shape as RecordSerializer and
+TransferSerializer output.
+"""
+import csv
+import heapq
+import json
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+from record.serializers import RecordSerializer, TransferSerializer
+
+# Rows fetched per round trip from each server-side cursor
+EXPORT_CHUNK_SIZE = 2000
+# Rows written per chunk of the response
+EXPORT_WRITE_SIZE = 500
+
+CSV_COLUMNS = ['id', 'type', 'category', 'subcategory', 'is_marked_tax_return', 'note',
+               'amount', 'date', 'book', 'asset', 'from_asset', 'to_asset']
+
+
+def serialized(queryset, serializer, descending):
+    order = ('-date', '-id') if descending else ('date', 'id')
+    for instance in queryset.order_by(*order).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield instance.date, serializer.to_representation(instance)
+
+
+def export_rows(records, transfers, descending=False):
+    """Serialized records and transfers merged by date."""
+    merged = heapq.merge(
+        serialized(records, RecordSerializer(), descending),
+        serialized(transfers, TransferSerializer(), descending),
+        key=lambda pair: pair[0], reverse=descending)
+    for _, row in merged:
+        yield row
+
+
+def in_chunks(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= EXPORT_WRITE_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def in_timezone(chunks, tz):
+    """
+    The chunks, each generated with tz active. The response is streamed
+    after TimezoneMiddleware has deactivated the request's zone, and the
+    zone must not stay active in the thread between chunks.
+    """
+    chunks = iter(chunks)
+    while True:
+        with timezone.override(tz):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=JSONEncoder) + '\n'
+
+
+class Line:
+    """File-like object for csv.writer that hands back each written line."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(Line(), fieldnames=CSV_COLUMNS, restval='',
+                            extrasaction='ignore')
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+FORMATS = {
+    # format: (line writer, content type)
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
@@ -0,0 +1,148 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.db import connection
+
+
+RECORD_COLUMNS = ('id', 'type', 'category', 'subcategory', 'is_marked_tax_return',
+                  'note', 'amount', 'date', 'book_id', 'asset_id')
+TRANSFER_COLUMNS = ('id', 'note', 'amount', 'date', 'book_id',
+                    'from_asset_id', 'to_asset_id')
+
+# Days are grouped by the UTC date, as datetime.date() on the stored value
+DAY = "({}.date AT TIME ZONE 'UTC')::date"
+
+# The newest days of one branch, one (book, -date) index probe per day:
+# each step finds the newest entry before the start of the previous day
+BRANCH_DAYS = """
+    WITH RECURSIVE branch_days(day) AS (
+        (SELECT {day} FROM ({sql}) b WHERE {where}
+         ORDER BY b.date DESC LIMIT 1)
+        UNION ALL
+        SELECT (SELECT {day} FROM ({sql}) b
+                WHERE {where} AND b.date < (d.day::timestamp AT TIME ZONE 'UTC')
+                ORDER BY b.date DESC LIMIT 1)
+        FROM branch_days d WHERE d.day IS NOT NULL
+    )
+    SELECT day FROM branch_days WHERE day IS NOT NULL LIMIT %s
+"""
+
+RECORD_BRANCH = """
+    SELECT r.id, 'record' AS kind, r.type, r.category, r.subcategory,
+           r.is_marked_tax_return, r.note, r.amount, r.date, r.book_id, r.asset_id,
+           NULL::bigint AS from_asset_id, NULL::bigint AS to_asset_id,
+           (r.date AT TIME ZONE 'UTC')::date AS day
+    FROM ({}) r
+"""
+TRANSFER_BRANCH = """
+    SELECT t.id, 'transfer' AS kind, 'transfer' AS type, '' AS category, '' AS subcategory,
+           false AS is_marked_tax_return, t.note, t.amount, t.date, t.book_id,
+           NULL::bigint AS asset_id, t.from_asset_id, t.to_asset_id,
+           (t.date AT TIME ZONE 'UTC')::date AS day
+    FROM ({}) t
+"""
+
+
+class CombinedFeed:
+    """
+    Records and transfers merged newest first by PostgreSQL with UNION ALL,
+    paged by whole days. Filtering, ordering, limits and the per-day income
+    and expense sums all run in the database; rows come back as plain dicts.
+    A page first finds its days in each branch separately, walking the
+    (book, -date) indexes, then reads only the entries of those days.
+
+    Supports count() and slicing by day, so Django's Paginator can page it.
+    """
+
+    def __init__(self, records, transfers):
+        branches, self.params, self.branches = [], [], []
+        for queryset, columns, branch, kind in (
+                (records, RECORD_COLUMNS, RECORD_BRANCH, 'record'),
+                (transfers, TRANSFER_COLUMNS, TRANSFER_BRANCH, 'transfer')):
+            # Querysets from .none() can't be compiled, leave them out
+            if queryset.query.is_empty():
+                continue
+            sql, params = queryset.order_by().values_list(
+                *columns).query.sql_with_params()
+            branches.append(branch.format(sql))
+            self.params.extend(params)
+            self.branches.append((kind, sql, params))
+
+        self.sql = f"WITH feed AS ({' UNION ALL '.join(branches)}) " if branches else None
+
+    def count(self):
+        """Number of days with at least one entry."""
+        if self.sql is None:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self.sql + "SELECT count(DISTINCT day) FROM feed", self.params)
+            return cursor.fetchone()[0]
+
+    def __getitem__(self, days):
+        if not isinstance(days, slice):
+            raise TypeError('CombinedFeed only supports slicing')
+        offset = days.start or 0
+        return self.days(days.stop - offset, offset=offset)
+
+    def branch_days(self, limit, before=None):
+        """The newest `limit` days with entries, before a (date, kind, id) position."""
+        found = set()
+        with connection.cursor() as cursor:
+            for kind, sql, params in self.branches:
+                where, bound = 'TRUE', []
+                if before is not None:
+                    where = '(b.date, %s, b.id) < (%s, %s, %s)'
+                    bound = [kind, *before]
+                query = BRANCH_DAYS.format(day=DAY.format('b'), sql=sql, where=where)
+                cursor.execute(query, [*params, *bound, *params, *bound, limit])
+                found.update(day for day, in cursor.fetchall())
+        return sorted(found, reverse=True)[:limit]
+
+    def days_query(self, first, last, before=None):
+        """SQL and params for the entries of the days from first to last."""
+        where, params = 'TRUE', []
+        if before is not None:
+            where = '(feed.date, feed.kind, feed.id) < (%s, %s, %s)'
+            params = list(before)
+
+        query = self.sql + f"""
+            SELECT feed.*,
+                   SUM(CASE WHEN kind = 'record' AND type = 'income' THEN amount ELSE 0 END)
+                       OVER (PARTITION BY feed.day) AS sum_of_income,
+                   SUM(CASE WHEN kind = 'record' AND type = 'expense' THEN amount ELSE 0 END)
+                       OVER (PARTITION BY feed.day) AS sum_of_expense
+            FROM feed
+            WHERE feed.date >= %s AND feed.date < %s AND {where}
+            ORDER BY feed.date DESC, feed.kind DESC, feed.id DESC
+        """
+        start = datetime.combine(first, time.min, tzinfo=dt_timezone.utc)
+        end = datetime.combine(last + timedelta(days=1), time.min, tzinfo=dt_timezone.utc)
+        return query, [*self.params, start, end, *params]
+
+    def days(self, limit, offset=0, before=None):
+        """
+        Up to `limit` day groups, skipping `offset` days, optionally only
+        entries strictly older than a (date, kind, id) position.
+        """
+        if self.sql is None:
+            return []
+        days = self.branch_days(limit + offset, before)[offset:]
+        if not days:
+            return []
+
+        query, params = self.days_query(days[-1], days[0], before)
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            columns = [column.name for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        grouped_data = []
+        for row in rows:
+            if not grouped_data or grouped_data[-1]['date'] != row['day']:
+                grouped_data.append({
+                    'date': row['day'],
+                    'records': [],
+                    'sum_of_income': row['sum_of_income'],
+                    'sum_of_expense': row['sum_of_expense']
+                })
+            grouped_data[-1]['records'].append(row)
+        return grouped_data
@@ -0,0 +1,90 @@
+import random
+import re
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from asset.models import Asset, AssetGroup
+from book.models import Book
+from record.models import Record, RecordMonthSummary, RecordSummary
+from record.summary import rebuild_summaries, summary_queryset
+
+EXECUTION_TIME = re.compile(r'Execution Time: ([\d.]+) ms')
+CATEGORIES = ['Food', 'Transport', 'Rent', 'Fun', 'Health']
+
+
+class Command(BaseCommand):
+    help = ('Compare the rows a year of trend reads from records and from the '
+            'day and month summaries, and the time it takes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=50000)
+        parser.add_argument('--days', type=int, default=730,
+                            help='Days back from today the records are spread over')
+        parser.add_argument('--timezone', default='America/New_York',
+                            help='Timezone of the benchmark book and the requests')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per query, the median time is shown')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('EXPLAIN ANALYZE needs the PostgreSQL database')
+
+        user = User.objects.create(username=f'benchmark-{time.time_ns()}')
+        try:
+            with timezone.override(options['timezone']):
+                book = Book.objects.create(user=user, name='Benchmark')
+                self.fill(book, options['records'], options['days'])
+                self.compare(book, options['repeat'])
+        finally:
+            user.delete()
+
+    def fill(self, book, count, days):
+        group = AssetGroup.objects.create(book=book, name='Benchmark')
+        asset = Asset.objects.create(group=group, name='Benchmark card')
+        now = timezone.now()
+        records = [
+            Record(book=book, asset=asset, type='expense', category=random.choice(CATEGORIES),
+                   amount=-Decimal(random.randint(100, 10000)) / 100,
+                   date=now - timedelta(seconds=random.randint(0, days * 86400)))
+            for _ in range(count)]
+        # bulk_create skips the summaries, built in one go after
+        Record.objects.bulk_create(records, batch_size=5000)
+        rebuild_summaries([book.pk])
+        with connection.cursor() as cursor:
+            for model in (Record, RecordSummary, RecordMonthSummary):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    def compare(self, book, repeat):
+        tz = timezone.get_current_timezone()
+        year = timezone.localdate().year
+        records = Record.objects.filter(book=book, is_template=False)
+        hours = records.annotate(hour=Trunc('date', 'hour')) \
+            .values('hour', 'category').distinct().count()
+        sources = [
+            ('records', records, Record.objects.filter(book=book).count()),
+            ('day summaries', summary_queryset(book.pk, 'day'),
+             RecordSummary.objects.filter(book=book).count()),
+            ('month summaries', summary_queryset(book.pk, 'month'),
+             RecordMonthSummary.objects.filter(book=book).count()),
+        ]
+
+        self.stdout.write(f'Book of {sources[0][2]} records, timezone {tz}, '
+                          f'{hours} rows when keyed per UTC hour, median of {repeat} runs')
+        self.stdout.write(f"{'source':<18}{'book rows':>12}{'rows read':>12}{'ms':>10}")
+        for label, queryset, rows in sources:
+            trend = queryset.filter(type='expense', date__year=year) \
+                .annotate(month=Trunc('date', 'month', tzinfo=tz)) \
+                .values('month').annotate(total=Sum('amount')).order_by('month')
+            times = []
+            for _ in range(repeat):
+                plan = trend.explain(analyze=True)
+                times.append(float(EXECUTION_TIME.search(plan).group(1)))
+            read = queryset.filter(type='expense', date__year=year).count()
+            self.stdout.write(f'{label:<18}{rows:>12}{read:>12}{statistics.median(times):>10.2f}')
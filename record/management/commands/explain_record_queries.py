@@ -0,0 +1,158 @@
+import re
+import statistics
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Abs, TruncMonth
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from book.models import Book
+from record import views
+from record.models import Record, Transfer
+
+
+INDEX_SCAN = re.compile(r'(?:Index Scan|Index Only Scan|Bitmap Index Scan)(?: Backward)? (?:using|on) (\S+)')
+EXECUTION_TIME = re.compile(r'Execution Time: ([\d.]+) ms')
+
+
+class Command(BaseCommand):
+    help = ('Run EXPLAIN ANALYZE on the queries each record view issues for a '
+            'book and report which of the record and transfer indexes they use')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--book', type=int,
+                            help='Book to query (default: the book with the most records)')
+        parser.add_argument('--timezone', default=None,
+                            help="Request timezone (default: the book's), another zone "
+                                 'skips the record summaries and scans records')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Date range, in days back from today, for the range views')
+        parser.add_argument('--plans', action='store_true',
+                            help='Print the full plans, not just the indexes used')
+        parser.add_argument('--compare-template-filter', action='store_true',
+                            help='Instead compare leaving scheduled record templates out '
+                                 'with the scheduled_record join and with is_template')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per query when comparing, the median time is shown')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('EXPLAIN ANALYZE needs the PostgreSQL database')
+
+        book = self.get_book(options['book'])
+        if options['compare_template_filter']:
+            return self.compare_template_filter(book, options['repeat'], options['plans'])
+
+        tz_name = options['timezone'] or book.timezone
+        today = timezone.localdate()
+        start = (today - timedelta(days=options['days'])).isoformat()
+        end = today.isoformat()
+        new_indexes = {index.name for model in (Record, Transfer)
+                       for index in model._meta.indexes}
+
+        book_params = {'book_id': book.pk}
+        range_params = {**book_params, 'start_date': start, 'end_date': end}
+        checks = [
+            ('combined', views.CombinedListView.as_view(), book_params),
+            ('combined, cursor', views.CombinedListView.as_view(),
+             {**book_params, 'pagination': 'cursor'}),
+            ('combined, expenses', views.CombinedListView.as_view(),
+             {**book_params, 'type': 'expense'}),
+            ('combined, date range', views.CombinedListView.as_view(),
+             {**book_params, 'date_after': start, 'date_before': end}),
+            ('combined, by asset', views.CombinedListView.as_view(),
+             {**book_params, 'asset': self.get_asset_id(book)}),
+            ('all records', views.all_records_view, range_params),
+            ('tax only', views.tax_only_records_view, range_params),
+            ('monthly data', views.MonthlyDataView.as_view(), book_params),
+            ('trend, year', views.RecordTrendView.as_view(),
+             {**book_params, 'type': 'expense', 'timeframe': str(today.year)}),
+            ('category, year', views.CategoriedRecordView.as_view(),
+             {**book_params, 'type': 'expense', 'timeframe': str(today.year)}),
+        ]
+
+        self.stdout.write(f'Book {book.pk} ({book.name}), timezone {tz_name}')
+        factory = APIRequestFactory()
+        for label, view, params in checks:
+            request = factory.get('/records/', params, HTTP_X_TIMEZONE=tz_name)
+            force_authenticate(request, user=book.user)
+            with timezone.override(tz_name), CaptureQueriesContext(connection) as queries:
+                response = view(request)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'\n{label} (HTTP {response.status_code})'))
+
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                    continue
+                if 'record' not in sql and 'transfer' not in sql:
+                    continue
+                plan = self.explain(sql)
+                used = sorted(set(INDEX_SCAN.findall(plan)))
+                self.stdout.write(f'  {" ".join(sql.split())[:100]}...')
+                if not used:
+                    self.stdout.write(self.style.WARNING('    no index scans'))
+                for name in used:
+                    if name in new_indexes:
+                        self.stdout.write(self.style.SUCCESS(f'    uses {name}'))
+                    else:
+                        self.stdout.write(f'    uses {name}')
+                if options['plans']:
+                    self.stdout.write('\n'.join(f'    {line}' for line in plan.splitlines()))
+
+    def compare_template_filter(self, book, repeat, show_plans):
+        records = Record.objects.filter(book=book)
+        shapes = [
+            ('monthly totals', lambda qs: qs.annotate(month=TruncMonth('date'))
+                .values('month').annotate(total=Sum('amount')).order_by('month')),
+            ('category totals', lambda qs: qs.filter(type='expense')
+                .values('category', 'subcategory').annotate(total=Sum(Abs('amount')))),
+            ('year of expenses', lambda qs: qs.filter(
+                type='expense', date__year=timezone.localdate().year)),
+            ('record count', lambda qs: qs.values('book').annotate(n=Count('id'))),
+        ]
+        filters = [
+            ('scheduledrecord__isnull', Q(scheduledrecord__isnull=True)),
+            ('is_template', Q(is_template=False)),
+        ]
+
+        self.stdout.write(f'Book {book.pk} ({book.name}), median of {repeat} runs')
+        for label, shape in shapes:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{label}'))
+            for name, condition in filters:
+                queryset = shape(records.filter(condition))
+                times = []
+                for _ in range(repeat):
+                    plan = queryset.explain(analyze=True, buffers=True)
+                    times.append(float(EXECUTION_TIME.search(plan).group(1)))
+                joins = 'joins scheduled_record' if 'scheduled_record' in plan else 'no join'
+                self.stdout.write(
+                    f'  {name:<24} {statistics.median(times):8.2f} ms  {joins}')
+                if show_plans:
+                    self.stdout.write('\n'.join(f'    {line}' for line in plan.splitlines()))
+
+    def get_book(self, book_id):
+        if book_id:
+            try:
+                return Book.objects.select_related('user').get(pk=book_id)
+            except Book.DoesNotExist:
+                raise CommandError(f'Book {book_id} does not exist')
+
+        book = Book.objects.select_related('user') \
+            .annotate(records=Count('record')).order_by('-records').first()
+        if book is None:
+            raise CommandError('There are no books to query')
+        return book
+
+    def get_asset_id(self, book):
+        # The asset most transfers go through
+        transfers = Transfer.objects.filter(book=book)
+        asset = transfers.values('from_asset').annotate(n=Count('id')).order_by('-n').first()
+        return asset['from_asset'] if asset else ''
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {sql}')
+            return '\n'.join(row[0] for row in cursor.fetchall())
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from record.summary import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the day and month record summaries used by the analytics views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--book', type=int, action='append', dest='books',
+                            help='Only rebuild this book (repeatable)')
+
+    def handle(self, *args, **options):
+        summaries = rebuild_summaries(options['books'])
+        self.stdout.write(f'Rebuilt {len(summaries)} summary rows')
@@ -0,0 +1,50 @@
+# Generated by Django 5.1 on 2026-10-18 17:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum, Count
+from django.db.models.functions import Abs, TruncDate
+from django.utils import timezone
+
+
+def build_summaries(apps, schema_editor):
+    Record = apps.get_model('record', 'Record')
+    RecordSummary = apps.get_model('record', 'RecordSummary')
+
+    grouped = Record.objects.filter(book__isnull=False, scheduledrecord__isnull=True) \
+        .annotate(day=TruncDate('date', tzinfo=timezone.get_default_timezone())) \
+        .values('book_id', 'day', 'type', 'category', 'subcategory') \
+        .annotate(total=Sum('amount'), abs_total=Sum(Abs('amount')), count=Count('id')) \
+        .order_by()
+    RecordSummary.objects.bulk_create(
+        (RecordSummary(**row) for row in grouped), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0003_book_monthly_goal'),
+        ('record', '0015_remove_scheduledrecord_celery_task_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('type', models.CharField(choices=[('income', 'income'), ('expense', 'expense')], max_length=10)),
+                ('category', models.CharField(max_length=200)),
+                ('subcategory', models.CharField(blank=True, default='', max_length=200)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('abs_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='record_summaries', to='book.book')),
+            ],
+            options={
+                'db_table': 'record_summary',
+                'constraints': [models.UniqueConstraint(fields=('book', 'day', 'type', 'category', 'subcategory'), name='unique_record_summary_day')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1 on 2026-10-18 17:25
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without blocking writes to the tables
+    atomic = False
+
+    dependencies = [
+        ('asset', '0009_alter_asset_group_alter_assetgroup_book'),
+        ('book', '0003_book_monthly_goal'),
+        ('record', '0016_recordsummary'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='record',
+            index=models.Index(fields=['book', '-date'], name='record_book_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='record',
+            index=models.Index(fields=['book', 'type', 'date'], name='record_book_type_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='record',
+            index=models.Index(condition=models.Q(('is_marked_tax_return', True)), fields=['book', 'date'], name='record_tax_return_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transfer',
+            index=models.Index(fields=['book', '-date'], name='transfer_book_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transfer',
+            index=models.Index(fields=['from_asset', 'date'], name='transfer_from_asset_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transfer',
+            index=models.Index(fields=['to_asset', 'date'], name='transfer_to_asset_date_idx'),
+        ),
+    ]
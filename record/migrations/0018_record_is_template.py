@@ -0,0 +1,24 @@
+# Generated by Django 5.1 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+def mark_templates(apps, schema_editor):
+    Record = apps.get_model('record', 'Record')
+    Record.objects.filter(scheduledrecord__isnull=False).update(is_template=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('record', '0017_record_transfer_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='record',
+            name='is_template',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_templates, migrations.RunPython.noop),
+    ]
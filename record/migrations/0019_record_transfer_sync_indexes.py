@@ -0,0 +1,26 @@
+# Generated by Django 5.1 on 2026-10-18 17:52
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without blocking writes to the tables
+    atomic = False
+
+    dependencies = [
+        ('asset', '0010_asset_updated_at_assetgroup_updated_at'),
+        ('book', '0004_tombstone'),
+        ('record', '0018_record_is_template'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='record',
+            index=models.Index(fields=['book', 'updated_at', 'id'], name='record_book_updated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transfer',
+            index=models.Index(fields=['book', 'updated_at', 'id'], name='transfer_book_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1 on 2026-10-19 09:12
+
+import datetime
+from django.db import migrations, models
+from django.db.models import Sum, Count
+from django.db.models.functions import Abs, Trunc
+
+
+def clear_summaries(apps, schema_editor):
+    apps.get_model('record', 'RecordSummary').objects.all().delete()
+
+
+def build_summaries(apps, schema_editor):
+    Record = apps.get_model('record', 'Record')
+    RecordSummary = apps.get_model('record', 'RecordSummary')
+
+    grouped = Record.objects.filter(book__isnull=False, is_template=False) \
+        .annotate(hour=Trunc('date', 'hour', tzinfo=datetime.timezone.utc)) \
+        .values('book_id', 'hour', 'type', 'category', 'subcategory') \
+        .annotate(total=Sum('amount'), abs_total=Sum(Abs('amount')), count=Count('id')) \
+        .order_by()
+    RecordSummary.objects.bulk_create(
+        (RecordSummary(**row) for row in grouped), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('record', '0019_record_transfer_sync_indexes'),
+    ]
+
+    operations = [
+        # Day rows can't be split into hours, they are rebuilt from the records
+        migrations.RunPython(clear_summaries, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='recordsummary',
+            name='unique_record_summary_day',
+        ),
+        migrations.RemoveField(
+            model_name='recordsummary',
+            name='day',
+        ),
+        migrations.AddField(
+            model_name='recordsummary',
+            name='hour',
+            field=models.DateTimeField(default=datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)),
+            preserve_default=False,
+        ),
+        migrations.AddConstraint(
+            model_name='recordsummary',
+            constraint=models.UniqueConstraint(fields=('book', 'hour', 'type', 'category', 'subcategory'), name='unique_record_summary_hour'),
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.1 on 2026-10-19 10:05
+
+import datetime
+import django.db.models.deletion
+from zoneinfo import ZoneInfo
+from django.db import migrations, models
+from django.db.models import Sum, Count
+from django.db.models.functions import Abs, Trunc
+
+
+def clear_summaries(apps, schema_editor):
+    apps.get_model('record', 'RecordSummary').objects.all().delete()
+
+
+def build_summaries(apps, schema_editor):
+    Book = apps.get_model('book', 'Book')
+    Record = apps.get_model('record', 'Record')
+
+    names = Book.objects.order_by().values_list('timezone', flat=True).distinct()
+    for model_name, period in (('RecordSummary', 'day'), ('RecordMonthSummary', 'month')):
+        model = apps.get_model('record', model_name)
+        for name in names:
+            grouped = Record.objects.filter(book__timezone=name, is_template=False) \
+                .annotate(start=Trunc('date', period, tzinfo=ZoneInfo(name))) \
+                .values('book_id', 'start', 'type', 'category', 'subcategory') \
+                .annotate(total=Sum('amount'), abs_total=Sum(Abs('amount')), count=Count('id')) \
+                .order_by()
+            model.objects.bulk_create((model(**row) for row in grouped), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0005_book_timezone'),
+        ('record', '0020_recordsummary_hour'),
+    ]
+
+    operations = [
+        # Hour rows can't be merged into days of a zone, they are rebuilt from the records
+        migrations.RunPython(clear_summaries, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='recordsummary',
+            name='unique_record_summary_hour',
+        ),
+        migrations.RemoveField(
+            model_name='recordsummary',
+            name='hour',
+        ),
+        migrations.AddField(
+            model_name='recordsummary',
+            name='start',
+            field=models.DateTimeField(default=datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)),
+            preserve_default=False,
+        ),
+        migrations.AddConstraint(
+            model_name='recordsummary',
+            constraint=models.UniqueConstraint(fields=('book', 'start', 'type', 'category', 'subcategory'), name='unique_record_summary_day'),
+        ),
+        migrations.CreateModel(
+            name='RecordMonthSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('income', 'income'), ('expense', 'expense')], max_length=10)),
+                ('category', models.CharField(max_length=200)),
+                ('subcategory', models.CharField(blank=True, default='', max_length=200)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('abs_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('start', models.DateTimeField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='record_month_summaries', to='book.book')),
+            ],
+            options={
+                'db_table': 'record_month_summary',
+                'constraints': [models.UniqueConstraint(fields=('book', 'start', 'type', 'category', 'subcategory'), name='unique_record_month_summary')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
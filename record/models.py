@@ -1,11 +1,16 @@
+from collections import defaultdict
+from decimal import Decimal
 from django.db import models, transaction
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
-from decimal import Decimal
-from datetime import timedelta
-from dateutil.relativedelta import relativedelta
-from book.models import Book
+from book.cache import bump_book_version, bump_book_versions
+from book.models import Book, Tombstone, deletes_books
 from asset.models import Asset
+from asset.utils import adjust_balance, adjust_balances, move_balance
+from .summary import record_summary_deltas, merge_summary_deltas, apply_summary_deltas
+from . import recurrence
 
 
 TYPE_CHOICES = (('income', 'income'), ('expense', 'expense'))
@@ -35,6 +40,23 @@ class Record(models.Model):
         on_delete=models.SET_NULL,
         related_name='generated_records'
     )
+    # Set on the parent rows of ScheduledRecord, so queries can leave the
+    # templates out without joining scheduled_record
+    is_template = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            # Book feeds and date range scans, newest first
+            models.Index(fields=['book', '-date'], name='record_book_date_idx'),
+            models.Index(fields=['book', 'type', 'date'],
+                         name='record_book_type_date_idx'),
+            # Only a small share of records is marked for tax return
+            models.Index(fields=['book', 'date'], name='record_tax_return_idx',
+                         condition=models.Q(is_marked_tax_return=True)),
+            # Sync cursors
+            models.Index(fields=['book', 'updated_at', 'id'],
+                         name='record_book_updated_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         with transaction.atomic():
@@ -46,39 +68,91 @@ class Record(models.Model):
             if self.type == 'expense' and self.amount > 0:
                 self.amount = -self.amount  # Ensure amount is negative for expense
 
+            # {asset id: balance change}, applied last
+            balance_deltas = defaultdict(Decimal)
+            old_record = None
             if not self.pk:  # If the record is being created
-                self._update_asset_balance(self.amount)
+                balance_deltas[self.asset_id] += self.amount
             else:  # If the record is being updated
                 old_record = Record.objects.select_for_update().get(pk=self.pk)
-                old_amount = old_record.amount
-                old_asset = old_record.asset
-
-                # Handle the case when an asset is assigned for the first time
-                if not old_asset and self.asset:
-                    self._update_asset_balance(self.amount)
-                elif old_asset != self.asset:
-                    # If the asset has changed, update both old and new assets
-                    if old_asset:
-                        self._update_asset_balance(-old_amount, old_asset)
-                    if self.asset:
-                        self._update_asset_balance(self.amount)
-                else:
-                    # If the asset hasn't changed, update with the difference
-                    self._update_asset_balance(self.amount - old_amount)
+                # Take the old amount off the old asset and add the new
+                # amount to the new one, the difference if they are the same
+                balance_deltas[old_record.asset_id] -= old_record.amount
+                balance_deltas[self.asset_id] += self.amount
 
             super().save(*args, **kwargs)
 
+            # Templates only count through the records they generate
+            if not self.is_template:
+                deltas = record_summary_deltas([self])
+                if old_record:
+                    merge_summary_deltas(
+                        deltas, record_summary_deltas([old_record], sign=-1))
+                apply_summary_deltas(deltas)
+
+            # The asset rows stay locked until commit, so update them last
+            adjust_balances(balance_deltas)
+            bump_book_versions([self.book_id, old_record and old_record.book_id])
+
     def delete(self, *args, **kwargs):
         with transaction.atomic():
-            self._update_asset_balance(-self.amount)
+            if not self.is_template:
+                apply_summary_deltas(record_summary_deltas([self], sign=-1))
             super().delete(*args, **kwargs)
+            # The asset row stays locked until commit, so update it last
+            adjust_balance(self.asset_id, -self.amount)
+            bump_book_version(self.book_id)
+
+
+class SummaryTotals(models.Model):
+    """Totals of a book's records of one type and (sub)category over a period."""
+    type = models.CharField(max_length=10, choices=TYPE_CHOICES)
+    category = models.CharField(max_length=200)
+    subcategory = models.CharField(max_length=200, blank=True, default='')
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    abs_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class RecordSummary(SummaryTotals):
+    """
+    Per-day totals of a book's records, maintained on every write so the
+    analytics views don't have to rescan the record table. Days are those
+    of the book's timezone, start being the start of the day there.
+    """
+    period = 'day'
+
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name='record_summaries')
+    start = models.DateTimeField()
+
+    class Meta:
+        db_table = 'record_summary'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['book', 'start', 'type', 'category', 'subcategory'],
+                name='unique_record_summary_day'),
+        ]
 
-    def _update_asset_balance(self, amount_change, asset=None):
-        asset_to_update = asset or self.asset
-        if asset_to_update:
-            asset_to_update = Asset.objects.select_for_update().get(pk=asset_to_update.pk)
-            asset_to_update.balance += Decimal(str(amount_change))
-            asset_to_update.save()
+
+class RecordMonthSummary(SummaryTotals):
+    """RecordSummary by month, for the views over months and years."""
+    period = 'month'
+
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name='record_month_summaries')
+    start = models.DateTimeField()
+
+    class Meta:
+        db_table = 'record_month_summary'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['book', 'start', 'type', 'category', 'subcategory'],
+                name='unique_record_month_summary'),
+        ]
 
 
 class Transfer(models.Model):
@@ -94,6 +168,17 @@ class Transfer(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', '-date'], name='transfer_book_date_idx'),
+            models.Index(fields=['from_asset', 'date'],
+                         name='transfer_from_asset_date_idx'),
+            models.Index(fields=['to_asset', 'date'],
+                         name='transfer_to_asset_date_idx'),
+            models.Index(fields=['book', 'updated_at', 'id'],
+                         name='transfer_book_updated_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         with transaction.atomic():
             # Ensure date is timezone-aware
@@ -101,28 +186,25 @@ class Transfer(models.Model):
                 self.date = timezone.make_aware(
                     self.date, timezone.get_current_timezone())
             if not self.pk:  # If the transfer is being created
-                self._update_asset_balances(self.amount)
+                amount_change = self.amount
             else:  # If the transfer is being updated
                 old_transfer = Transfer.objects.select_for_update().get(pk=self.pk)
-                old_amount = old_transfer.amount
-                self._update_asset_balances(self.amount - old_amount)
+                amount_change = self.amount - old_transfer.amount
 
             super().save(*args, **kwargs)
+            # The asset rows stay locked until commit, so update them last
+            self._update_asset_balances(amount_change)
+            bump_book_version(self.book_id)
 
     def delete(self, *args, **kwargs):
         with transaction.atomic():
-            self._update_asset_balances(-self.amount)
             super().delete(*args, **kwargs)
+            # The asset rows stay locked until commit, so update them last
+            self._update_asset_balances(-self.amount)
+            bump_book_version(self.book_id)
 
     def _update_asset_balances(self, amount_change):
-        if self.from_asset:
-            self.from_asset = Asset.objects.select_for_update().get(pk=self.from_asset.pk)
-            self.from_asset.balance -= Decimal(str(amount_change))
-            self.from_asset.save()
-        if self.to_asset:
-            self.to_asset = Asset.objects.select_for_update().get(pk=self.to_asset.pk)
-            self.to_asset.balance += Decimal(str(amount_change))
-            self.to_asset.save()
+        move_balance(self.from_asset_id, self.to_asset_id, amount_change)
 
 
 class ScheduledRecord(Record):
@@ -165,6 +247,9 @@ class ScheduledRecord(Record):
     month_day = models.IntegerField(
         null=True, blank=True, help_text="Day of month for monthly schedules")
 
+    # Most records a schedule generates in one run when catching up
+    MAX_CATCH_UP = 1000
+
     class Meta:
         db_table = 'scheduled_record'
         indexes = [
@@ -173,6 +258,7 @@ class ScheduledRecord(Record):
         ]
 
     def save(self, *args, **kwargs):
+        self.is_template = True
         is_new = not self.pk
         if is_new:
             self.next_occurrence = self._calculate_next_occurrence(
@@ -199,43 +285,8 @@ class ScheduledRecord(Record):
             self.status = 'completed'
             return current_datetime
 
-        if self.frequency == 'daily':
-            next_date = current_datetime + timedelta(days=self.num_of_days)
-
-        elif self.frequency == 'weekly':
-            if self.week_days:
-                # Find the next allowed weekday
-                next_date = current_datetime + timedelta(days=1)
-                while next_date.weekday() not in self.week_days:
-                    next_date += timedelta(days=1)
-            else:
-                next_date = current_datetime + timedelta(weeks=1)
-
-        elif self.frequency == 'monthly':
-            if self.month_day:
-                if not 1 <= self.month_day <= 31:
-                    raise ValueError("month_day must be between 1 and 31")
-                
-                # Try to set the day in current month
-                current_month_target = current_datetime.replace(day=1)  # Go to first of month to avoid invalid dates
-                current_month_target = current_month_target.replace(day=min(self.month_day,
-                    (current_month_target + relativedelta(months=1, days=-1)).day))
-                
-                # If we haven't passed this day yet in current month, use it
-                if current_month_target > current_datetime:
-                    next_date = current_month_target
-                else:
-                    # Otherwise, go to next month
-                    next_date = (current_datetime + relativedelta(months=1)).replace(day=1)  # First go to 1st
-                    next_date = next_date.replace(day=min(self.month_day,
-                        (next_date + relativedelta(months=1, days=-1)).day))
-            else:
-                next_date = current_datetime + relativedelta(months=1)
-
-        elif self.frequency == 'annually':
-            next_date = current_datetime + relativedelta(years=1)
-
-        else:
+        next_date = self._occurrence_after(current_datetime)
+        if next_date is None:
             return current_datetime
 
         # If next occurrence is past end_date, mark as completed
@@ -245,6 +296,41 @@ class ScheduledRecord(Record):
 
         return next_date
 
+    def _occurrence_after(self, current_datetime):
+        """The occurrence following current_datetime, ignoring status and end_date."""
+        return recurrence.nth_occurrence(self, current_datetime, 1)
+
+    def occurrences_until(self, until, limit=MAX_CATCH_UP):
+        """
+        Every occurrence from next_occurrence up to until, at most limit of
+        them, advancing next_occurrence past them. Unlike
+        _calculate_next_occurrence this stays on the schedule's own dates
+        instead of restarting from now, so missed runs are caught up.
+        """
+        occurrences, following = recurrence.occurrences_until(
+            self, self.next_occurrence, until, limit)
+        self.apply_occurrences(occurrences, following)
+        return occurrences
+
+    def apply_occurrences(self, occurrences, following):
+        """Advance the schedule past occurrences from recurrence.occurrences_until."""
+        if following is None:
+            # Keep the last occurrence, as _calculate_next_occurrence does
+            self.status = 'completed'
+            if occurrences:
+                self.next_occurrence = occurrences[-1]
+        else:
+            self.next_occurrence = following
+
+    def previews(self, count):
+        """The next count occurrences, starting with next_occurrence."""
+        if self.status == 'completed' or count < 1:
+            return []
+        if self.end_date and self.next_occurrence > self.end_date:
+            return []
+        return [self.next_occurrence] + recurrence.next_occurrences(
+            self, self.next_occurrence, count - 1)
+
     def update_next_occurrence(self):
         """Update the next occurrence after a task has run."""
         self.last_run = timezone.now()
@@ -283,3 +369,40 @@ class ScheduledRecord(Record):
             self.next_occurrence <= timezone.now() and
             (not self.end_date or self.next_occurrence <= self.end_date)
         )
+
+
+@receiver(post_delete, sender=Record)
+def add_record_tombstone(sender, instance, origin=None, **kwargs):
+    # Deleting a ScheduledRecord deletes its parent row too, that is
+    # covered by the scheduled_record tombstone
+    if instance.book_id and not instance.is_template and not deletes_books(origin):
+        Tombstone.objects.create(
+            book_id=instance.book_id, kind='record', object_id=instance.pk)
+
+
+@receiver(post_delete, sender=ScheduledRecord)
+def add_scheduled_record_tombstone(sender, instance, origin=None, **kwargs):
+    if instance.book_id and not deletes_books(origin):
+        Tombstone.objects.create(
+            book_id=instance.book_id, kind='scheduled_record', object_id=instance.pk)
+
+
+@receiver(post_delete, sender=Transfer)
+def add_transfer_tombstone(sender, instance, origin=None, **kwargs):
+    if instance.book_id and not deletes_books(origin):
+        Tombstone.objects.create(
+            book_id=instance.book_id, kind='transfer', object_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Asset)
+def touch_asset_records(sender, instance, origin=None, **kwargs):
+    """
+    Deleting an asset sets it to null on its records and transfers without
+    touching updated_at, so bump it for sync clients to see the change.
+    """
+    if deletes_books(origin):
+        return
+    now = timezone.now()
+    Record.objects.filter(asset=instance).update(updated_at=now)
+    Transfer.objects.filter(models.Q(from_asset=instance) | models.Q(to_asset=instance)) \
+        .update(updated_at=now)
@@ -1,7 +1,74 @@
+import base64
+from datetime import datetime
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class RecordListCreatePagination(PageNumberPagination):
     page_size = 50
     page_size_query_param = "size"
     max_page_size = 100
+
+
+class CombinedCursorPagination:
+    """
+    Keyset pagination over the combined feed, newest first. A page holds
+    `size` whole days; the cursor is the (date, kind, id) of its last entry,
+    so each page only reads the rows it returns.
+    """
+    page_size = 50
+    page_size_query_param = "size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_feed(self, feed, request):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+
+        # One extra day tells us whether there is a next page
+        days = feed.days(page_size + 1, before=self.decode_cursor(request))
+        self.next_position = None
+        if len(days) > page_size:
+            days = days[:page_size]
+            last = days[-1]['records'][-1]
+            self.next_position = (last['date'], last['kind'], last['id'])
+        return days
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            date, kind, id = base64.urlsafe_b64decode(
+                encoded.encode('ascii')).decode('ascii').split('|')
+            if kind not in ('record', 'transfer'):
+                raise ValueError(kind)
+            return datetime.fromisoformat(date), kind, int(id)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        date, kind, id = position
+        return base64.urlsafe_b64encode(
+            f'{date.isoformat()}|{kind}|{id}'.encode('ascii')).decode('ascii')
+
+    def get_paginated_response(self, data):
+        next_cursor = self.encode_cursor(
+            self.next_position) if self.next_position else None
+        next_url = replace_query_param(
+            self.base_url, self.cursor_query_param, next_cursor) if next_cursor else None
+        return Response({
+            'next': next_url,
+            'next_cursor': next_cursor,
+            'results': data,
+        })
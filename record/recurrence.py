@@ -0,0 +1,98 @@
+"""
+Closed-form recurrence maths for scheduled records.
+
+The k-th occurrence after a date is computed directly from the schedule's
+frequency, so listing occurrences never steps through the calendar a day
+or a month at a time. Functions take any object with the ScheduledRecord
+schedule fields: frequency, num_of_days, week_days, month_day, end_date.
+"""
+import calendar
+from datetime import timedelta
+from dateutil.relativedelta import relativedelta
+
+
+def nth_occurrence(schedule, start, k):
+    """
+    The k-th occurrence (k >= 1) strictly after start, or None for an
+    unknown frequency. Ignores status and end_date.
+    """
+    if schedule.frequency == 'daily':
+        return start + timedelta(days=schedule.num_of_days * k)
+
+    if schedule.frequency == 'weekly':
+        if not schedule.week_days:
+            return start + timedelta(weeks=k)
+        # Days from start to each allowed weekday, 1 to 7
+        offsets = sorted({(day - start.weekday() - 1) % 7 + 1
+                          for day in schedule.week_days})
+        weeks, index = divmod(k - 1, len(offsets))
+        return start + timedelta(days=offsets[index] + 7 * weeks)
+
+    if schedule.frequency == 'monthly':
+        if not schedule.month_day:
+            return start + relativedelta(months=k)
+        if not 1 <= schedule.month_day <= 31:
+            raise ValueError("month_day must be between 1 and 31")
+        month = start.year * 12 + start.month - 1
+        # The first occurrence is this month's if it is still ahead
+        if _in_month(start, month, schedule.month_day) <= start:
+            month += 1
+        return _in_month(start, month + k - 1, schedule.month_day)
+
+    if schedule.frequency == 'annually':
+        return start + relativedelta(years=k)
+
+    return None
+
+
+def _in_month(moment, month, day):
+    """moment moved to the given day of month (months counted from year 0), clamped."""
+    year, month = divmod(month, 12)
+    last_day = calendar.monthrange(year, month + 1)[1]
+    return moment.replace(year=year, month=month + 1, day=min(day, last_day))
+
+
+def next_occurrences(schedule, start, n):
+    """Up to n occurrences strictly after start, ending at end_date."""
+    occurrences = []
+    for k in range(1, n + 1):
+        occurrence = nth_occurrence(schedule, start, k)
+        if occurrence is None or (schedule.end_date and occurrence > schedule.end_date):
+            break
+        occurrences.append(occurrence)
+    return occurrences
+
+
+def occurrences_until(schedule, start, until, limit):
+    """
+    start and the occurrences after it up to until, at most limit of them,
+    and never past end_date. Returns (occurrences, following) where
+    following is the first occurrence not returned, or None when there is
+    none before end_date.
+    """
+    candidates = [start]
+    k = 0
+    while True:
+        current = candidates[-1]
+        if current is None or (schedule.end_date and current > schedule.end_date):
+            return candidates[:-1], None
+        if current > until or len(candidates) > limit:
+            return candidates[:-1], current
+        k += 1
+        candidates.append(nth_occurrence(schedule, start, k))
+
+
+def expand(schedules, until, limit):
+    """
+    occurrences_until for many schedules in one call, each starting from
+    its next_occurrence. Returns ({schedule id: (occurrences, following)},
+    {schedule id: exception}) so one bad schedule doesn't stop the rest.
+    """
+    expansions, errors = {}, {}
+    for schedule in schedules:
+        try:
+            expansions[schedule.id] = occurrences_until(
+                schedule, schedule.next_occurrence, until, limit)
+        except ValueError as e:
+            errors[schedule.id] = e
+    return expansions, errors
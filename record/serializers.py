@@ -28,6 +28,36 @@ class RecordSerializer(serializers.ModelSerializer):
         return data
 
 
+class RecordBulkItemSerializer(RecordSerializer):
+    """
+    Validates one row of a bulk import. Book and asset ids are checked against
+    the user's books and assets preloaded into the context instead of one
+    query per row.
+    """
+    book = serializers.IntegerField(required=False, allow_null=True)
+    asset = serializers.IntegerField(required=False, allow_null=True)
+
+    def validate_book(self, value):
+        if value is not None and value not in self.context['book_ids']:
+            raise serializers.ValidationError(
+                f'Invalid pk "{value}" - object does not exist.')
+        return value
+
+    def validate_asset(self, value):
+        if value is not None and value not in self.context['asset_books']:
+            raise serializers.ValidationError(
+                f'Invalid pk "{value}" - object does not exist.')
+        return value
+
+    def validate(self, data):
+        book, asset = data.get('book'), data.get('asset')
+        if book is not None and asset is not None and \
+                self.context['asset_books'][asset] != book:
+            raise serializers.ValidationError(
+                {'asset': 'The asset does not belong to this book.'})
+        return super().validate(data)
+
+
 class TransferSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transfer
@@ -53,13 +83,30 @@ class TransferSerializer(serializers.ModelSerializer):
 
 
 class CombinedRecordSerializer(serializers.Serializer):
+    """
+    Serializes a row of the combined feed (a dict, see record.feed) in the
+    same shape as RecordSerializer or TransferSerializer.
+    """
+    id = serializers.IntegerField()
+    type = serializers.CharField()
+    category = serializers.CharField()
+    subcategory = serializers.CharField()
+    is_marked_tax_return = serializers.BooleanField()
+    note = serializers.CharField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    date = serializers.DateTimeField()
+    book = serializers.IntegerField(source='book_id')
+    asset = serializers.IntegerField(source='asset_id')
+    from_asset = serializers.IntegerField(source='from_asset_id')
+    to_asset = serializers.IntegerField(source='to_asset_id')
+
     def to_representation(self, instance):
-        if isinstance(instance, Record):
-            return RecordSerializer(instance).data
-        elif isinstance(instance, Transfer):
-            data = TransferSerializer(instance).data
-            data['type'] = 'transfer'
-            return data
+        data = super().to_representation(instance)
+        if instance['kind'] == 'transfer':
+            fields = TransferSerializer.Meta.fields
+        else:
+            fields = RecordSerializer.Meta.fields
+        return {field: data[field] for field in fields}
 
 
 class GroupedDaySerializer(serializers.Serializer):
@@ -73,6 +120,7 @@ class MonthlyDataSerializer(serializers.Serializer):
     month = serializers.DateTimeField(format="%Y-%m")
     monthly_income = serializers.DecimalField(max_digits=12, decimal_places=2)
     monthly_expense = serializers.DecimalField(max_digits=12, decimal_places=2)
+    balance = serializers.DecimalField(max_digits=14, decimal_places=2)
 
 
 class ScheduledRecordSerializer(serializers.ModelSerializer):
@@ -167,3 +215,15 @@ class ScheduledRecordSerializer(serializers.ModelSerializer):
         if value and timezone.is_naive(value):
             value = timezone.make_aware(value, timezone.get_current_timezone())
         return value
+
+
+class ScheduledRecordSyncSerializer(ScheduledRecordSerializer):
+    """
+    A scheduled record without its generated records, which sync sends as
+    records. Expects generated_count annotated on the queryset.
+    """
+    execution_count = serializers.IntegerField(source='generated_count', read_only=True)
+
+    class Meta(ScheduledRecordSerializer.Meta):
+        fields = [field for field in ScheduledRecordSerializer.Meta.fields
+                  if field != 'generated_records']
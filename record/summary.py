@@ -0,0 +1,187 @@
+from collections import defaultdict
+from datetime import datetime, time
+from decimal import Decimal
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Count
+from django.db.models.functions import Abs, Trunc
+from django.utils import timezone
+from book.cache import bump_book_versions, record_outcome
+
+# Summary tables kept up to date, see record.models.RecordSummary
+PERIODS = ('day', 'month')
+
+
+def zone(name):
+    """ZoneInfo for a Book.timezone, TIME_ZONE for one zoneinfo doesn't know."""
+    try:
+        return ZoneInfo(name or settings.TIME_ZONE)
+    except (ValueError, ZoneInfoNotFoundError):
+        return ZoneInfo(settings.TIME_ZONE)
+
+
+@lru_cache(maxsize=4096)
+def book_timezone(book_id):
+    """
+    The zone a book's summaries are kept in. Books never change theirs, so
+    it is cached for good.
+    """
+    from book.models import Book
+
+    return zone(Book.objects.filter(pk=book_id).values_list('timezone', flat=True).first())
+
+
+def summaries_apply(book_id):
+    """
+    Whether a book's summaries add up to the days of the current timezone,
+    which is when it is the book's own. Other zones have to read Record.
+    """
+    return book_timezone(book_id).key == timezone.get_current_timezone_name()
+
+
+def use_summaries(endpoint, book_id):
+    """
+    Whether an analytics request for a book can read the summaries, counting
+    the reads of each kind per endpoint for the cache stats.
+    """
+    if not book_id:
+        return False
+    used = summaries_apply(book_id)
+    record_outcome(endpoint, 'summary' if used else 'records')
+    return used
+
+
+def summary_model(period):
+    from .models import RecordMonthSummary, RecordSummary
+    return RecordMonthSummary if period == 'month' else RecordSummary
+
+
+def summary_queryset(book_id, period='day'):
+    """
+    The day or month summaries of a book, with date and amount like
+    Record, so the analytics helpers can read either.
+    """
+    return summary_model(period).objects.filter(book_id=book_id) \
+        .annotate(date=F('start'), amount=F('total'))
+
+
+def period_start(moment, tz, period):
+    """Aware start of the day or month of a moment in a zone."""
+    day = moment.astimezone(tz).date()
+    if period == 'month':
+        day = day.replace(day=1)
+    return datetime.combine(day, time.min, tzinfo=tz)
+
+
+def summary_keys(record):
+    if not record.book_id or not record.date:
+        return []
+    tz = book_timezone(record.book_id)
+    return [(period, record.book_id, period_start(record.date, tz, period), record.type,
+             record.category, record.subcategory) for period in PERIODS]
+
+
+def record_summary_deltas(records, sign=1):
+    """
+    Sum records into {summary key: [total, abs_total, count]}. Use sign=-1
+    for records that are being removed.
+    """
+    deltas = defaultdict(lambda: [Decimal('0.00'), Decimal('0.00'), 0])
+    for record in records:
+        amount = Decimal(str(record.amount))
+        for key in summary_keys(record):
+            delta = deltas[key]
+            delta[0] += sign * amount
+            delta[1] += sign * abs(amount)
+            delta[2] += sign
+    return deltas
+
+
+def merge_summary_deltas(deltas, other):
+    for key, (total, abs_total, count) in other.items():
+        delta = deltas[key]
+        delta[0] += total
+        delta[1] += abs_total
+        delta[2] += count
+    return deltas
+
+
+def apply_summary_deltas(deltas):
+    """
+    Apply deltas from record_summary_deltas with one UPDATE per summary row,
+    creating rows on first use and dropping rows that no longer count any
+    record. Must be called inside a transaction.
+    """
+    # Sorted so concurrent writers touch rows in the same order
+    for key in sorted(deltas):
+        total, abs_total, count = deltas[key]
+        if not count and not total and not abs_total:
+            continue
+        period, book_id, start, type, category, subcategory = key
+        model = summary_model(period)
+        rows = model.objects.filter(
+            book_id=book_id, start=start, type=type,
+            category=category, subcategory=subcategory)
+        changes = {
+            'total': F('total') + total,
+            'abs_total': F('abs_total') + abs_total,
+            'count': F('count') + count,
+        }
+
+        if not rows.update(**changes):
+            try:
+                with transaction.atomic():
+                    model.objects.create(
+                        book_id=book_id, start=start, type=type,
+                        category=category, subcategory=subcategory,
+                        total=total, abs_total=abs_total, count=count)
+            except IntegrityError:
+                # Another writer created the row first
+                rows.update(**changes)
+
+        if count < 0:
+            rows.filter(count__lte=0).delete()
+
+
+def summary_rows(records, period):
+    """
+    Aggregate a Record queryset into day or month summary rows, without
+    saving them, each book's in its own zone.
+    """
+    from book.models import Book
+
+    model = summary_model(period)
+    rows = []
+    names = Book.objects.filter(pk__in=records.values('book_id')) \
+        .order_by().values_list('timezone', flat=True).distinct()
+    for name in names:
+        grouped = records.filter(book__timezone=name) \
+            .annotate(start=Trunc('date', period, tzinfo=zone(name))) \
+            .values('book_id', 'start', 'type', 'category', 'subcategory') \
+            .annotate(total=Sum('amount'), abs_total=Sum(Abs('amount')), count=Count('id')) \
+            .order_by()
+        rows.extend(model(**row) for row in grouped)
+    return rows
+
+
+def rebuild_summaries(book_ids=None):
+    """Recompute the summaries from scratch, for all books or the given ones."""
+    from .models import Record
+
+    records = Record.objects.filter(is_template=False, book__isnull=False)
+    if book_ids is not None:
+        records = records.filter(book_id__in=book_ids)
+
+    with transaction.atomic():
+        created = []
+        for period in PERIODS:
+            summaries = summary_model(period).objects.all()
+            if book_ids is not None:
+                summaries = summaries.filter(book_id__in=book_ids)
+            summaries.delete()
+            created.extend(summary_model(period).objects.bulk_create(
+                summary_rows(records, period), batch_size=1000))
+        bump_book_versions({summary.book_id for summary in created} | set(book_ids or ()))
+        return created
@@ -1,104 +1,199 @@
 from celery import shared_task
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
 import json
+import math
+from asset.utils import adjust_balances
+from book.cache import bump_book_versions
+from book.models import Book
+from user.utils import Util
 from .models import Record, ScheduledRecord
-from .utils import send_push_message
+from . import recurrence
+from .summary import record_summary_deltas, apply_summary_deltas
 import logging
 logger = logging.getLogger(__name__)
 
 
+def due_schedules(now):
+    return ScheduledRecord.objects.filter(
+        status='active',
+        next_occurrence__lte=now,
+        start_date__lte=now
+    )
+
+
 @shared_task
 def check_due_records():
     """
-    Periodic task to check and process all due records.
+    Periodic task to check and process all due records. The backlog is
+    split between drain_due_records tasks, which claim schedules with
+    SKIP LOCKED and so never wait on each other.
     """
     now = timezone.now()
-    
-    # Get all due records and lock them
-    with transaction.atomic():
-        due_records = ScheduledRecord.objects.select_for_update().filter(
-            status='active',
-            next_occurrence__lte=now,
-            start_date__lte=now
-        )
-
-        for record in due_records:
-            try:
-                # Double-check the record is still due after getting lock
-                if record.next_occurrence <= now:
-                    process_record_immediately(record)
-            except Exception as e:
-                print(f"Error processing record {record.id}: {str(e)}")
-
-    return f"Checked {due_records.count()} due records"
+    due_count = due_schedules(now).count()
+
+    workers = min(settings.SCHEDULED_RECORD_WORKERS,
+                  math.ceil(due_count / settings.SCHEDULED_RECORD_BATCH_SIZE))
+    for _ in range(workers - 1):
+        drain_due_records.delay(now.isoformat())
+    if workers:
+        drain_due_records(now.isoformat())
+
+    return f"Checked {due_count} due records"
+
+
+@shared_task
+def drain_due_records(cutoff):
+    """
+    Process schedules due at cutoff, one chunk per transaction, until none
+    are left that another worker hasn't claimed.
+    """
+    now = datetime.fromisoformat(cutoff)
+    processed, failed = 0, set()
+
+    while True:
+        with transaction.atomic():
+            # Schedules run in this pass have last_run == now
+            schedules = list(
+                due_schedules(now)
+                .exclude(last_run__gte=now)
+                .exclude(pk__in=failed)
+                .select_for_update(skip_locked=True, of=('self',))
+                .order_by('next_occurrence')[:settings.SCHEDULED_RECORD_BATCH_SIZE]
+            )
+            if not schedules:
+                break
+            errors = run_schedules(schedules, now)
+
+        failed.update(errors)
+        processed += len(schedules) - len(errors)
+
+    return f"Processed {processed} due records"
+
+
+def run_schedules(schedules, now):
+    """
+    Generate every occurrence of each locked schedule up to now, catching
+    up on missed runs, with one bulk insert, one balance update per asset
+    and one bulk update of the schedules.
+    Returns {schedule id: exception} for schedules that could not be run.
+    """
+    expansions, errors = recurrence.expand(
+        schedules, now, ScheduledRecord.MAX_CATCH_UP)
+    for schedule_id, e in errors.items():
+        logger.error(f"Error processing record {schedule_id}: {str(e)}")
+
+    runs = []
+    for schedule in schedules:
+        if schedule.id in errors:
+            continue
+        dates, following = expansions[schedule.id]
+        schedule.apply_occurrences(dates, following)
+        schedule.last_run = now
+        # bulk_update() skips auto_now, sync clients need the change
+        schedule.updated_at = now
+        runs.append((schedule, [
+            Record(
+                book_id=schedule.book_id,
+                asset_id=schedule.asset_id,
+                type=schedule.type,
+                category=schedule.category,
+                subcategory=schedule.subcategory,
+                amount=schedule.amount,
+                note=schedule.note,
+                is_marked_tax_return=schedule.is_marked_tax_return,
+                date=date,
+                created_by_schedule=schedule
+            )
+            for date in dates
+        ]))
+
+    if not runs:
+        return errors
+
+    records = Record.objects.bulk_create(
+        [record for _, new_records in runs for record in new_records])
+
+    apply_summary_deltas(record_summary_deltas(records))
+    # Every updated schedule changes its book's lists, records or not
+    bump_book_versions(schedule.book_id for schedule, _ in runs)
+
+    ScheduledRecord.objects.bulk_update(
+        [schedule for schedule, _ in runs],
+        ['next_occurrence', 'last_run', 'status', 'updated_at']
+    )
+
+    queue_schedule_notifications(runs)
+
+    # The asset rows stay locked until commit, so update them last
+    deltas = defaultdict(Decimal)
+    for record in records:
+        deltas[record.asset_id] += record.amount
+    adjust_balances(deltas)
+    return errors
 
 
 def process_record_immediately(record):
     """Process a record immediately without scheduling"""
-    # Create the new record
-    new_record = Record.objects.create(
-        book=record.book,
-        asset=record.asset,
-        type=record.type,
-        category=record.category,
-        subcategory=record.subcategory,
-        amount=record.amount,
-        note=record.note,
-        is_marked_tax_return=record.is_marked_tax_return,
-        date=record.next_occurrence,
-        created_by_schedule=record
+    errors = run_schedules([record], timezone.now())
+    if errors:
+        raise errors[record.id]
+    transaction.on_commit(Util.dispatch_push_notifications)
+
+
+def queue_schedule_notifications(runs):
+    """
+    Queue pushes for the generated records, and completed series, to the
+    book owners. They are written in the caller's transaction and sent
+    after it commits.
+    """
+    tokens = dict(
+        Book.objects.filter(pk__in={schedule.book_id for schedule, _ in runs})
+        .values_list('pk', 'user__account__expo_push_token')
     )
 
-    # Update the scheduled record
-    record.last_run = timezone.now()
-    old_next = record.next_occurrence
-    record.next_occurrence = record._calculate_next_occurrence(old_next)
-    
-    # Handle completion if needed
-    if record.status == 'completed':
-        try:
-            account = record.book.user.account
-            if account.expo_push_token:
-                message = f'Scheduled record series completed: {record.category}'
-                send_push_message(
-                    token=account.expo_push_token,
-                    message=message,
-                    extra={
-                        "type": "SCHEDULE_COMPLETED",
-                        "scheduleId": record.id,
-                        "bookId": record.book.id,
-                        "category": record.category
-                    }
-                )
-        except Exception as e:
-            print(f"Failed to send completion notification: {str(e)}")
-    
-    record.save()
-
-    # Send notification for new record
-    try:
-        account = record.book.user.account
-        if account.expo_push_token:
-            abs_amount = abs(float(record.amount))
-            action = "costs" if record.type == "expense" else "earns"
-            message = f'{record.frequency.capitalize()} record: {record.category} {action} ${abs_amount:.2f}'
-            
-            send_push_message(
-                token=account.expo_push_token,
-                message=message,
-                extra={
+    messages = []
+    for schedule, new_records in runs:
+        token = tokens.get(schedule.book_id)
+        if not token:
+            continue
+
+        if schedule.status == 'completed':
+            messages.append((
+                token,
+                f'Scheduled record series completed: {schedule.category}',
+                {
+                    "type": "SCHEDULE_COMPLETED",
+                    "scheduleId": schedule.id,
+                    "bookId": schedule.book_id,
+                    "category": schedule.category
+                }
+            ))
+
+        abs_amount = abs(float(schedule.amount))
+        action = "costs" if schedule.type == "expense" else "earns"
+        message = f'{schedule.frequency.capitalize()} record: {schedule.category} {action} ${abs_amount:.2f}'
+        for new_record in new_records:
+            messages.append((
+                token,
+                message,
+                {
                     "type": "SCHEDULED_RECORD",
                     "recordId": new_record.id,
-                    "bookId": record.book.id,
-                    "category": record.category,
-                    "amount": str(record.amount),
-                    "scheduleId": record.id
+                    "bookId": schedule.book_id,
+                    "category": schedule.category,
+                    "amount": str(schedule.amount),
+                    "scheduleId": schedule.id
                 }
-            )
-    except Exception as e:
-        print(f"Failed to send push notification: {str(e)}")
+            ))
 
+    # Sent by the periodic dispatch, so all of a tick's records can be
+    # coalesced into one digest per device
+    Util.queue_push_messages(messages, dispatch=False)
 
 
 @shared_task
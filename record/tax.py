@@ -0,0 +1,42 @@
+from decimal import Decimal
+from django.db.models import Count, Sum
+from record.analytics import in_range
+from record.models import Record
+
+
+def tax_records(book_id, start=None, end=None):
+    """Records of a book marked for tax return, optionally on the days start..end."""
+    records = Record.objects.filter(
+        book_id=book_id, is_marked_tax_return=True, is_template=False)
+    if start and end:
+        records = in_range(records, start, end)
+    return records
+
+
+def tax_summary(records):
+    """
+    Totals of tax-marked records per type and category, with one grouped
+    query over the tax return index.
+    """
+    rows = records.values('type', 'category') \
+        .annotate(total=Sum('amount'), count=Count('id')) \
+        .order_by('type', 'category')
+
+    summary = {
+        'income': Decimal('0.00'),
+        'expense': Decimal('0.00'),
+        'count': 0,
+        'categories': [],
+    }
+    for row in rows:
+        summary[row['type']] += abs(row['total'])
+        summary['count'] += row['count']
+        summary['categories'].append({
+            'type': row['type'],
+            'category': row['category'],
+            'total': abs(row['total']),
+            'count': row['count'],
+        })
+    # Income less the expenses claimed against it
+    summary['taxable'] = summary['income'] - summary['expense']
+    return summary
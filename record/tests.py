@@ -1,3 +1,589 @@
-from django.test import TestCase
+from calendar import monthrange
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from asset.models import Asset, AssetGroup
+from book.cache import book_version
+from book.models import Book
+from .models import Record, RecordMonthSummary, RecordSummary, ScheduledRecord, Transfer
+from .summary import rebuild_summaries, summaries_apply, summary_queryset
+from .tasks import run_schedules
+from . import recurrence
 
-# Create your tests here.
+LOCMEM_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+}
+
+
+def make_book(username):
+    user = User.objects.create_user(username, password='password')
+    book = Book.objects.create(user=user, name=f'{username} book')
+    group = AssetGroup.objects.create(book=book, name='Savings')
+    asset = Asset.objects.create(group=group, name='Bank', balance=Decimal('100.00'))
+    return user, book, asset
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RecordBulkCreateTests(TestCase):
+    url = '/record/record/bulk/'
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user, self.book, self.asset = make_book('owner')
+        _, self.other_book, self.other_asset = make_book('other')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def row(self, **kwargs):
+        return {'type': 'expense', 'category': 'Food', 'amount': '10.00',
+                'date': '2025-01-02T12:00:00Z', 'book': self.book.pk,
+                'asset': self.asset.pk, **kwargs}
+
+    def test_creates_records_and_reconciles_balance(self):
+        response = self.client.post(self.url, [
+            self.row(),
+            self.row(type='income', amount='25.50'),
+            self.row(amount='0'),
+        ], format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [2])
+        self.assertEqual(Record.objects.filter(book=self.book).count(), 2)
+        self.asset.refresh_from_db()
+        self.assertEqual(self.asset.balance, Decimal('115.50'))
+
+    def test_rejects_books_and_assets_of_other_users(self):
+        response = self.client.post(self.url, [
+            self.row(book=self.other_book.pk, asset=None),
+            self.row(asset=self.other_asset.pk),
+        ], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('book', response.data['errors'][0]['errors'])
+        self.assertIn('asset', response.data['errors'][1]['errors'])
+        self.assertFalse(Record.objects.exists())
+        self.other_asset.refresh_from_db()
+        self.assertEqual(self.other_asset.balance, Decimal('100.00'))
+
+    def test_rejects_asset_of_another_book(self):
+        other_group = AssetGroup.objects.create(
+            book=Book.objects.create(user=self.user, name='Second'), name='Cash')
+        wallet = Asset.objects.create(group=other_group, name='Wallet')
+
+        response = self.client.post(self.url, [self.row(asset=wallet.pk)], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('asset', response.data['errors'][0]['errors'])
+        self.assertFalse(Record.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RecordBalanceTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        self.user, self.book, self.asset = make_book('owner')
+        self.wallet = Asset.objects.create(group=self.asset.group, name='Wallet')
+
+    def balances(self):
+        self.asset.refresh_from_db()
+        self.wallet.refresh_from_db()
+        return self.asset.balance, self.wallet.balance
+
+    def test_save_and_delete_update_balances(self):
+        record = Record.objects.create(book=self.book, asset=self.asset, type='expense',
+                                       category='Food', amount=Decimal('30.00'))
+        self.assertEqual(self.balances(), (Decimal('70.00'), Decimal('0.00')))
+
+        record.amount = Decimal('-40.00')
+        record.save()
+        self.assertEqual(self.balances(), (Decimal('60.00'), Decimal('0.00')))
+
+        record.asset = self.wallet
+        record.save()
+        self.assertEqual(self.balances(), (Decimal('100.00'), Decimal('-40.00')))
+
+        record.delete()
+        self.assertEqual(self.balances(), (Decimal('100.00'), Decimal('0.00')))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RecordSummaryTests(TestCase):
+    """The analytics views answer the same from the summaries as from Record."""
+    # Around the turn of a month and a year in UTC, and the last day of March
+    RECORDS = [('2024-12-31T20:30:00Z', '-12.00'), ('2025-01-01T03:00:00Z', '-7.50'),
+               ('2025-01-31T23:30:00Z', '40.00'), ('2025-02-01T08:00:00Z', '-3.25'),
+               ('2025-03-31T22:15:00Z', '-9.00'), ('2025-03-31T12:00:00Z', '15.00')]
+    ZONES = ['UTC', 'America/New_York', 'Asia/Tokyo', 'Australia/Sydney', 'Asia/Kolkata']
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.client = APIClient()
+
+    def make_book(self, zone):
+        # Books keep the timezone of the request creating them
+        with timezone.override(zone):
+            user, book, asset = make_book(f'owner-{zone}')
+        for moment, amount in self.RECORDS:
+            amount = Decimal(amount)
+            Record.objects.create(book=book, asset=asset, amount=amount,
+                                  date=datetime.fromisoformat(moment),
+                                  type='income' if amount > 0 else 'expense', category='Food')
+        self.client.force_authenticate(user)
+        return book
+
+    def get(self, book, path, summaries, **params):
+        caches['shared'].clear()
+        with mock.patch('record.summary.summaries_apply', wraps=summaries_apply) as applies:
+            if not summaries:
+                applies.side_effect = None
+                applies.return_value = False
+            response = self.client.get(path, {'book_id': book.pk, **params},
+                                       HTTP_X_TIMEZONE=book.timezone)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_summaries_match_records_in_the_books_timezone(self):
+        requests = [
+            ('/record/category/', {'type': 'expense', 'timeframe': '2025-01'}),
+            ('/record/category/', {'type': 'expense', 'timeframe': '2025-03'}),
+            ('/record/category/', {'type': 'expense', 'timeframe': '2025'}),
+            ('/record/category/', {'type': 'expense', 'timeframe': '2025@1'}),
+            ('/record/trend/', {'type': 'all', 'start': '2024-12-30', 'end': '2025-04-02',
+                                'granularity': 'day'}),
+            ('/record/trend/', {'type': 'all', 'start': '2024-12-01', 'end': '2025-03-31',
+                                'granularity': 'month'}),
+            ('/record/trend/', {'type': 'balance', 'timeframe': '2025-02'}),
+            ('/record/trend/', {'type': 'expense', 'timeframe': '2025'}),
+            ('/record/trend/', {'type': 'cumulative', 'granularity': 'month'}),
+            ('/record/monthly-data/', {}),
+        ]
+        for zone in self.ZONES:
+            book = self.make_book(zone)
+            with timezone.override(zone):
+                self.assertTrue(summaries_apply(book.pk))
+            for path, params in requests:
+                with self.subTest(zone=zone, path=path, **params):
+                    self.assertEqual(self.get(book, path, True, **params),
+                                     self.get(book, path, False, **params))
+
+    def test_other_timezones_read_records(self):
+        book = self.make_book('Asia/Tokyo')
+        for zone in ['UTC', 'America/New_York']:
+            with timezone.override(zone):
+                self.assertFalse(summaries_apply(book.pk))
+
+    def test_last_day_of_a_month_is_counted(self):
+        book = self.make_book('UTC')
+        for summaries in (True, False):
+            data = self.get(book, '/record/category/', summaries, type='expense', timeframe='2025-03')
+            self.assertEqual(data['total_amount'], '9.00')
+
+    def test_year_reads_month_rows(self):
+        book = self.make_book('UTC')
+        self.assertEqual(RecordSummary.objects.filter(book=book).count(), 6)
+        # December, January and March each have one expense row, February
+        # one, and January and March one income row
+        self.assertEqual(RecordMonthSummary.objects.filter(book=book).count(), 6)
+        with mock.patch('record.views.trend.summary_queryset', wraps=summary_queryset) as queryset:
+            self.get(book, '/record/trend/', True, type='expense', timeframe='2025')
+        self.assertEqual(queryset.call_args.args[1], 'month')
+
+    def test_writes_keep_the_summaries_rebuildable(self):
+        book = self.make_book('Australia/Sydney')
+        records = list(Record.objects.filter(book=book).order_by('date'))
+        records[0].date = datetime.fromisoformat('2025-02-14T15:00:00Z')
+        records[0].save()
+        records[1].amount = Decimal('-1.00')
+        records[1].save()
+        records[2].delete()
+
+        def rows(model):
+            return sorted(model.objects.filter(book=book).values_list(
+                'start', 'type', 'category', 'subcategory', 'total', 'abs_total', 'count'))
+
+        maintained = rows(RecordSummary), rows(RecordMonthSummary)
+        rebuild_summaries([book.pk])
+        self.assertEqual((rows(RecordSummary), rows(RecordMonthSummary)), maintained)
+
+    def test_books_take_the_timezone_of_the_request(self):
+        user = User.objects.create_user('creator', password='password')
+        self.client.force_authenticate(user)
+        response = self.client.post('/book/', {'name': 'Travel', 'timezone': 'UTC'},
+                                    HTTP_X_TIMEZONE='Asia/Kolkata')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Book.objects.get(user=user).timezone, 'Asia/Kolkata')
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CategoriedRecordViewTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        self.user, self.book, self.asset = make_book('owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for category, subcategory, amount in [('Food', 'Lunch', '30.00'), ('Food', 'Dinner', '20.00'),
+                                              ('Rent', '', '100.00'), ('Fun', '', '10.00'),
+                                              ('Gifts', '', '5.00')]:
+            Record.objects.create(book=self.book, type='expense', category=category,
+                                  subcategory=subcategory, amount=Decimal(amount),
+                                  date=datetime(2025, 1, 15, 12, tzinfo=dt_timezone.utc))
+        Record.objects.create(book=self.book, type='income', category='Salary',
+                              amount=Decimal('500.00'),
+                              date=datetime(2025, 1, 15, 12, tzinfo=dt_timezone.utc))
+
+    def get(self, **params):
+        response = self.client.get('/record/category/', {'book_id': self.book.pk, 'type': 'expense',
+                                                         'timeframe': '2025-01', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_totals_per_category_and_subcategory(self):
+        data = self.get()
+
+        self.assertEqual(data['total_amount'], '165.00')
+        self.assertEqual([item['text'] for item in data['data']], ['Rent', 'Food', 'Fun', 'Gifts'])
+        food = data['details']['Food']
+        self.assertEqual((food['total_amount'], food['record_count']), ('50.00', 2))
+        self.assertEqual([(sub['subcategory'], sub['total_amount']) for sub in food['subcategories']],
+                         [('Lunch', '30.00'), ('Dinner', '20.00')])
+
+    def test_top_n_folds_the_rest_into_other(self):
+        data = self.get(top_n=2)
+
+        self.assertEqual(list(data['details']), ['Rent', 'Food', 'Other'])
+        other = data['details']['Other']
+        self.assertEqual((other['total_amount'], other['record_count']), ('15.00', 2))
+        self.assertEqual({sub['subcategory'] for sub in other['subcategories']}, {'Fun', 'Gifts'})
+        self.assertEqual(data['total_amount'], '165.00')
+
+    def test_invalid_parameters(self):
+        for params in [{'type': 'transfer'}, {'top_n': '0'}, {'timeframe': '2025-13'}]:
+            response = self.client.get('/record/category/', {
+                'book_id': self.book.pk, 'type': 'expense', **params})
+            self.assertEqual(response.status_code, 400, params)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RecordTrendViewTests(TestCase):
+    RECORDS = [('2024-12-10', 'income', '100.00'), ('2025-01-05', 'expense', '-30.00'),
+               ('2025-01-05', 'income', '200.00'), ('2025-03-20', 'expense', '-50.00')]
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user, self.book, self.asset = make_book('owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for day, type, amount in self.RECORDS:
+            Record.objects.create(book=self.book, asset=self.asset, type=type, category='Misc',
+                                  amount=Decimal(amount),
+                                  date=datetime.fromisoformat(f'{day}T12:00:00+00:00'))
+
+    def get(self, path='/record/trend/', status=200, **params):
+        response = self.client.get(path, {'book_id': self.book.pk, **params},
+                                   HTTP_X_TIMEZONE='UTC')
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def test_all_returns_every_series(self):
+        data = self.get(type='all', timeframe='2025')
+
+        self.assertEqual(len(data), 12)
+        self.assertEqual(data[0], {'date': '2025-01', 'income': 200.0, 'expense': 30.0, 'balance': 270.0})
+        self.assertEqual(data[2], {'date': '2025-03', 'income': 0, 'expense': 50.0, 'balance': 220.0})
+
+    def test_several_timeframes_at_once(self):
+        data = self.get(type='expense', timeframe=['2025', '2025-01', '2025@1'])
+
+        self.assertEqual(list(data), ['2025', '2025-01', '2025@1'])
+        self.assertEqual([point['value'] for point in data['2025'][:3]], [30.0, 0, 50.0])
+        self.assertEqual(len(data['2025-01']), 31)
+        self.assertEqual(data['2025-01'][4], {'date': '2025-01-05', 'value': 30.0})
+        # Week 1 of 2025 starts on Monday the 6th
+        self.assertEqual(data['2025@1'][0]['date'], '2025-01-06')
+        self.assertEqual(len(data['2025@1']), 7)
+
+    def test_one_timeframe_is_a_list(self):
+        self.assertEqual(self.get(type='expense', timeframe='2025-03')[19],
+                         {'date': '2025-03-20', 'value': 50.0})
+        self.get(status=400, type='expense', timeframe=['2025', '2025-13'])
+
+    def test_range_and_granularity(self):
+        data = self.get(type='expense', start='2024-12-01', end='2025-06-30', granularity='quarter')
+        self.assertEqual(data, [{'date': '2024-Q4', 'value': 0}, {'date': '2025-Q1', 'value': 80.0},
+                                {'date': '2025-Q2', 'value': 0}])
+
+        data = self.get(type='income', start='2025-01-01', end='2025-01-31', granularity='week')
+        # Weeks start on Monday, the first one before the start
+        self.assertEqual(data[0], {'date': '2024-12-30', 'value': 200.0})
+        self.assertEqual(len(data), 5)
+
+    def test_empty_buckets_are_filled(self):
+        data = self.get(type='expense', start='2025-01-04', end='2025-01-08', granularity='day')
+
+        self.assertEqual(data, [{'date': f'2025-01-0{day}', 'value': 30.0 if day == 5 else 0}
+                                for day in range(4, 9)])
+        # Nothing at all in the range still gives every bucket
+        self.assertEqual(self.get(type='expense', start='2030-01-01', end='2030-12-31'),
+                         [{'date': f'2030-{month:02d}', 'value': 0} for month in range(1, 13)])
+
+    def test_invalid_ranges(self):
+        for params in [{'start': '2025-01-01'}, {'start': '2025-01-01', 'end': '2025-02-30'},
+                       {'start': '2025-02-01', 'end': '2025-01-01'},
+                       {'start': '2025-01-01', 'end': '2025-12-31', 'granularity': 'hour'},
+                       {'type': 'cumulative', 'granularity': 'hour'}]:
+            data = self.get(status=400, **{'type': 'expense', **params})
+            self.assertIn('detail', data)
+
+    def test_points_are_bounded(self):
+        with mock.patch('record.views.trend.RecordTrendView.max_points', 10):
+            self.assertEqual(len(self.get(type='expense', start='2025-01-01', end='2025-01-11',
+                                          granularity='day')), 11)
+            data = self.get(status=400, type='expense', start='2025-01-01', end='2025-01-12',
+                            granularity='day')
+            self.assertEqual(data['detail'], 'Range too long, at most 10 points per series.')
+            self.get(type='expense', start='2025-01-01', end='2025-12-31', granularity='quarter')
+
+    def test_balance_opens_with_everything_before_the_window(self):
+        data = self.get(type='balance', timeframe='2025-03')
+        self.assertEqual((data[0]['value'], data[19]['value'], data[-1]['value']), (270.0, 220.0, 220.0))
+
+        data = self.get(type='balance', start='2025-01-06', end='2025-01-07', granularity='day')
+        self.assertEqual(data, [{'date': '2025-01-06', 'value': 270.0},
+                                {'date': '2025-01-07', 'value': 270.0}])
+
+    def test_cumulative_runs_over_the_whole_history(self):
+        self.assertEqual(self.get(type='cumulative'), [
+            {'date': '2024-12', 'value': 100.0}, {'date': '2025-01', 'value': 270.0},
+            {'date': '2025-02', 'value': 270.0}, {'date': '2025-03', 'value': 220.0}])
+        self.assertEqual(self.get(type='cumulative', granularity='quarter'), [
+            {'date': '2024-Q4', 'value': 100.0}, {'date': '2025-Q1', 'value': 220.0}])
+
+    def test_monthly_data_balance(self):
+        data = self.get('/record/monthly-data/')
+
+        self.assertEqual(data, [
+            {'month': '2024-12', 'monthly_income': '100.00', 'monthly_expense': None, 'balance': '100.00'},
+            {'month': '2025-01', 'monthly_income': '200.00', 'monthly_expense': '-30.00',
+             'balance': '270.00'},
+            {'month': '2025-03', 'monthly_income': None, 'monthly_expense': '-50.00', 'balance': '220.00'}])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CombinedListViewTests(TestCase):
+    url = '/record/combined/'
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user, self.book, self.asset = make_book('owner')
+        self.wallet = Asset.objects.create(group=self.asset.group, name='Wallet')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Five days, with two records at the same moment on the third
+        for day in range(1, 6):
+            moment = datetime(2025, 1, day, 12, tzinfo=dt_timezone.utc)
+            Record.objects.create(book=self.book, type='expense', category='Food',
+                                  amount=Decimal(f'{day}.00'), date=moment)
+            if day == 3:
+                Record.objects.create(book=self.book, type='income', category='Salary',
+                                      amount=Decimal('50.00'), date=moment)
+            if day % 2:
+                Transfer.objects.create(book=self.book, from_asset=self.asset, to_asset=self.wallet,
+                                        amount=Decimal('1.00'), date=moment)
+
+    def entries(self, days):
+        return [(day['date'], entry['type'], entry['id'])
+                for day in days for entry in day['records']]
+
+    def test_cursor_pages_cover_the_feed_once(self):
+        everything = self.client.get(self.url, {'book_id': self.book.pk}).json()['results']
+
+        pages, cursor = [], None
+        while True:
+            params = {'book_id': self.book.pk, 'pagination': 'cursor', 'size': 2}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(self.url, params).json()
+            pages.append(data['results'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual([day['date'] for page in pages for day in page],
+                         ['2025-01-05', '2025-01-04', '2025-01-03', '2025-01-02', '2025-01-01'])
+        self.assertEqual(self.entries(day for page in pages for day in page),
+                         self.entries(everything))
+        self.assertEqual(len(self.entries(everything)), 9)
+
+    def test_day_sums(self):
+        days = self.client.get(self.url, {'book_id': self.book.pk}).json()['results']
+        third = next(day for day in days if day['date'] == '2025-01-03')
+        self.assertEqual((third['sum_of_income'], third['sum_of_expense']), ('50.00', '-3.00'))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'book_id': self.book.pk, 'pagination': 'cursor',
+                                              'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ExportRecordsViewTests(TestCase):
+
+    def setUp(self):
+        self.user, self.book, self.asset = make_book('owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Record.objects.create(book=self.book, asset=self.asset, amount=Decimal('-7.50'),
+                              date=datetime.fromisoformat('2025-01-01T03:00:00Z'),
+                              type='expense', category='Food')
+
+    def export(self, output, zone):
+        response = self.client.get('/record/export/', {'book_id': self.book.pk, 'output': output},
+                                   HTTP_X_TIMEZONE=zone)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_dates_are_in_the_request_timezone(self):
+        for output in ['jsonl', 'csv']:
+            with self.subTest(output=output):
+                self.assertIn('2024-12-31T22:00:00', self.export(output, 'America/New_York'))
+                self.assertIn('2025-01-01T12:00:00', self.export(output, 'Asia/Tokyo'))
+        self.assertEqual(timezone.get_current_timezone_name(), 'UTC')
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RunSchedulesTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        self.user, self.book, self.asset = make_book('owner')
+
+    def schedule(self, start):
+        return ScheduledRecord.objects.create(
+            book=self.book, asset=self.asset, type='expense', category='Rent',
+            amount=Decimal('-10.00'), frequency='daily', start_date=start)
+
+    def test_run_without_records_invalidates_the_book(self):
+        now = timezone.now()
+        schedule = self.schedule(now + timedelta(days=3))
+        version = book_version(self.book.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            errors = run_schedules([schedule], now)
+
+        self.assertEqual(errors, {})
+        self.assertFalse(Record.objects.filter(created_by_schedule=schedule).exists())
+        self.assertNotEqual(book_version(self.book.pk), version)
+
+    def test_run_catches_up_and_updates_the_balance(self):
+        now = timezone.now()
+        schedule = self.schedule(now - timedelta(days=2, hours=1))
+        schedule.next_occurrence = schedule.start_date
+        schedule.save()
+        self.asset.refresh_from_db()
+        balance = self.asset.balance
+
+        with self.captureOnCommitCallbacks(execute=True):
+            run_schedules([schedule], now)
+
+        self.assertEqual(Record.objects.filter(created_by_schedule=schedule).count(), 3)
+        self.asset.refresh_from_db()
+        self.assertEqual(self.asset.balance, balance - Decimal('30.00'))
+        schedule.refresh_from_db()
+        self.assertGreater(schedule.next_occurrence, now)
+
+
+def schedule_fields(frequency, num_of_days=1, week_days=(), month_day=None, end_date=None):
+    return SimpleNamespace(frequency=frequency, num_of_days=num_of_days, week_days=list(week_days),
+                           month_day=month_day, end_date=end_date)
+
+
+def stepped_occurrence(schedule, current):
+    """The next occurrence found by stepping through the calendar, for comparison."""
+    if schedule.frequency == 'daily':
+        return current + timedelta(days=schedule.num_of_days)
+    if schedule.frequency == 'weekly':
+        current += timedelta(days=1)
+        while current.weekday() not in schedule.week_days:
+            current += timedelta(days=1)
+        return current
+    # Monthly on month_day, clamped to the length of the month
+    target = current.replace(day=min(schedule.month_day, monthrange(current.year, current.month)[1]))
+    if target > current:
+        return target
+    following = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return following.replace(day=min(schedule.month_day, monthrange(following.year, following.month)[1]))
+
+
+class RecurrenceTests(SimpleTestCase):
+    start = datetime(2025, 1, 31, 9, 30, tzinfo=dt_timezone.utc)
+
+    def dates(self, schedule, count, start=None):
+        return [moment.date().isoformat()
+                for moment in recurrence.next_occurrences(schedule, start or self.start, count)]
+
+    def test_matches_stepping_through_the_calendar(self):
+        schedules = [schedule_fields('daily', num_of_days=3),
+                     schedule_fields('weekly', week_days=[0, 4]),
+                     schedule_fields('weekly', week_days=[6]),
+                     schedule_fields('monthly', month_day=31),
+                     schedule_fields('monthly', month_day=15)]
+        for schedule in schedules:
+            for offset in range(0, 400, 37):
+                start = self.start + timedelta(days=offset)
+                expected, current = [], start
+                for _ in range(30):
+                    current = stepped_occurrence(schedule, current)
+                    expected.append(current)
+                with self.subTest(schedule=vars(schedule), start=start):
+                    self.assertEqual(recurrence.next_occurrences(schedule, start, 30), expected)
+
+    def test_month_end_is_clamped_without_drifting(self):
+        self.assertEqual(self.dates(schedule_fields('monthly', month_day=31), 4),
+                         ['2025-02-28', '2025-03-31', '2025-04-30', '2025-05-31'])
+        # Without month_day, every occurrence is counted from the start date
+        self.assertEqual(self.dates(schedule_fields('monthly'), 3),
+                         ['2025-02-28', '2025-03-31', '2025-04-30'])
+        self.assertEqual(self.dates(schedule_fields('annually'), 2,
+                                    start=datetime(2024, 2, 29, tzinfo=dt_timezone.utc)),
+                         ['2025-02-28', '2026-02-28'])
+
+    def test_stops_at_end_date(self):
+        schedule = schedule_fields('daily', num_of_days=7, end_date=self.start + timedelta(days=20))
+        self.assertEqual(self.dates(schedule, 10), ['2025-02-07', '2025-02-14'])
+
+    def test_occurrences_until(self):
+        schedule = schedule_fields('daily')
+        occurrences, following = recurrence.occurrences_until(
+            schedule, self.start, self.start + timedelta(days=2, hours=1), limit=10)
+        self.assertEqual(len(occurrences), 3)
+        self.assertEqual(following, self.start + timedelta(days=3))
+
+        # The limit leaves the rest for the next run
+        occurrences, following = recurrence.occurrences_until(
+            schedule, self.start, self.start + timedelta(days=30), limit=5)
+        self.assertEqual(len(occurrences), 5)
+        self.assertEqual(following, self.start + timedelta(days=5))
+
+        # Nothing follows the end date
+        schedule.end_date = self.start + timedelta(days=1)
+        occurrences, following = recurrence.occurrences_until(
+            schedule, self.start, self.start + timedelta(days=30), limit=10)
+        self.assertEqual((len(occurrences), following), (2, None))
+
+    def test_invalid_schedules(self):
+        self.assertIsNone(recurrence.nth_occurrence(schedule_fields('hourly'), self.start, 1))
+        with self.assertRaises(ValueError):
+            recurrence.nth_occurrence(schedule_fields('monthly', month_day=32), self.start, 1)
+        expansions, errors = recurrence.expand(
+            [SimpleNamespace(id=1, next_occurrence=self.start, **vars(schedule_fields('monthly', month_day=0))),
+             SimpleNamespace(id=2, next_occurrence=self.start, **vars(schedule_fields('monthly', month_day=40)))],
+            self.start, limit=10)
+        self.assertEqual((list(expansions), list(errors)), ([1], [2]))
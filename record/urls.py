@@ -5,7 +5,9 @@ from . import views
 urlpatterns = [
     path('all/', views.all_records_view),
     path('tax-only/', views.tax_only_records_view),
+    path('export/', views.export_records_view, name='record-export'),
     path('record/', views.RecordList.as_view()),
+    path('record/bulk/', views.RecordBulkCreate.as_view(), name='record-bulk'),
     path('record/<int:pk>/', views.RecordDetail.as_view()),
     path('transfer/', views.TransferList.as_view()),
     path('transfer/<int:pk>/', views.TransferDetail.as_view()),
@@ -24,6 +26,8 @@ urlpatterns = [
          views.ScheduledRecordResume.as_view(), name='scheduled-resume'),
     path('scheduled/<int:pk>/execute/',
          views.ScheduledRecordExecute.as_view(), name='scheduled-execute'),
+    path('scheduled/<int:pk>/previews/',
+         views.ScheduledRecordPreviews.as_view(), name='scheduled-previews'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
@@ -1,7 +1,17 @@
-from rest_framework import generics
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import generics, status
+from rest_framework.views import APIView
+from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from asset.models import Asset
+from asset.utils import adjust_balances
+from book.cache import bump_book_versions
+from book.models import Book
 from record.models import Record, Transfer
-from record.serializers import RecordSerializer, TransferSerializer
+from record.summary import record_summary_deltas, apply_summary_deltas
+from record.serializers import RecordSerializer, RecordBulkItemSerializer, TransferSerializer
 
 
 class RecordList(generics.ListCreateAPIView):
@@ -14,6 +24,85 @@ class RecordList(generics.ListCreateAPIView):
     serializer_class = RecordSerializer
 
 
+class RecordBulkCreate(APIView):
+    """
+    Create many Records in one request, e.g. a bank statement import.
+    Valid rows are inserted, invalid rows are reported back by index.
+    """
+    permission_classes = [IsAuthenticated]
+    max_records = 5000
+    batch_size = 500
+
+    def post(self, request):
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({'error': 'Expected a non-empty list of records.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > self.max_records:
+            return Response({'error': f'At most {self.max_records} records can be imported at once.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Resolve every referenced book and asset of the user with one query each
+        book_ids, asset_ids = set(), set()
+        for row in rows:
+            if isinstance(row, dict):
+                book_ids.add(str(row.get('book')))
+                asset_ids.add(str(row.get('asset')))
+        book_ids = {int(pk) for pk in book_ids if pk.isdigit()}
+        asset_ids = {int(pk) for pk in asset_ids if pk.isdigit()}
+        context = {
+            'request': request,
+            'book_ids': set(Book.objects.filter(pk__in=book_ids, user=request.user)
+                            .values_list('pk', flat=True)),
+            # asset id: id of its book
+            'asset_books': dict(Asset.objects.filter(pk__in=asset_ids, group__book__user=request.user)
+                                .values_list('pk', 'group__book_id')),
+        }
+
+        records, errors = [], []
+        for index, row in enumerate(rows):
+            serializer = RecordBulkItemSerializer(data=row, context=context)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            data = serializer.validated_data
+            record = Record(
+                book_id=data.pop('book', None),
+                asset_id=data.pop('asset', None),
+                **data
+            )
+            # bulk_create skips Record.save(), so apply its normalisation here
+            if record.date and timezone.is_naive(record.date):
+                record.date = timezone.make_aware(
+                    record.date, timezone.get_current_timezone())
+            if record.type == 'expense' and record.amount > 0:
+                record.amount = -record.amount
+            records.append(record)
+
+        if not records:
+            return Response({'created': 0, 'records': [], 'errors': errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        deltas = defaultdict(int)
+        for record in records:
+            if record.asset_id:
+                deltas[record.asset_id] += record.amount
+
+        with transaction.atomic():
+            created = Record.objects.bulk_create(
+                records, batch_size=self.batch_size)
+            apply_summary_deltas(record_summary_deltas(created))
+            # The asset rows stay locked until commit, so update them last
+            adjust_balances(deltas)
+            bump_book_versions(record.book_id for record in created)
+
+        return Response({
+            'created': len(created),
+            'records': RecordSerializer(created, many=True).data,
+            'errors': errors,
+        }, status=status.HTTP_201_CREATED)
+
+
 class RecordDetail(generics.RetrieveUpdateDestroyAPIView):
     """
     Retrieve, update or delete a Record instance.
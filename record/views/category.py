@@ -4,9 +4,13 @@ from rest_framework.exceptions import ValidationError
 from decimal import Decimal
 from collections import defaultdict
 from itertools import cycle
+from book.cache import BookCacheMixin, BookETagMixin
 from record.models import Record
-from django.db.models import Q
-from datetime import datetime, timedelta
+from record.analytics import day_range
+from record.summary import summary_model, use_summaries
+from django.db.models import Q, F, Sum, Count
+from django.db.models.functions import Abs
+from datetime import date, datetime, timedelta
 import re
 import calendar
 
@@ -16,8 +20,12 @@ colors = ("#519DE9", "#7CC674", "#73C5C5", "#8481DD", "#F6D173", "#EF9234", "#A3
           "#002F5D", "#23511E", "#003737", "#2A265F", "#C58C00", "#8F4700", "#2C0000", "#6A6E73",
           "#8BC1F7", "#BDE2B9", "#A2D9D9", "#B2B0EA", "#F9E0A2", "#F4B678", "#C9190B", "#F0F0F0")
 
+OTHER_CATEGORY = 'Other'
 
-class CategoriedRecordView(generics.ListAPIView):
+
+class CategoriedRecordView(BookETagMixin, BookCacheMixin, generics.ListAPIView):
+    cache_endpoint = 'category'
+    use_summaries = False
 
     def get_queryset(self):
         book_id = self.request.query_params.get('book_id')
@@ -41,24 +49,83 @@ class CategoriedRecordView(generics.ListAPIView):
         if timeframe:
             filters &= self.build_timeframe_filter(timeframe)
 
+        # Read the summaries when they add up to the request's days, by
+        # month unless a week is asked for
+        self.use_summaries = use_summaries(self.cache_endpoint, book_id)
+        if self.use_summaries:
+            period = 'day' if timeframe and '@' in timeframe else 'month'
+            return summary_model(period).objects.annotate(date=F('start')).filter(filters)
+
         # Add the exclusion of ScheduledRecord to the filters
-        filters &= Q(scheduledrecord__isnull=True)
+        filters &= Q(is_template=False)
         return Record.objects.filter(filters)
 
+    def get_category_rows(self, queryset):
+        """
+        Totals per (category, subcategory) as dicts with total_amount and
+        record_count.
+        """
+        if self.use_summaries:
+            return queryset.values('category', 'subcategory').annotate(
+                total_amount=Sum('abs_total'),
+                record_count=Sum('count')
+            ).order_by()
+
+        return queryset.values('category', 'subcategory').annotate(
+            total_amount=Sum(Abs('amount')),
+            record_count=Count('id')
+        ).order_by()
+
+    def get_top_n(self):
+        top_n = self.request.query_params.get('top_n')
+        if not top_n:
+            return None
+        if not top_n.isdigit() or int(top_n) < 1:
+            raise ValidationError(
+                {"detail": "top_n must be a positive integer."})
+        return int(top_n)
+
+    def merge_into_other(self, categories, top_n):
+        """
+        Keep the top_n largest categories and fold the rest into an "Other"
+        category, with each folded category listed as one of its subcategories.
+        """
+        ranked = sorted(categories.items(),
+                        key=lambda item: item[1]['total_amount'], reverse=True)
+        kept = dict(ranked[:top_n])
+        if len(ranked) <= top_n:
+            return kept
+
+        other = kept.setdefault(OTHER_CATEGORY, self.new_category())
+        for category, cat_data in ranked[top_n:]:
+            other['total_amount'] += cat_data['total_amount']
+            other['record_count'] += cat_data['record_count']
+            other['subcategories'][category]['total_amount'] += cat_data['total_amount']
+            other['subcategories'][category]['record_count'] += cat_data['record_count']
+        return kept
+
+    def new_category(self):
+        return {
+            'total_amount': Decimal('0.00'),
+            'record_count': 0,
+            'subcategories': defaultdict(lambda: {
+                'total_amount': Decimal('0.00'),
+                'record_count': 0
+            })
+        }
+
     def build_timeframe_filter(self, timeframe):
         try:
             # Year only: YYYY
             if re.match(r'^\d{4}$', timeframe):
                 year = int(timeframe)
-                return Q(date__year=year)
+                return day_range(date(year, 1, 1), date(year, 12, 31))
             
             # Year-Month: YYYY-MM
             elif re.match(r'^\d{4}-(?:0?[1-9]|1[0-2])$', timeframe):
                 year, month = map(int, timeframe.split('-'))
                 _, last_day = calendar.monthrange(year, month)
-                start_date = datetime(year, month, 1).date()
-                end_date = datetime(year, month, last_day).date()
-                return Q(date__range=[start_date, end_date])
+                return day_range(date(year, month, 1), date(year, month, last_day))
             
             # Year-Week: YYYY@WW
             elif re.match(r'^\d{4}@(?:[1-9]|0[1-9]|[1-4]\d|5[0-3])$', timeframe):
@@ -66,8 +133,7 @@ class CategoriedRecordView(generics.ListAPIView):
                 # Pad week number to ensure it has two digits
                 week_str = f"{week:02d}"
                 start_date = datetime.strptime(f'{year}-W{week_str}-1', "%Y-W%W-%w").date()
-                end_date = start_date + timedelta(days=6)
-                return Q(date__range=[start_date, end_date])
+                return day_range(start_date, start_date + timedelta(days=6))
             
             else:
                 raise ValidationError({
@@ -81,27 +147,29 @@ class CategoriedRecordView(generics.ListAPIView):
 
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
+        top_n = self.get_top_n()
 
         total_amount = Decimal('0.00')
-        categories = defaultdict(lambda: {
-            'total_amount': Decimal('0.00'),
-            'record_count': 0,
-            'subcategories': defaultdict(lambda: {
-                'total_amount': Decimal('0.00'),
-                'record_count': 0
-            })
-        })
+        categories = defaultdict(self.new_category)
 
-        for record in queryset:
-            category = record.category
-            subcategory = record.subcategory
-            amount = abs(record.amount)
+        for row in self.get_category_rows(queryset):
+            category = row['category']
+            subcategory = row['subcategory']
+            amount = row['total_amount']
+            count = row['record_count']
 
             total_amount += amount
             categories[category]['total_amount'] += amount
-            categories[category]['record_count'] += 1
+            categories[category]['record_count'] += count
             categories[category]['subcategories'][subcategory]['total_amount'] += amount
-            categories[category]['subcategories'][subcategory]['record_count'] += 1
+            categories[category]['subcategories'][subcategory]['record_count'] += count
+
+        if top_n:
+            categories = self.merge_into_other(categories, top_n)
+
+        # Largest first, so colors stay stable between requests
+        categories = dict(sorted(categories.items(),
+                                 key=lambda item: item[1]['total_amount'], reverse=True))
 
         color_cycle = cycle(colors)
         category_data = []
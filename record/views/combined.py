@@ -1,18 +1,22 @@
-from itertools import chain, groupby
-from operator import attrgetter
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Q
-from rest_framework.response import Response
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.filters import SearchFilter
+from book.cache import BookETagMixin
 from record.models import Record, Transfer
 from record.serializers import GroupedDaySerializer
-from record.pagination import RecordListCreatePagination
+from record.pagination import RecordListCreatePagination, CombinedCursorPagination
 from record.filters import CombinedFilter
+from record.feed import CombinedFeed
 
 
-class CombinedListView(generics.ListAPIView):
+class CombinedListView(BookETagMixin, generics.ListAPIView):
+    """
+    Records and transfers of a book grouped by day, newest first, merged in
+    the database (see record.feed). Pass ?pagination=cursor for keyset pages
+    that follow the returned next_cursor.
+    """
     permission_classes = [IsAuthenticated]
     pagination_class = RecordListCreatePagination
     serializer_class = GroupedDaySerializer
@@ -20,14 +24,14 @@ class CombinedListView(generics.ListAPIView):
     filterset_class = CombinedFilter
     search_fields = ['note', 'amount', 'category', 'subcategory']
 
-    def get_queryset(self):
+    def get_querysets(self):
+        """The filtered records and transfers, unevaluated."""
         user = self.request.user
         book_id = self.request.query_params.get('book_id')
         asset_ids = self.request.query_params.getlist('asset')
 
-        records = Record.objects.filter(book__user=user, book__id=book_id).exclude(
-            scheduledrecord__isnull=False
-        )
+        records = Record.objects.filter(
+            book__user=user, book__id=book_id, is_template=False)
         transfers = Transfer.objects.filter(book__user=user, book__id=book_id)
 
         if asset_ids:
@@ -74,36 +78,21 @@ class CombinedListView(generics.ListAPIView):
         if date_before:
             transfers = transfers.filter(date__lte=date_before)
 
-        # Combine and sort the querysets
-        combined = sorted(
-            chain(filtered_records, transfers),
-            key=attrgetter('date'),
-            reverse=True
-        )
-
-        # Group by date
-        grouped_data = []
-        for date, group in groupby(combined, key=lambda x: x.date.date()):
-            group_list = list(group)
-            sum_of_income = sum(r.amount for r in group_list if isinstance(
-                r, Record) and r.type == 'income')
-            sum_of_expense = sum(r.amount for r in group_list if isinstance(
-                r, Record) and r.type == 'expense')
-
-            grouped_data.append({
-                'date': date,
-                'records': group_list,
-                'sum_of_income': sum_of_income,
-                'sum_of_expense': sum_of_expense
-            })
+        return filtered_records, transfers
 
-        return grouped_data
+    def get_queryset(self):
+        records, transfers = self.get_querysets()
+        return CombinedFeed(records, transfers)
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        page = self.paginate_queryset(queryset)
-        if page is not None:
+        feed = self.get_queryset()
+
+        if request.query_params.get('pagination') == 'cursor':
+            paginator = CombinedCursorPagination()
+            page = paginator.paginate_feed(feed, request)
             serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+            return paginator.get_paginated_response(serializer.data)
+
+        page = self.paginate_queryset(feed)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
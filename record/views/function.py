@@ -1,10 +1,17 @@
 from datetime import datetime
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from django.utils.timezone import make_aware
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from book.models import Book
+from record.analytics import in_range
+from record.export import FORMATS, export_rows, in_chunks, in_timezone
 from record.models import Record, Transfer
 from record.serializers import RecordSerializer, TransferSerializer
+from record.tax import tax_records
 from record.utils import group_records_by_date
 
 
@@ -65,15 +72,59 @@ def tax_only_records_view(request):
         except ValueError:
             return Response({'error': 'Invalid date format. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        records = Record.objects.filter(
-            book__id=book_id, date__range=[start_date, end_date], is_marked_tax_return=True).order_by(f'{"-" if is_decreasing else ""}date')
+        records = tax_records(book_id).filter(
+            date__range=[start_date, end_date]).order_by(f'{"-" if is_decreasing else ""}date')
 
-        serializer = RecordSerializer(records, many=True)
+        # One query, instead of exists() and a second one
+        data = RecordSerializer(records, many=True).data
 
-        if records.exists():
+        if data:
             if group_by_date:
-                group_data = group_records_by_date(serializer.data)
+                group_data = group_records_by_date(data)
                 return Response(group_data, status=status.HTTP_200_OK)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(data, status=status.HTTP_200_OK)
         else:
             return Response({'error': 'No record found'}, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_records_view(request):
+    """
+    Stream every record and transfer of a book in date order, as JSON lines
+    (output=jsonl, the default) or CSV (output=csv). start_date and
+    end_date, both YYYY-MM-DD, optionally limit it to those days.
+    """
+    book_id = request.query_params.get('book_id')
+    # Not ?format=, DRF picks the renderer with it
+    export_format = request.query_params.get('output', 'jsonl')
+    start_date = request.query_params.get('start_date')
+    end_date = request.query_params.get('end_date')
+    is_decreasing = request.query_params.get('is_decreasing', 'false').lower() in [
+        'true', 'yes', 't']
+
+    if export_format not in FORMATS:
+        return Response({'error': f'Invalid output. Must be one of: {", ".join(FORMATS)}.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if not book_id or not book_id.isdigit() or \
+            not Book.objects.filter(pk=book_id, user=request.user).exists():
+        return Response({'error': 'Book not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    records = Record.objects.filter(book_id=book_id, is_template=False)
+    transfers = Transfer.objects.filter(book_id=book_id)
+    if start_date or end_date:
+        try:
+            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            return Response({'error': 'Both start_date and end_date are required, as YYYY-MM-DD.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        records = in_range(records, start_date, end_date)
+        transfers = in_range(transfers, start_date, end_date)
+
+    write_lines, content_type = FORMATS[export_format]
+    chunks = in_chunks(write_lines(export_rows(records, transfers, is_decreasing)))
+    response = StreamingHttpResponse(
+        in_timezone(chunks, timezone.get_current_timezone()), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="book-{book_id}.{export_format}"'
+    return response
@@ -1,38 +1,49 @@
-from django.db.models import Sum, F, Q
-from django.db.models.functions import TruncMonth
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
+from record.analytics import cumulative_totals, day_start
 from record.models import Record
+from record.summary import summary_queryset, use_summaries
+from book.cache import BookCacheMixin, BookETagMixin
 from book.models import Book
 from record.serializers import MonthlyDataSerializer
 
 
-class MonthlyDataView(ListAPIView):
+class MonthlyDataView(BookETagMixin, BookCacheMixin, ListAPIView):
+    cache_endpoint = 'monthly-data'
     serializer_class = MonthlyDataSerializer
 
     def get_queryset(self):
         book_id = self.request.query_params.get('book_id')
 
-        queryset = Record.objects.filter(
-            scheduledrecord__isnull=True
-        )
-
-        if book_id:
-            try:
-                queryset = queryset.filter(book_id=book_id)
-            except Book.DoesNotExist:
-                raise ValidationError({"Book not found"})
-
-        queryset = queryset.annotate(month=TruncMonth('date')).values('month')
-        queryset = queryset.annotate(
-            monthly_income=Sum('amount', filter=Q(type='income')),
-            monthly_expense=Sum('amount', filter=Q(type='expense'))
-        )
-        queryset = queryset.order_by('month')
+        # Read the month summaries when they add up to the request's months
+        if use_summaries(self.cache_endpoint, book_id):
+            queryset = summary_queryset(book_id, 'month')
+        else:
+            queryset = Record.objects.filter(is_template=False)
+
+            if book_id:
+                try:
+                    queryset = queryset.filter(book_id=book_id)
+                except Book.DoesNotExist:
+                    raise ValidationError({"Book not found"})
+
         return queryset
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+        # Months with records, each with the balance of the book after it
+        rows = [{
+            'month': month,
+            'monthly_income': income,
+            'monthly_expense': expense,
+            'balance': balance
+        } for month, value, income, expense, balance
+            in cumulative_totals(self.get_queryset(), 'month') if value is not None]
+        serializer = self.get_serializer(
+            [self.as_datetime(row) for row in rows], many=True)
         return Response(serializer.data)
+
+    def as_datetime(self, row):
+        # Months are dates, the serializer expects a datetime
+        row['month'] = day_start(row['month'])
+        return row
@@ -4,14 +4,17 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Count, Prefetch
 from django.db import transaction
+from book.cache import BookETagMixin
 from record.models import ScheduledRecord, Record
 from record.serializers import ScheduledRecordSerializer
 from record.permissions import IsOwner
 
 
-class ScheduledRecordList(generics.ListCreateAPIView):
+class ScheduledRecordList(BookETagMixin, generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated, IsOwner]
     serializer_class = ScheduledRecordSerializer
+    book_id_param = 'book'
+    user_scope = True
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -130,6 +133,40 @@ class ScheduledRecordResume(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+class ScheduledRecordPreviews(APIView):
+    """Upcoming occurrences of a schedule, ?count= of them (default 52)."""
+    permission_classes = [IsAuthenticated, IsOwner]
+    max_count = 520
+
+    def get(self, request, pk):
+        try:
+            count = int(request.query_params.get('count', 52))
+        except ValueError:
+            return Response(
+                {'error': 'count must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 1 <= count <= self.max_count:
+            return Response(
+                {'error': f'count must be between 1 and {self.max_count}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            record = ScheduledRecord.objects.get(pk=pk, book__user=request.user)
+        except ScheduledRecord.DoesNotExist:
+            return Response(
+                {'error': 'Schedule not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return Response({
+            'id': record.id,
+            'status': record.status,
+            'occurrences': record.previews(count)
+        })
+
+
 # API won't let you execute a scheduled task before its scheduled time
 class ScheduledRecordExecute(APIView):
     permission_classes = [IsAuthenticated, IsOwner]
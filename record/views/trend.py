@@ -1,20 +1,46 @@
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
-from django.db.models import Sum
-from django.db.models.functions import TruncDate, TruncMonth
+from book.cache import BookCacheMixin, BookETagMixin
 from book.models import Book
+from record.analytics import (GRANULARITIES, GRANULARITY_DAYS, bucket_label, bucket_totals,
+                              cumulative_totals, opening_balance)
 from record.models import Record
-from datetime import datetime, timedelta
+from record.summary import summary_queryset, use_summaries
+from datetime import date, datetime, timedelta
 from calendar import monthrange
 
 
-class RecordTrendView(generics.ListAPIView):
-    def get_queryset(self):
+def summary_period(granularity, start=None, end=None):
+    """
+    'month' when buckets of a granularity, between start and end if given,
+    are made of whole months, so month summaries can be summed instead of
+    day ones.
+    """
+    if granularity in ('day', 'week'):
+        return 'day'
+    if start and start.day != 1:
+        return 'day'
+    if end and (end + timedelta(days=1)).day != 1:
+        return 'day'
+    return 'month'
+
+
+class RecordTrendView(BookETagMixin, BookCacheMixin, generics.ListAPIView):
+    cache_endpoint = 'trend'
+    max_points = 2000
+    use_summaries = False
+
+    def get_queryset(self, period='day'):
+        """
+        The records to sum, or their summaries by day or by month when they
+        add up to the request's days.
+        """
         book_id = self.request.query_params.get('book_id')
-        queryset = Record.objects.filter(
-            scheduledrecord__isnull=True
-        )
+        if self.use_summaries:
+            return summary_queryset(book_id, period)
+
+        queryset = Record.objects.filter(is_template=False)
 
         if book_id:
             try:
@@ -23,108 +49,129 @@ class RecordTrendView(generics.ListAPIView):
                 raise ValidationError({"Book not found"})
         return queryset
 
-    def list(self, request, *args, **kwargs):
-        filter_type = request.query_params.get('type', 'balance')
-        timeframe = request.query_params.get('timeframe', '')
-
-        queryset = self.get_queryset()
-
+    def typed_queryset(self, filter_type, period='day'):
+        queryset = self.get_queryset(period)
         if filter_type in ['income', 'expense']:
             queryset = queryset.filter(type=filter_type)
+        return queryset
 
-        # Parse timeframe
-        if '@' in timeframe:
-            year, week = timeframe.split('@')
-            return self.get_week_data(queryset, filter_type, int(year), int(week))
-        elif '-' in timeframe:
-            year, month = timeframe.split('-')
-            return self.get_month_data(queryset, filter_type, int(year), int(month))
-        elif timeframe.isdigit():
-            return self.get_year_data(queryset, filter_type, int(timeframe))
-        else:
-            raise ValidationError({"detail": "Invalid timeframe format"})
-
-    def get_year_data(self, queryset, filter_type, year):
-        queryset = queryset.filter(date__year=year)
-        data = queryset.annotate(month=TruncMonth('date')) \
-            .values('month') \
-            .annotate(value=Sum('amount')) \
-            .order_by('month')
-
-        data_dict = {item['month'].month: item['value'] for item in data}
-        result = []
-        running_balance = 0
-
-        for month in range(1, 13):
-            value = data_dict.get(month, 0)
-            if filter_type == 'balance':
-                running_balance += value
-                result.append({
-                    'date': f"{year}-{month:02d}",
-                    'value': abs(running_balance)
-                })
-            else:
-                result.append({
-                    'date': f"{year}-{month:02d}",
-                    'value': abs(value)
-                })
-
-        return Response(result)
-
-    def get_month_data(self, queryset, filter_type, year, month):
-        queryset = queryset.filter(date__year=year, date__month=month)
-        data = queryset.annotate(day=TruncDate('date')) \
-            .values('day') \
-            .annotate(value=Sum('amount')) \
-            .order_by('day')
-
-        _, days_in_month = monthrange(year, month)
-        data_dict = {item['day'].day: item['value'] for item in data}
+    def list(self, request, *args, **kwargs):
+        filter_type = request.query_params.get('type', 'balance')
+        self.use_summaries = use_summaries(
+            self.cache_endpoint, request.query_params.get('book_id'))
+
+        # The running balance over the whole history of the book
+        if filter_type == 'cumulative':
+            granularity = self.parse_granularity()
+            queryset = self.typed_queryset(filter_type, summary_period(granularity))
+            return Response(self.get_cumulative_data(queryset, granularity))
+
+        # An explicit range takes precedence over timeframes
+        if 'start' in request.query_params or 'end' in request.query_params:
+            start, end, granularity = self.parse_range()
+            queryset = self.typed_queryset(
+                filter_type, summary_period(granularity, start, end))
+            return Response(self.get_range_data(
+                queryset, filter_type, start, end, granularity))
+
+        # Several timeframes can be requested at once for dashboards
+        timeframes = request.query_params.getlist('timeframe') or ['']
+        series = {}
+        for timeframe in timeframes:
+            start, end, granularity = self.parse_timeframe(timeframe)
+            queryset = self.typed_queryset(
+                filter_type, summary_period(granularity, start, end))
+            series[timeframe] = self.get_range_data(
+                queryset, filter_type, start, end, granularity)
+        if len(timeframes) == 1:
+            return Response(series[timeframes[0]])
+        return Response(series)
+
+    def parse_timeframe(self, timeframe):
+        """(start, end, granularity) for a year, year-month or year@week timeframe."""
+        try:
+            if '@' in timeframe:
+                year, week = timeframe.split('@')
+                start_date = datetime.strptime(f'{year}-W{week}-1', "%Y-W%W-%w").date()
+                return start_date, start_date + timedelta(days=6), 'day'
+            elif '-' in timeframe:
+                year, month = (int(part) for part in timeframe.split('-'))
+                _, days_in_month = monthrange(year, month)
+                return date(year, month, 1), date(year, month, days_in_month), 'day'
+            elif timeframe.isdigit():
+                year = int(timeframe)
+                return date(year, 1, 1), date(year, 12, 31), 'month'
+        except ValueError:
+            pass
+        raise ValidationError({"detail": "Invalid timeframe format"})
+
+    def parse_range(self):
+        """(start, end, granularity) from the start, end and granularity parameters."""
+        params = self.request.query_params
+        try:
+            start = datetime.strptime(params['start'], "%Y-%m-%d").date()
+            end = datetime.strptime(params['end'], "%Y-%m-%d").date()
+        except (KeyError, ValueError):
+            raise ValidationError(
+                {"detail": "Both start and end are required, as YYYY-MM-DD."})
+        if end < start:
+            raise ValidationError({"detail": "end must not be before start."})
+
+        granularity = params.get('granularity', 'month')
+        if granularity not in GRANULARITIES:
+            raise ValidationError(
+                {"detail": f"Invalid granularity. Must be one of: {', '.join(GRANULARITIES)}."})
+        if (end - start).days / GRANULARITY_DAYS[granularity] > self.max_points:
+            raise ValidationError(
+                {"detail": f"Range too long, at most {self.max_points} points per series."})
+        return start, end, granularity
+
+    def parse_granularity(self):
+        granularity = self.request.query_params.get('granularity', 'month')
+        if granularity not in GRANULARITIES:
+            raise ValidationError(
+                {"detail": f"Invalid granularity. Must be one of: {', '.join(GRANULARITIES)}."})
+        return granularity
+
+    def get_range_data(self, queryset, filter_type, start, end, granularity):
+        rows = bucket_totals(queryset, start, end, granularity)
+        # Balances carry on from everything before the window
+        opening = 0
+        if filter_type in ['balance', 'all']:
+            opening = opening_balance(queryset, start)
+        return self.build_series(rows, granularity, filter_type, opening)
+
+    def get_cumulative_data(self, queryset, granularity):
+        return [{
+            'date': bucket_label(bucket, granularity),
+            'value': abs(balance)
+        } for bucket, _, _, _, balance in cumulative_totals(queryset, granularity)]
+
+    def build_series(self, rows, granularity, filter_type, opening=0):
+        """One point per bucket from bucket_totals, empty buckets counting as zero."""
         result = []
-        running_balance = 0
+        running_balance = opening
 
-        for day in range(1, days_in_month + 1):
-            value = data_dict.get(day, 0)
-            if filter_type == 'balance':
-                running_balance += value
+        for bucket, value, income, expense in rows:
+            label = bucket_label(bucket, granularity)
+            value = value or 0
+            running_balance += value
+            if filter_type == 'all':
                 result.append({
-                    'date': f"{year}-{month:02d}-{day:02d}",
-                    'value': abs(running_balance)
+                    'date': label,
+                    'income': abs(income or 0),
+                    'expense': abs(expense or 0),
+                    'balance': abs(running_balance)
                 })
-            else:
-                result.append({
-                    'date': f"{year}-{month:02d}-{day:02d}",
-                    'value': abs(value)
-                })
-
-        return Response(result)
-
-    def get_week_data(self, queryset, filter_type, year, week):
-        start_date = datetime.strptime(f'{year}-W{week}-1', "%Y-W%W-%w").date()
-        end_date = start_date + timedelta(days=6)
-        queryset = queryset.filter(date__range=[start_date, end_date])
-        data = queryset.annotate(day=TruncDate('date')) \
-            .values('day') \
-            .annotate(value=Sum('amount')) \
-            .order_by('day')
-
-        data_dict = {item['day']: item['value'] for item in data}
-        result = []
-        running_balance = 0
-
-        for i in range(7):
-            current_date = start_date + timedelta(days=i)
-            value = data_dict.get(current_date, 0)
-            if filter_type == 'balance':
-                running_balance += value
+            elif filter_type == 'balance':
                 result.append({
-                    'date': current_date.strftime("%Y-%m-%d"),
+                    'date': label,
                     'value': abs(running_balance)
                 })
             else:
                 result.append({
-                    'date': current_date.strftime("%Y-%m-%d"),
+                    'date': label,
                     'value': abs(value)
                 })
 
-        return Response(result)
+        return result
@@ -0,0 +1,141 @@
+"""
+Cached public keys of the social login providers.
+
+A provider's JWKS is fetched at most once per Cache-Control max-age and
+kept in the Django cache, so all workers share one copy. Each process also
+keeps the parsed keys by kid, and only parses a key set again when the
+shared copy changes. A token signed with an unknown kid (the provider
+rotated its keys) refetches the key set, at most once per
+JWKS_REFRESH_INTERVAL seconds across workers.
+"""
+import re
+import threading
+import time
+import jwt
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+import logging
+logger = logging.getLogger(__name__)
+
+# Shared by all workers, see CACHES
+cache = ConnectionProxy(caches, 'shared')
+
+MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+def max_age(response):
+    """Seconds the response may be kept for, from its Cache-Control header."""
+    match = MAX_AGE.search(response.headers.get('Cache-Control', ''))
+    if match:
+        return max(int(match.group(1)), 1)
+    return settings.JWKS_DEFAULT_TTL
+
+
+def parse_keys(jwks):
+    """Public key objects of a key set, by kid."""
+    keys = {}
+    for jwk in jwks.get('keys', []):
+        try:
+            keys[jwk['kid']] = jwt.PyJWK(jwk).key
+        except (KeyError, jwt.PyJWKError) as e:
+            logger.warning(f"Skipping unusable JWK {jwk.get('kid')}: {e}")
+    return keys
+
+
+class KeySet:
+    """The public keys of one provider, by kid."""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.keys = {}
+        self.expires = 0
+        self.fetched = None
+        self.lock = threading.Lock()
+
+    @property
+    def cache_key(self):
+        return f'jwks:{self.name}'
+
+    @property
+    def refresh_key(self):
+        return f'jwks:{self.name}:refresh'
+
+    def fetch(self):
+        """Fetch the key set from the provider and share it with the other workers."""
+        response = requests.get(self.url, timeout=settings.JWKS_TIMEOUT)
+        response.raise_for_status()
+        ttl = max_age(response)
+        data = {'jwks': response.json(), 'fetched': time.time(), 'expires': time.time() + ttl}
+        try:
+            cache.set(self.cache_key, data, timeout=ttl)
+        except Exception as e:
+            logger.warning(f"Failed to cache {self.name} keys: {e}")
+        return data
+
+    def load(self, data):
+        # Only parse keys again when another worker fetched a new copy
+        if data['fetched'] != self.fetched:
+            self.keys = parse_keys(data['jwks'])
+            self.fetched = data['fetched']
+        self.expires = data['expires']
+
+    def shared(self):
+        try:
+            return cache.get(self.cache_key)
+        except Exception as e:
+            logger.warning(f"Key cache unavailable: {e}")
+            return None
+
+    def may_refresh(self):
+        """Whether this worker may refetch for an unknown kid right now."""
+        try:
+            return cache.add(self.refresh_key, 1, timeout=settings.JWKS_REFRESH_INTERVAL)
+        except Exception:
+            return True
+
+    def get_key(self, kid):
+        """
+        The public key for a kid, or None if the provider has no such key.
+        Raises requests.RequestException if the keys can't be fetched.
+        """
+        if time.time() < self.expires and kid in self.keys:
+            return self.keys[kid]
+
+        with self.lock:
+            if time.time() >= self.expires:
+                data = self.shared()
+                if data is None or time.time() >= data['expires']:
+                    data = self.fetch()
+                self.load(data)
+
+            if kid not in self.keys:
+                data = self.shared()
+                if data is not None and data['fetched'] != self.fetched:
+                    self.load(data)
+                elif self.may_refresh():
+                    logger.info(f"Unknown {self.name} key {kid}, refreshing keys")
+                    self.load(self.fetch())
+
+            return self.keys.get(kid)
+
+
+apple_keys = KeySet('apple', settings.APPLE_JWKS_URL)
+google_keys = KeySet('google', settings.GOOGLE_JWKS_URL)
+
+
+def decode(token, key_set, **options):
+    """
+    Verify a provider's RS256 identity token and return its claims. Raises
+    jwt.InvalidTokenError if the token is invalid or signed with a key the
+    provider doesn't have.
+    """
+    kid = jwt.get_unverified_header(token).get('kid')
+    if not kid:
+        raise jwt.InvalidTokenError('Token has no key id')
+    public_key = key_set.get_key(kid)
+    if public_key is None:
+        raise jwt.InvalidTokenError(f'No matching {key_set.name} public key')
+    return jwt.decode(token, public_key, algorithms=['RS256'], **options)
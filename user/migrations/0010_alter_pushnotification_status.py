@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0009_pushnotification'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pushnotification',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('merged', 'Merged into a digest')], default='pending', max_length=10),
+        ),
+    ]
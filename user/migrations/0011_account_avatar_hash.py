@@ -0,0 +1,43 @@
+# Generated by Django 5.1 on 2026-10-18 19:05
+
+import base64
+import binascii
+import hashlib
+from django.db import migrations, models
+
+
+def hash_avatars(apps, schema_editor):
+    Account = apps.get_model('user', 'Account')
+
+    accounts = []
+    for account in Account.objects.filter(avatar__isnull=False).only('id', 'avatar').iterator(chunk_size=100):
+        avatar = bytes(account.avatar)
+        # Social logins used to store data URIs instead of the image bytes
+        if avatar.startswith(b'data:image') and b';base64,' in avatar:
+            try:
+                avatar = base64.b64decode(avatar.split(b';base64,', 1)[1])
+            except binascii.Error:
+                pass
+        account.avatar = avatar
+        account.avatar_hash = hashlib.sha256(avatar).hexdigest() if avatar else None
+        accounts.append(account)
+        if len(accounts) >= 100:
+            Account.objects.bulk_update(accounts, ['avatar', 'avatar_hash'])
+            accounts = []
+    Account.objects.bulk_update(accounts, ['avatar', 'avatar_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0010_alter_pushnotification_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='avatar_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(hash_avatars, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1 on 2026-10-18 21:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0011_account_avatar_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pushnotification',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed'), ('merged', 'Merged into a digest')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='pushnotification',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='pushnotification',
+            index=models.Index(condition=models.Q(('status', 'sending')), fields=['claimed_at'], name='push_notification_sending_idx'),
+        ),
+    ]
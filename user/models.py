@@ -4,6 +4,7 @@ from django.db.models.signals import post_save, pre_delete
 from django.dispatch import receiver
 from django.conf import settings
 from rest_framework.authtoken.models import Token
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
@@ -20,11 +21,27 @@ class Account(models.Model):
     account_status = models.CharField(max_length=20, default="unverified")
     expo_push_token = models.CharField(max_length=255, blank=True, null=True)
     avatar = models.BinaryField(null=True, blank=True)
+    avatar_hash = models.CharField(max_length=64, null=True, blank=True)
     nickname = models.CharField(
         max_length=100, null=True, blank=True, default="anonymous")
     auth_provider = models.CharField(max_length=20, blank=True, null=True)
     social_id = models.CharField(max_length=255, blank=True, null=True)
 
+    @staticmethod
+    def digest(avatar):
+        """sha256 of avatar bytes, naming one version of an avatar."""
+        return hashlib.sha256(bytes(avatar)).hexdigest() if avatar else None
+
+    def save(self, *args, **kwargs):
+        # Keep avatar_hash in step with the avatar, unless it wasn't loaded
+        update_fields = kwargs.get('update_fields')
+        if 'avatar' not in self.get_deferred_fields() and \
+                (update_fields is None or 'avatar' in update_fields):
+            self.avatar_hash = self.digest(self.avatar)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'avatar_hash'}
+        super().save(*args, **kwargs)
+
     def delete(self, *args, **kwargs):
         """
         Override delete method to ensure proper deletion of user
@@ -59,6 +76,42 @@ class Account(models.Model):
         db_table = 'user_account'
 
 
+class PushNotification(models.Model):
+    """
+    Outbox of Expo push messages. Rows are written in the same transaction
+    as the change they report and sent later, in batches, by
+    user.tasks.dispatch_push_notifications. A worker marks its batch as
+    sending while it talks to Expo, claimed_at telling when.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('merged', 'Merged into a digest'),
+    ]
+
+    token = models.CharField(max_length=255)
+    body = models.CharField(max_length=500)
+    data = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.CharField(max_length=500, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'user_push_notification'
+        indexes = [
+            models.Index(fields=['id'], name='push_notification_pending_idx',
+                         condition=models.Q(status='pending')),
+            models.Index(fields=['claimed_at'], name='push_notification_sending_idx',
+                         condition=models.Q(status='sending')),
+        ]
+
+
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     """Create auth token for new users"""
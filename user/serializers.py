@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.core.files.base import ContentFile
+from django.urls import reverse
 from rest_framework import serializers
 from io import BytesIO
 import base64
@@ -39,6 +40,17 @@ class Base64ImageField(serializers.ImageField):
         return None
 
 
+def avatar_url(account, request=None):
+    """
+    URL of an account's avatar, or None without one. It carries the avatar
+    hash, so a new avatar gets a new URL and clients can cache each for good.
+    """
+    if not account.avatar_hash:
+        return None
+    url = f"{reverse('account_avatar', kwargs={'pk': account.pk})}?v={account.avatar_hash}"
+    return request.build_absolute_uri(url) if request else url
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -59,12 +71,17 @@ class UserSerializer(serializers.ModelSerializer):
 class AccountSerializer(serializers.ModelSerializer):
     user = UserSerializer(required=True)
     account_id = serializers.CharField(allow_null=True)
-    avatar = Base64ImageField(required=False, allow_null=True)
+    avatar = Base64ImageField(required=False, allow_null=True, write_only=True)
+    avatar_url = serializers.SerializerMethodField()
     nickname = serializers.CharField(required=False, allow_blank=True)
 
     class Meta:
         model = Account
         fields = "__all__"
+        read_only_fields = ['avatar_hash']
+
+    def get_avatar_url(self, obj):
+        return avatar_url(obj, self.context.get('request'))
 
     def create(self, validated_data):
         user_data = validated_data.pop('user')
@@ -102,7 +119,7 @@ class AccountSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
-    def compress_image(self, image):
+    def compress_image(self, image, max_dimension=None):
         max_size = 5 * 1024 * 1024  # 5MB
 
         # Compress the image
@@ -110,6 +127,10 @@ class AccountSerializer(serializers.ModelSerializer):
         if img.mode in ("RGBA", "P"):  # Convert to RGB if necessary
             img = img.convert("RGB")
 
+        # Shrink to fit max_dimension, keeping the aspect ratio
+        if max_dimension:
+            img.thumbnail((max_dimension, max_dimension))
+
         output = BytesIO()
         img.save(output, format='JPEG', quality=70, optimize=True)
         output.seek(0)
@@ -0,0 +1,399 @@
+from celery import shared_task
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import get_connection
+from django.db import transaction
+from django.utils import timezone
+from exponent_server_sdk import (DeviceNotRegisteredError, MessageRateExceededError, PushClient,
+                                 PushMessage, PushServerError, PushTicketError)
+from io import BytesIO
+from PIL import Image
+from requests.exceptions import ConnectionError, RequestException, Timeout
+from rest_framework.serializers import ValidationError
+from record.tax import tax_records, tax_summary
+from .models import Account, PushNotification
+from .serializers import AccountSerializer
+from .utils import Util
+import logging
+import os
+import requests
+import smtplib
+import time
+logger = logging.getLogger(__name__)
+
+# Expo accepts at most 100 messages per request
+PUSH_BATCH_SIZE = 100
+
+_push_client = None
+_email_connection = None
+
+
+def get_push_client():
+    """One client per worker process, so its HTTP session and connections are reused."""
+    global _push_client
+    if _push_client is None:
+        _push_client = PushClient(timeout=30)
+    return _push_client
+
+
+@shared_task
+def dispatch_push_notifications():
+    """
+    Send pending push notifications in batches until none are left. Each
+    batch is claimed in a short transaction with SKIP LOCKED, so several
+    workers can drain the outbox at once, and sent with no rows locked.
+    Failed sends go back to pending for the next run until
+    EXPO_PUSH_RETRY_COUNT attempts have been made. Scheduled record pushes
+    are first coalesced into one digest per device.
+    """
+    release_stale_claims()
+    coalesce_scheduled_records()
+    sent, tried = 0, set()
+
+    while True:
+        batch = claim_batch(tried)
+        if not batch:
+            break
+        tried.update(notification.pk for notification in batch)
+
+        try:
+            publish_batch(batch)
+        except Exception as exc:
+            logger.exception(f"Push batch failed: {exc}")
+            for notification in batch:
+                retry_or_fail(notification, f"Push batch failed: {exc}")
+        PushNotification.objects.bulk_update(batch, ['status', 'error', 'sent_at'])
+        sent += sum(notification.status == 'sent' for notification in batch)
+
+    return f"Sent {sent} of {len(tried)} push notifications"
+
+
+def claim_batch(exclude):
+    """
+    Mark up to PUSH_BATCH_SIZE pending notifications as sending and count
+    the attempt, committing before anything is sent.
+    """
+    with transaction.atomic():
+        batch = list(
+            PushNotification.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending')
+            .exclude(pk__in=exclude)
+            .order_by('id')[:PUSH_BATCH_SIZE]
+        )
+        now = timezone.now()
+        for notification in batch:
+            notification.status = 'sending'
+            notification.attempts += 1
+            notification.claimed_at = now
+        PushNotification.objects.bulk_update(batch, ['status', 'attempts', 'claimed_at'])
+    return batch
+
+
+def release_stale_claims():
+    """
+    Put back notifications left sending by a worker that died before
+    recording the result, failing those out of attempts.
+    """
+    stale = PushNotification.objects.filter(
+        status='sending',
+        claimed_at__lt=timezone.now() - timedelta(seconds=settings.EXPO_PUSH_CLAIM_TIMEOUT))
+    stale.filter(attempts__gte=settings.EXPO_PUSH_RETRY_COUNT) \
+        .update(status='failed', error='Worker stopped while sending')
+    stale.update(status='pending')
+
+
+def coalesce_scheduled_records():
+    """
+    Replace the pending SCHEDULED_RECORD pushes of each device, when there
+    are at least EXPO_PUSH_DIGEST_MIN of them, with one digest message
+    giving their count and totals.
+    """
+    with transaction.atomic():
+        pending = PushNotification.objects.select_for_update(skip_locked=True) \
+            .filter(status='pending', attempts=0, data__type='SCHEDULED_RECORD') \
+            .order_by('id')
+        by_token = defaultdict(list)
+        for notification in pending:
+            by_token[notification.token].append(notification)
+
+        digests, merged = [], []
+        for token, notifications in by_token.items():
+            if len(notifications) < settings.EXPO_PUSH_DIGEST_MIN:
+                continue
+            digests.append(digest_of(token, notifications))
+            for notification in notifications:
+                notification.status = 'merged'
+            merged.extend(notifications)
+
+        PushNotification.objects.bulk_create(digests)
+        PushNotification.objects.bulk_update(merged, ['status'])
+
+
+def digest_of(token, notifications):
+    income = expense = Decimal('0.00')
+    book_ids = set()
+    for notification in notifications:
+        amount = Decimal(notification.data.get('amount', '0'))
+        if amount < 0:
+            expense += amount
+        else:
+            income += amount
+        book_ids.add(notification.data.get('bookId'))
+
+    parts = []
+    if expense:
+        parts.append(f'${abs(expense):.2f} in costs')
+    if income:
+        parts.append(f'${income:.2f} in earnings')
+    body = f'{len(notifications)} scheduled records added'
+    if parts:
+        body += f': {" and ".join(parts)}'
+
+    return PushNotification(token=token, body=body, data={
+        "type": "SCHEDULED_RECORD_DIGEST",
+        "count": len(notifications),
+        "total": str(income + expense),
+        "bookIds": sorted(book_id for book_id in book_ids if book_id is not None)
+    })
+
+
+def publish_batch(batch):
+    """Publish the notifications with one request, updating them from the tickets."""
+    try:
+        tickets = get_push_client().publish_multiple([
+            PushMessage(to=notification.token,
+                        body=notification.body,
+                        data=notification.data)
+            for notification in batch
+        ])
+    except (PushServerError, RequestException) as exc:
+        logger.warning(f"Push batch failed: {exc}")
+        for notification in batch:
+            retry_or_fail(notification, str(exc))
+        return
+
+    unregistered = set()
+    for notification, ticket in zip(batch, tickets):
+        try:
+            ticket.validate_response()
+        except DeviceNotRegisteredError:
+            notification.status = 'failed'
+            notification.error = 'Device not registered'
+            unregistered.add(notification.token)
+        except MessageRateExceededError as exc:
+            retry_or_fail(notification, f"Rate exceeded: {exc}")
+        except PushTicketError as exc:
+            notification.status = 'failed'
+            notification.error = f"Push ticket error: {exc}"[:500]
+        else:
+            notification.status = 'sent'
+            notification.sent_at = timezone.now()
+
+    if unregistered:
+        # The app was uninstalled or the token expired, stop sending to it
+        Account.objects.filter(expo_push_token__in=unregistered) \
+            .update(expo_push_token=None)
+        logger.info(f"Removed {len(unregistered)} unregistered push tokens")
+
+
+def retry_or_fail(notification, error):
+    notification.error = error[:500]
+    if notification.attempts >= settings.EXPO_PUSH_RETRY_COUNT:
+        notification.status = 'failed'
+    else:
+        notification.status = 'pending'
+
+
+@shared_task
+def prune_push_notifications():
+    """
+    Periodic task to delete pushes that were sent, merged into a digest or
+    gave up more than EXPO_PUSH_RETENTION_DAYS ago.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.EXPO_PUSH_RETENTION_DAYS)
+    deleted, _ = PushNotification.objects.filter(
+        status__in=['sent', 'merged', 'failed'], created_at__lt=cutoff).delete()
+    return f"Pruned {deleted} push notifications"
+
+
+def get_email_connection():
+    """
+    One SMTP connection per worker process, opened on first use and kept
+    open, so emails don't each pay for a new connection and TLS handshake.
+    """
+    global _email_connection
+    if _email_connection is None:
+        _email_connection = get_connection(fail_silently=False)
+    # Does nothing while the connection is open
+    _email_connection.open()
+    return _email_connection
+
+
+def close_email_connection():
+    global _email_connection
+    if _email_connection is not None:
+        try:
+            _email_connection.close()
+        except Exception:
+            pass
+        _email_connection = None
+
+
+def send_messages(messages):
+    try:
+        return get_email_connection().send_messages(messages)
+    except smtplib.SMTPServerDisconnected:
+        # The server dropped the idle connection, reconnect once
+        close_email_connection()
+        return get_email_connection().send_messages(messages)
+
+
+@shared_task(bind=True, max_retries=settings.EMAIL_RETRY_COUNT)
+def send_email(self, emails):
+    """
+    Send the emails queued together by Util.send_emails over the worker's
+    SMTP connection. When sending fails, the ones not sent yet are retried
+    with exponential backoff.
+    """
+    if isinstance(emails, dict):
+        # Queued one per task, before emails were batched
+        emails = [emails]
+
+    sent = 0
+    for index, data in enumerate(emails):
+        try:
+            # One at a time over the open connection, as
+            # connection.send_messages() does, knowing which were sent
+            sent += send_messages([Util.build_email(data)])
+        except smtplib.SMTPRecipientsRefused as e:
+            # Retrying won't help a rejected address
+            logger.error(f"Email to {data['to_email']} refused: {e.recipients}")
+        except FileNotFoundError as e:
+            # The attachment was removed after queueing, retrying won't bring it back
+            logger.error(f"Email to {data['to_email']} not sent: {e}")
+        except (smtplib.SMTPException, OSError) as e:
+            close_email_connection()
+            logger.warning(f"Sending email to {data['to_email']} failed: {e}")
+            raise self.retry(args=[emails[index:]], exc=e,
+                             countdown=settings.EMAIL_RETRY_DELAY * 2 ** self.request.retries)
+    return f"Sent {sent} of {len(emails)} emails"
+
+
+def tax_report_dir(user_id):
+    return os.path.join(settings.TAX_REPORT_DIR, str(user_id))
+
+
+def prune_tax_reports(directory):
+    """Delete reports in a directory older than TAX_REPORT_TTL."""
+    cutoff = time.time() - settings.TAX_REPORT_TTL
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+
+
+@shared_task(bind=True)
+def render_tax_report(self, user_id, book_id=None, start=None, end=None):
+    """
+    Fill the tax return PDF for a user from the tax-marked records of a
+    book, start and end being optional YYYY-MM-DD days. The file goes to the
+    user's own directory under TAX_REPORT_DIR, named after the task, and
+    the task result tells the web workers where to find it.
+    """
+    user = User.objects.select_related('account').get(pk=user_id)
+    summary = None
+    if book_id:
+        summary = tax_summary(tax_records(
+            book_id,
+            start and date.fromisoformat(start),
+            end and date.fromisoformat(end)))
+
+    account = getattr(user, 'account', None)
+    name = (account and account.nickname) or user.get_full_name() or user.username
+    data = {'name': name}
+    if summary:
+        data.update({
+            'income': f"{summary['income']:.2f}",
+            'expense': f"{summary['expense']:.2f}",
+            'tax': f"{summary['taxable']:.2f}",
+        })
+
+    directory = tax_report_dir(user_id)
+    os.makedirs(directory, exist_ok=True)
+    prune_tax_reports(directory)
+    path = os.path.join(directory, f'{self.request.id}.pdf')
+    Util.fill_pdf(data, path)
+
+    return {
+        'user_id': user_id,
+        'path': path,
+        'summary': summary and {
+            **{key: str(summary[key]) for key in ('income', 'expense', 'taxable')},
+            'count': summary['count'],
+            'categories': [{**category, 'total': str(category['total'])}
+                           for category in summary['categories']],
+        },
+    }
+
+
+@shared_task
+def email_tax_report(report):
+    """Email a report rendered by render_tax_report to its user, chained after it."""
+    user = User.objects.get(pk=report['user_id'])
+    if not user.email:
+        logger.warning(f"No email address to send the tax report of user {user.pk} to")
+        return None
+    Util.send_email({
+        "email_subject": 'Your tax return',
+        "email_body": 'Your tax return report is attached.',
+        "to_email": user.email,
+        "email_attachment": report['path'],
+    })
+    return f"Emailed tax report to {user.email}"
+
+
+def download_picture(url):
+    """The body of url, refusing ones larger than AVATAR_DOWNLOAD_MAX bytes."""
+    content = BytesIO()
+    with requests.get(url, timeout=settings.AVATAR_DOWNLOAD_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            content.write(chunk)
+            if content.tell() > settings.AVATAR_DOWNLOAD_MAX:
+                raise ValueError(f"Picture is larger than {settings.AVATAR_DOWNLOAD_MAX} bytes")
+    content.seek(0)
+    return content
+
+
+@shared_task(bind=True, max_retries=settings.AVATAR_RETRY_COUNT)
+def download_avatar(self, account_id, picture_url):
+    """
+    Store a social login profile picture as an account's avatar, shrunk to
+    AVATAR_MAX_DIMENSION and recompressed as JPEG. Only failures to reach
+    the provider are retried, a bad picture keeps the current avatar, and
+    an unchanged one isn't written again.
+    """
+    try:
+        picture = download_picture(picture_url)
+    except (ConnectionError, Timeout) as e:
+        logger.warning(f"Retrying avatar download of account {account_id}: {e}")
+        raise self.retry(exc=e, countdown=30 * 2 ** self.request.retries)
+    except (RequestException, ValueError) as e:
+        logger.warning(f"Failed to download avatar of account {account_id}: {e}")
+        return None
+
+    try:
+        avatar = AccountSerializer().compress_image(
+            picture, max_dimension=settings.AVATAR_MAX_DIMENSION)
+    except (OSError, Image.DecompressionBombError, ValidationError) as e:
+        logger.warning(f"Unusable avatar for account {account_id}: {e}")
+        return None
+
+    # The same picture again leaves the row, and the avatar's ETag, alone
+    avatar_hash = Account.digest(avatar)
+    updated = Account.objects.filter(pk=account_id).exclude(avatar_hash=avatar_hash) \
+        .update(avatar=avatar, avatar_hash=avatar_hash)
+    return f"Stored {len(avatar)} byte avatar for account {account_id}" if updated else None
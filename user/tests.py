@@ -1,3 +1,542 @@
-from django.test import TestCase
+import json
+import os
+import smtplib
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+from types import SimpleNamespace
+from unittest import mock
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from requests.exceptions import ConnectionError, HTTPError, ReadTimeout
+from jwt.algorithms import RSAAlgorithm
+from rest_framework.test import APIClient
+from . import jwks
+from .models import Account, PushNotification
+from .tasks import (close_email_connection, coalesce_scheduled_records, digest_of,
+                    dispatch_push_notifications, download_avatar, email_tax_report,
+                    prune_push_notifications, send_email)
+from .utils import Util
 
-# Create your tests here.
+LOCMEM_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+}
+
+
+def ticket():
+    return SimpleNamespace(validate_response=lambda: None)
+
+
+@override_settings(EXPO_PUSH_RETRY_COUNT=3, EXPO_PUSH_CLAIM_TIMEOUT=300)
+class DispatchPushNotificationsTests(TestCase):
+
+    def setUp(self):
+        self.notification = PushNotification.objects.create(
+            token='ExponentPushToken[test]', body='Hello')
+
+    def dispatch(self, publish):
+        client = mock.Mock()
+        client.publish_multiple.side_effect = publish
+        with mock.patch('user.tasks.get_push_client', return_value=client):
+            return dispatch_push_notifications()
+
+    def test_sends_with_the_batch_claimed(self):
+        def publish(messages):
+            # Claimed and committed before the request, not held locked
+            self.notification.refresh_from_db()
+            self.assertEqual(self.notification.status, 'sending')
+            self.assertEqual(self.notification.attempts, 1)
+            return [ticket() for _ in messages]
+
+        self.dispatch(publish)
+
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, 'sent')
+        self.assertIsNotNone(self.notification.sent_at)
+
+    def test_timeout_keeps_the_attempt(self):
+        self.dispatch(ReadTimeout('read timed out'))
+
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, 'pending')
+        self.assertEqual(self.notification.attempts, 1)
+        self.assertIn('read timed out', self.notification.error)
+
+    def test_unexpected_error_keeps_the_attempt(self):
+        for _ in range(3):
+            self.dispatch(ValueError('bad response'))
+
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, 'failed')
+        self.assertEqual(self.notification.attempts, 3)
+        self.assertIn('bad response', self.notification.error)
+
+    def test_releases_stale_claims(self):
+        PushNotification.objects.filter(pk=self.notification.pk).update(
+            status='sending', attempts=1,
+            claimed_at=timezone.now() - timedelta(seconds=301))
+
+        self.dispatch(lambda messages: [ticket() for _ in messages])
+
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, 'sent')
+        self.assertEqual(self.notification.attempts, 2)
+
+    def test_keeps_recent_claims(self):
+        PushNotification.objects.filter(pk=self.notification.pk).update(
+            status='sending', attempts=1, claimed_at=timezone.now())
+
+        self.dispatch(lambda messages: [ticket() for _ in messages])
+
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, 'sending')
+
+
+@override_settings(EXPO_PUSH_DIGEST_MIN=2)
+class CoalesceScheduledRecordsTests(TestCase):
+
+    def push(self, token, amount, book_id=1, **fields):
+        return PushNotification.objects.create(
+            token=token, body='Scheduled record added', data={
+                'type': 'SCHEDULED_RECORD', 'amount': amount, 'bookId': book_id}, **fields)
+
+    def test_pushes_to_one_device_become_a_digest(self):
+        pushes = [self.push('ExponentPushToken[a]', '-12.50'),
+                  self.push('ExponentPushToken[a]', '-7.50', book_id=2),
+                  self.push('ExponentPushToken[a]', '100.00')]
+
+        coalesce_scheduled_records()
+
+        for push in pushes:
+            push.refresh_from_db()
+            self.assertEqual(push.status, 'merged')
+        digest = PushNotification.objects.get(status='pending')
+        self.assertEqual(digest.token, 'ExponentPushToken[a]')
+        self.assertEqual(digest.body, '3 scheduled records added: $20.00 in costs and $100.00 in earnings')
+        self.assertEqual(digest.data, {'type': 'SCHEDULED_RECORD_DIGEST', 'count': 3,
+                                       'total': '80.00', 'bookIds': [1, 2]})
+
+    def test_devices_are_kept_apart(self):
+        for token in ('ExponentPushToken[a]', 'ExponentPushToken[b]'):
+            self.push(token, '-1.00')
+            self.push(token, '-2.00')
+        single = self.push('ExponentPushToken[c]', '-3.00')
+
+        coalesce_scheduled_records()
+
+        digests = PushNotification.objects.filter(data__type='SCHEDULED_RECORD_DIGEST')
+        self.assertEqual(sorted(digests.values_list('token', 'data__count')),
+                         [('ExponentPushToken[a]', 2), ('ExponentPushToken[b]', 2)])
+        single.refresh_from_db()
+        # Below EXPO_PUSH_DIGEST_MIN, sent as it is
+        self.assertEqual(single.status, 'pending')
+
+    def test_claimed_pushes_are_not_merged(self):
+        claimed = self.push('ExponentPushToken[a]', '-1.00', status='sending', attempts=1,
+                            claimed_at=timezone.now())
+        retried = self.push('ExponentPushToken[a]', '-2.00', attempts=1)
+        pending = self.push('ExponentPushToken[a]', '-3.00')
+
+        coalesce_scheduled_records()
+
+        for push, status in ((claimed, 'sending'), (retried, 'pending'), (pending, 'pending')):
+            push.refresh_from_db()
+            self.assertEqual(push.status, status)
+        self.assertFalse(PushNotification.objects.filter(data__type='SCHEDULED_RECORD_DIGEST').exists())
+
+    def test_digest_of_costs_only(self):
+        pushes = [PushNotification(data={'amount': '-4.00', 'bookId': 3}),
+                  PushNotification(data={'amount': '-1.25'})]
+
+        digest = digest_of('ExponentPushToken[a]', pushes)
+
+        self.assertEqual(digest.body, '2 scheduled records added: $5.25 in costs')
+        self.assertEqual(digest.data['bookIds'], [3])
+
+
+@override_settings(EXPO_PUSH_RETENTION_DAYS=30)
+class PrunePushNotificationsTests(TestCase):
+
+    def test_prunes_finished_pushes_past_the_retention(self):
+        old = timezone.now() - timedelta(days=31)
+        for status in ('pending', 'sending', 'sent', 'merged', 'failed'):
+            PushNotification.objects.create(token='ExponentPushToken[old]', body=status, status=status)
+            PushNotification.objects.create(token='ExponentPushToken[new]', body=status, status=status)
+        PushNotification.objects.filter(token='ExponentPushToken[old]').update(created_at=old)
+
+        self.assertEqual(prune_push_notifications(), 'Pruned 3 push notifications')
+
+        kept = PushNotification.objects.values_list('token', 'status')
+        self.assertEqual(sorted(kept), [
+            ('ExponentPushToken[new]', 'failed'), ('ExponentPushToken[new]', 'merged'),
+            ('ExponentPushToken[new]', 'pending'), ('ExponentPushToken[new]', 'sending'),
+            ('ExponentPushToken[new]', 'sent'),
+            ('ExponentPushToken[old]', 'pending'), ('ExponentPushToken[old]', 'sending')])
+
+
+class SendEmailTests(TestCase):
+    data = {'email_subject': 'Report', 'email_body': 'Attached', 'to_email': 'owner@example.com'}
+
+    def test_queues_the_attachment_by_absolute_path(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                open(os.path.join(directory, 'report.pdf'), 'wb'), \
+                mock.patch('os.getcwd', return_value=directory), \
+                mock.patch('user.tasks.send_email.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                Util.send_email({**self.data, 'email_attachment': 'report.pdf'})
+
+        self.assertEqual(delay.call_args.args[0][0]['email_attachment'],
+                         os.path.join(directory, 'report.pdf'))
+
+    def test_missing_attachment_fails_before_queueing(self):
+        with mock.patch('user.tasks.send_email.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                with self.assertRaises(FileNotFoundError):
+                    Util.send_email({**self.data, 'email_attachment': '/missing/report.pdf'})
+
+        self.assertEqual(callbacks, [])
+        delay.assert_not_called()
+
+    def test_attachment_removed_after_queueing_is_not_retried(self):
+        with mock.patch('user.tasks.send_messages') as send_messages:
+            result = send_email.apply(args=[{**self.data, 'email_attachment': '/missing/report.pdf'}])
+
+        self.assertEqual(result.result, 'Sent 0 of 1 emails')
+        send_messages.assert_not_called()
+
+    def test_queues_several_emails_as_one_task(self):
+        emails = [{**self.data, 'to_email': f'user{n}@example.com'} for n in range(3)]
+        with mock.patch('user.tasks.send_email.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                Util.send_emails(emails)
+
+        delay.assert_called_once_with(emails)
+
+    def test_sends_the_batch_over_one_connection(self):
+        emails = [{**self.data, 'to_email': f'user{n}@example.com'} for n in range(3)]
+        connection = mock.Mock()
+        connection.send_messages.side_effect = lambda messages: len(messages)
+        with mock.patch('user.tasks.get_connection', return_value=connection) as get_connection:
+            result = send_email.apply(args=[emails])
+            close_email_connection()
+
+        self.assertEqual(result.result, 'Sent 3 of 3 emails')
+        get_connection.assert_called_once()
+        sent = [message.to for (messages,), _ in connection.send_messages.call_args_list
+                for message in messages]
+        self.assertEqual(sent, [[data['to_email']] for data in emails])
+
+    def test_failure_retries_only_the_unsent_emails(self):
+        emails = [{**self.data, 'to_email': f'user{n}@example.com'} for n in range(3)]
+        sent, failures = [], [smtplib.SMTPServerDisconnected('connection lost')]
+
+        def send(messages):
+            if messages[0].to == ['user1@example.com'] and failures:
+                raise failures.pop()
+            sent.extend(message.to[0] for message in messages)
+            return len(messages)
+
+        with mock.patch('user.tasks.send_messages', side_effect=send), \
+                mock.patch.object(send_email, 'retry', wraps=send_email.retry) as retry, \
+                self.assertLogs('user.tasks', 'WARNING'):
+            send_email.apply(args=[emails])
+
+        self.assertEqual(retry.call_args.kwargs['args'], [emails[1:]])
+        self.assertEqual(sent, ['user0@example.com', 'user1@example.com', 'user2@example.com'])
+
+    def test_emails_queued_one_per_task_still_send(self):
+        with mock.patch('user.tasks.send_messages', return_value=1) as send_messages:
+            result = send_email.apply(args=[self.data])
+
+        self.assertEqual(result.result, 'Sent 1 of 1 emails')
+        send_messages.assert_called_once()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TaxReturnTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', email='owner@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_emails_the_rendered_report(self):
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as report, \
+                mock.patch('user.tasks.send_email.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                email_tax_report({'user_id': self.user.pk, 'path': report.name})
+
+        [data] = delay.call_args.args[0]
+        self.assertEqual(data['to_email'], 'owner@example.com')
+        self.assertEqual(data['email_attachment'], report.name)
+
+    def test_renders_then_emails(self):
+        with mock.patch('user.views.other.chain') as chain:
+            chain.return_value.delay.return_value.parent.id = 'render-task'
+            response = self.client.post('/user/tax-return/', {'book_id': '', 'start_date': '2025-01-01'})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'task_id': 'render-task'})
+        render, email = chain.call_args.args
+        self.assertEqual(render.args, (self.user.pk, '', '2025-01-01', None))
+        self.assertEqual(email.task, 'user.tasks.email_tax_report')
+
+    def test_needs_an_email_address(self):
+        self.user.email = ''
+        self.user.save()
+
+        response = self.client.post('/user/tax-return/', {})
+
+        self.assertEqual(response.status_code, 400)
+
+
+def picture(size=(600, 300), color='green'):
+    content = BytesIO()
+    Image.new('RGB', size, color).save(content, format='PNG')
+    return content.getvalue()
+
+
+@override_settings(AVATAR_MAX_DIMENSION=128)
+class DownloadAvatarTests(TestCase):
+    url = 'https://provider.example/picture.png'
+
+    def setUp(self):
+        user = User.objects.create_user('owner', password='password')
+        self.account = Account.objects.create(user=user)
+
+    def served(self, *responses):
+        """Patch the provider to answer with each body, or raise each exception, in turn."""
+        def get(url, **kwargs):
+            body = next(bodies)
+            if isinstance(body, Exception):
+                raise body
+            response = mock.MagicMock()
+            response.__enter__.return_value.iter_content.return_value = [body]
+            return response
+
+        bodies = iter(responses)
+        return mock.patch('user.tasks.requests.get', side_effect=get)
+
+    def download(self):
+        # Retries run straight away, not after their countdown
+        return download_avatar.apply(args=[self.account.pk, self.url])
+
+    def test_stores_the_shrunk_avatar_and_its_hash(self):
+        with self.served(picture()):
+            self.assertIn('byte avatar', self.download().result)
+
+        self.account.refresh_from_db()
+        avatar = Image.open(BytesIO(bytes(self.account.avatar)))
+        self.assertEqual((avatar.format, avatar.size), ('JPEG', (128, 64)))
+        self.assertEqual(self.account.avatar_hash, Account.digest(self.account.avatar))
+
+    def test_connection_failures_are_logged_and_retried(self):
+        with self.served(ConnectionError('refused'), picture()) as get, \
+                self.assertLogs('user.tasks', 'WARNING') as logs:
+            self.assertTrue(self.download().successful())
+
+        self.assertEqual(get.call_count, 2)
+        self.assertIn('Retrying avatar download', logs.output[0])
+        self.account.refresh_from_db()
+        self.assertIsNotNone(self.account.avatar_hash)
+
+    def test_gives_up_after_the_retries(self):
+        # max_retries is read from AVATAR_RETRY_COUNT when the task is defined
+        attempts = settings.AVATAR_RETRY_COUNT + 1
+        with self.served(*[ConnectionError('refused')] * attempts) as get, \
+                self.assertLogs('user.tasks', 'WARNING'):
+            self.assertFalse(self.download().successful())
+
+        self.assertEqual(get.call_count, attempts)
+
+    def test_bad_pictures_keep_the_avatar(self):
+        with self.served(HTTPError('404 Not Found'), b'not an image') as get, \
+                self.assertLogs('user.tasks', 'WARNING') as logs:
+            self.assertIsNone(self.download().result)
+            self.assertIsNone(self.download().result)
+
+        self.assertEqual(get.call_count, 2)
+        self.assertIn('Failed to download avatar', logs.output[0])
+        self.assertIn('Unusable avatar', logs.output[1])
+        self.account.refresh_from_db()
+        self.assertIsNone(self.account.avatar)
+
+    def test_unchanged_avatar_is_not_written(self):
+        with self.served(picture(), picture()):
+            self.assertIsNotNone(self.download().result)
+            # The same hash, no row updated
+            self.assertIsNone(self.download().result)
+
+        with self.served(picture(color='blue')):
+            self.assertIsNotNone(self.download().result)
+
+    def test_queued_once_the_login_commits(self):
+        with mock.patch('user.tasks.download_avatar.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                Util.queue_avatar_download(self.account.pk, self.url)
+                delay.assert_not_called()
+        delay.assert_called_once_with(self.account.pk, self.url)
+
+        with mock.patch('user.tasks.download_avatar.delay', side_effect=OSError('broker down')), \
+                self.assertLogs('user.utils', 'WARNING') as logs:
+            with self.captureOnCommitCallbacks(execute=True):
+                Util.queue_avatar_download(self.account.pk, self.url)
+        self.assertIn('broker down', logs.output[0])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, AVATAR_THUMBNAIL_SIZES=(64, 128), AVATAR_CACHE_MAX_AGE=3600)
+class AccountAvatarTests(TestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = User.objects.create_user('owner', password='password')
+        self.account = Account.objects.create(user=self.user, avatar=picture((400, 200)))
+        self.account.refresh_from_db()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, account=None, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(f'/user/{(account or self.account).pk}/avatar/', params, **headers)
+
+    def test_serves_the_avatar_with_its_hash_as_etag(self):
+        response = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response.content, bytes(self.account.avatar))
+        self.assertEqual(response['ETag'], f'"{self.account.avatar_hash}"')
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.get()['ETag']
+
+        response = self.get(etag=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        self.account.avatar = picture((400, 200), color='blue')
+        self.account.save()
+        self.assertEqual(self.get(etag=etag).status_code, 200)
+
+    def test_thumbnails(self):
+        response = self.get(size=64)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (64, 32))
+        self.assertEqual(response['ETag'], f'"{self.account.avatar_hash}-64"')
+        # Made once, then read from the cache
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(size=64).content, response.content)
+
+        for size in ('256', '0', 'large'):
+            self.assertEqual(self.get(size=size).status_code, 400, size)
+
+    def test_versioned_url_is_cached_for_good(self):
+        response = self.get(v=self.account.avatar_hash)
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = self.get(v='an-old-hash')
+        self.assertNotIn('max-age', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_missing_avatars(self):
+        self.account.avatar = None
+        self.account.save()
+        self.assertEqual(self.get().status_code, 404)
+        self.assertEqual(self.get(size=64).json(), {'error': 'Avatar not found'})
+
+        other = User.objects.create_user('other', password='password')
+        other_account = Account.objects.create(user=other, avatar=picture())
+        self.assertEqual(self.get(other_account).status_code, 404)
+
+
+PRIVATE_KEYS = {kid: rsa.generate_private_key(public_exponent=65537, key_size=2048)
+                for kid in ('k1', 'k2')}
+
+
+def jwks_response(kids, cache_control='public, max-age=120'):
+    keys = [dict(json.loads(RSAAlgorithm.to_jwk(PRIVATE_KEYS[kid].public_key())), kid=kid, alg='RS256')
+            for kid in kids]
+    response = mock.Mock(headers={'Cache-Control': cache_control} if cache_control else {})
+    response.json.return_value = {'keys': keys}
+    return response
+
+
+@override_settings(CACHES=LOCMEM_CACHE, JWKS_DEFAULT_TTL=3600, JWKS_REFRESH_INTERVAL=60)
+class KeySetTests(SimpleTestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.now = 1000.0
+        patcher = mock.patch('user.jwks.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.keys = jwks.KeySet('test', 'https://provider.example/keys')
+
+    def served(self, *responses):
+        return mock.patch('user.jwks.requests.get', side_effect=list(responses))
+
+    def test_keys_are_kept_for_the_max_age(self):
+        with self.served(jwks_response(['k1']), jwks_response(['k1'])) as get:
+            self.assertIsNotNone(self.keys.get_key('k1'))
+            self.now += 119
+            self.assertIsNotNone(self.keys.get_key('k1'))
+            self.assertEqual(get.call_count, 1)
+
+            self.now += 2
+            self.assertIsNotNone(self.keys.get_key('k1'))
+            self.assertEqual(get.call_count, 2)
+
+    def test_default_ttl_without_max_age(self):
+        self.assertEqual(jwks.max_age(jwks_response(['k1'], cache_control=None)), 3600)
+        self.assertEqual(jwks.max_age(jwks_response(['k1'], cache_control='max-age=0')), 1)
+
+    def test_unknown_kid_refetches_once_per_interval(self):
+        with self.served(jwks_response(['k1']), jwks_response(['k1', 'k2']),
+                         jwks_response(['k1', 'k2'])) as get:
+            self.keys.get_key('k1')
+            self.now += 1
+            # The provider rotated in k2
+            self.assertIsNotNone(self.keys.get_key('k2'))
+            self.assertEqual(get.call_count, 2)
+
+            self.assertIsNone(self.keys.get_key('k3'))
+            self.assertIsNone(self.keys.get_key('k3'))
+            self.assertEqual(get.call_count, 2)
+
+            self.now += 61
+            self.assertIsNone(self.keys.get_key('k3'))
+            self.assertEqual(get.call_count, 3)
+
+    def test_workers_share_the_cached_key_set(self):
+        other_worker = jwks.KeySet('test', 'https://provider.example/keys')
+        with self.served(jwks_response(['k1'])) as get:
+            self.keys.get_key('k1')
+            with mock.patch('user.jwks.parse_keys', wraps=jwks.parse_keys) as parse_keys:
+                self.assertIsNotNone(other_worker.get_key('k1'))
+                self.assertEqual(parse_keys.call_count, 1)
+                # Expired locally, the shared copy is the same, so nothing is parsed again
+                other_worker.expires = 0
+                other_worker.get_key('k1')
+                self.assertEqual(parse_keys.call_count, 1)
+            self.assertEqual(get.call_count, 1)
+
+    def test_decode(self):
+        token = jwt.encode({'sub': 'user', 'aud': 'app'}, PRIVATE_KEYS['k1'], algorithm='RS256',
+                           headers={'kid': 'k1'})
+        with self.served(jwks_response(['k1'])):
+            self.assertEqual(jwks.decode(token, self.keys, audience='app')['sub'], 'user')
+            other = jwt.encode({'sub': 'user'}, PRIVATE_KEYS['k2'], algorithm='RS256',
+                               headers={'kid': 'k1'})
+            with self.assertRaises(jwt.InvalidTokenError):
+                jwks.decode(other, self.keys, audience='app')
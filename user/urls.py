@@ -12,6 +12,7 @@ urlpatterns = [
     # path("logout/", views.logout_user, name="logout"),
     path('details/', views.user_details_view),
     path('<int:pk>/', views.AccountDetail.as_view()),
+    path('<int:pk>/avatar/', views.AccountAvatar.as_view(), name='account_avatar'),
     path("login/", obtain_auth_token, name="login"),
     path('auth/apple/', views.apple_auth, name='apple_auth'),
     path('auth/facebook/', views.facebook_auth, name='facebook_auth'),
@@ -25,4 +26,7 @@ urlpatterns = [
          name='register_push_token'),
     path("tax-return/", views.tax_return_view),
     path("fill-pdf/", views.fill_pdf_view),
+    path("tax-report/<str:task_id>/", views.tax_report_view, name="tax_report"),
+    path("tax-report/<str:task_id>/download/", views.tax_report_download_view,
+         name="tax_report_download"),
 ]
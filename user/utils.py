@@ -1,23 +1,17 @@
-from django.core.mail import EmailMessage
-import threading
+from django.core.mail import EmailMessage, get_connection
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.utils.http import base36_to_int
 import six
 from fillpdf import fillpdfs
-from exponent_server_sdk import DeviceNotRegisteredError, PushClient, PushMessage, PushServerError, PushTicketError
-from requests.exceptions import ConnectionError, HTTPError
+from django.conf import settings
+from django.db import transaction
 from book.models import Book
 from asset.models import AssetGroup
+from .models import PushNotification
+import logging
+import os
 
-
-class EmailThread(threading.Thread):
-
-    def __init__(self, email):
-        self.email = email
-        threading.Thread.__init__(self)
-
-    def run(self):
-        self.email.send()
+logger = logging.getLogger(__name__)
 
 
 class Util:
@@ -47,38 +41,95 @@ class Util:
         return book, groups
 
     @staticmethod
-    def send_email(data):
+    def build_email(data):
         email = EmailMessage(
             subject=data['email_subject'], body=data['email_body'], to=[data['to_email']])
         if 'email_attachment' in data:
             email.attach_file(data['email_attachment'])
-        EmailThread(email).start()
+        return email
 
     @staticmethod
-    def fill_pdf():
-        data = {
-            'name': 'Luke',
-            'income': '1000',
-            'expense': '20',
-            'tax': '2'
-        }
+    def send_email(data):
+        """
+        Queue an email for the Celery workers once the transaction commits.
+        data has email_subject, email_body, to_email and optionally the path
+        of an email_attachment, which the worker reads when sending. The
+        path is made absolute, as the worker's working directory may differ.
+        """
+        Util.send_emails([data])
+
+    @staticmethod
+    def send_emails(emails):
+        """Queue several emails like send_email, sent together by one task."""
+        checked = []
+        for data in emails:
+            if 'email_attachment' in data:
+                path = os.path.abspath(data['email_attachment'])
+                if not os.path.isfile(path):
+                    raise FileNotFoundError(f"Email attachment {path} not found")
+                data = {**data, 'email_attachment': path}
+            # Raise BadHeaderError here rather than in the worker
+            Util.build_email(data).message()
+            checked.append(data)
+        if checked:
+            transaction.on_commit(lambda: Util.queue_email(checked))
+
+    @staticmethod
+    def queue_email(emails):
+        from .tasks import send_email
+        try:
+            send_email.delay(emails)
+        except Exception as e:
+            # Nothing else would send them, so don't lose them
+            logger.warning(f"Could not queue email, sending it now: {e}")
+            get_connection().send_messages([Util.build_email(data) for data in emails])
+
+    @staticmethod
+    def fill_pdf(data, output_path):
+        """Fill the tax return form with data, writing it to output_path."""
         fillpdfs.write_fillable_pdf(
-            'doc/test_file.pdf', 'doc/new.pdf', data)
+            settings.TAX_REPORT_TEMPLATE, output_path, data)
+
+    @staticmethod
+    def queue_push_message(token, message, extra=None):
+        Util.queue_push_messages([(token, message, extra)])
 
-    def send_push_message(token, message, extra=None):
+    @staticmethod
+    def queue_push_messages(messages, dispatch=True):
+        """
+        Write (token, message, extra) push notifications to the outbox. They
+        are sent by dispatch_push_notifications once the transaction commits,
+        or with dispatch=False by its next periodic run.
+        """
+        notifications = PushNotification.objects.bulk_create([
+            PushNotification(token=token, body=message, data=extra or {})
+            for token, message, extra in messages if token
+        ])
+        if notifications and dispatch:
+            transaction.on_commit(Util.dispatch_push_notifications)
+
+    @staticmethod
+    def dispatch_push_notifications():
+        from .tasks import dispatch_push_notifications
+        try:
+            dispatch_push_notifications.delay()
+        except Exception as e:
+            # The periodic dispatch picks the notifications up instead
+            logger.warning(f"Could not queue push dispatch: {e}")
+
+    @staticmethod
+    def queue_avatar_download(account_id, picture_url):
+        """Download a social login profile picture in the background, once the login commits."""
+        transaction.on_commit(lambda: Util.dispatch_avatar_download(account_id, picture_url))
+
+    @staticmethod
+    def dispatch_avatar_download(account_id, picture_url):
+        from .tasks import download_avatar
         try:
-            response = PushClient().publish(
-                PushMessage(to=token,
-                            body=message,
-                            data=extra))
-        except PushServerError as exc:
-            print(f"Push server error: {exc}")
-        except (ConnectionError, HTTPError) as exc:
-            print(f"Connection or HTTP error: {exc}")
-        except DeviceNotRegisteredError:
-            print(f"Device not registered")
-        except PushTicketError as exc:
-            print(f"Push ticket error: {exc}")
+            download_avatar.delay(account_id, picture_url)
+        except Exception as e:
+            # Not critical, the next login tries again
+            logger.warning(f"Could not queue avatar download: {e}")
 
 
 class EmailVerificationTokenGenerator(PasswordResetTokenGenerator):
@@ -1,4 +1,5 @@
 from .basic import *
+from .avatar import *
 from .email import *
 from .apple_auth import *
 from .facebook_auth import *
@@ -7,13 +7,13 @@ from django.contrib.auth.models import User
 from django.db import transaction
 from user.models import Account
 from user.utils import Util
+from user.serializers import avatar_url
 from book.serializers import BookSerializer
+from user import jwks
 import jwt
 import requests
 import uuid
-import json
 import logging
-from jwt.algorithms import RSAAlgorithm
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -36,33 +36,10 @@ def apple_auth(request):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # Fetch Apple's public keys
-            keys_response = requests.get('https://appleid.apple.com/auth/keys')
-            keys = keys_response.json()['keys']
-
-            # Get the kid (Key ID) from the token headers
-            token_headers = jwt.get_unverified_header(identity_token)
-            token_kid = token_headers.get('kid')
-
-            # Find the matching public key
-            public_key = None
-            for key in keys:
-                if key['kid'] == token_kid:
-                    # Convert the JWK to PEM format
-                    public_key = RSAAlgorithm.from_jwk(json.dumps(key))
-                    break
-
-            if not public_key:
-                logger.error("No matching Apple public key found")
-                return Response({
-                    'error': 'No matching key found'
-                }, status=status.HTTP_400_BAD_REQUEST)
-
-            # Verify and decode the token
-            decoded_token = jwt.decode(
+            # Verify and decode the token with Apple's cached public keys
+            decoded_token = jwks.decode(
                 identity_token,
-                public_key,
-                algorithms=['RS256'],
+                jwks.apple_keys,
                 audience='com.lukeguexpo.moneymongoose',  # Your app's bundle ID
                 issuer='https://appleid.apple.com'
             )
@@ -207,7 +184,8 @@ def apple_auth(request):
         response_data = {
             'id': account.id,
             'account_id': account.account_id,
-            'avatar': None,  # Apple doesn't provide avatar
+            'avatar_url': avatar_url(account, request),
+            'avatar_hash': account.avatar_hash,
             'nickname': account.nickname,
             'account_status': account.account_status,
             'email': user.email,
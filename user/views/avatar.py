@@ -0,0 +1,110 @@
+from io import BytesIO
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework import status
+from PIL import Image
+from user.models import Account
+from user.serializers import AccountSerializer
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Shared by all workers, see CACHES
+cache = ConnectionProxy(caches, 'shared')
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """Render errors as JSON even when the client only accepts images."""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
+def thumbnail_key(avatar_hash, size):
+    # Keyed by content, so a new avatar never hits an old thumbnail
+    return f'avatar:{avatar_hash}:{size}'
+
+
+def avatar_content(account_id, avatar_hash, size=None):
+    """
+    JPEG bytes of an account's avatar, or of a thumbnail fitting size pixels.
+    None if the avatar isn't the one named by avatar_hash any more.
+    """
+    if size:
+        try:
+            thumbnail = cache.get(thumbnail_key(avatar_hash, size))
+            if thumbnail is not None:
+                return thumbnail
+        except Exception as e:
+            logger.warning(f"Avatar cache unavailable: {e}")
+
+    avatar = Account.objects.filter(pk=account_id, avatar_hash=avatar_hash) \
+        .values_list('avatar', flat=True).first()
+    if avatar is None or not size:
+        return avatar and bytes(avatar)
+
+    thumbnail = AccountSerializer().compress_image(
+        BytesIO(bytes(avatar)), max_dimension=size)
+    try:
+        cache.set(thumbnail_key(avatar_hash, size), thumbnail,
+                  timeout=settings.AVATAR_THUMBNAIL_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Failed to cache avatar thumbnail: {e}")
+    return thumbnail
+
+
+class AccountAvatar(APIView):
+    """
+    The avatar of the user's account as JPEG, or a thumbnail of it with
+    ?size= one of AVATAR_THUMBNAIL_SIZES. The ETag is the avatar hash. A
+    request whose ?v= is the current hash may be cached for good, since a
+    new avatar gets a new URL.
+    """
+    permission_classes = [IsAuthenticated]
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, pk):
+        size = request.query_params.get('size')
+        if size is not None:
+            if not size.isdigit() or int(size) not in settings.AVATAR_THUMBNAIL_SIZES:
+                return Response({
+                    'error': f'size must be one of {", ".join(map(str, settings.AVATAR_THUMBNAIL_SIZES))}'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            size = int(size)
+
+        avatar_hash = Account.objects.filter(pk=pk, user=request.user) \
+            .values_list('avatar_hash', flat=True).first()
+        if not avatar_hash:
+            return Response({'error': 'Avatar not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = quote_etag(f'{avatar_hash}-{size}' if size else avatar_hash)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            try:
+                content = avatar_content(pk, avatar_hash, size)
+            except (OSError, Image.DecompressionBombError) as e:
+                logger.error(f"Failed to make avatar thumbnail of account {pk}: {e}")
+                content = None
+            if content is None:
+                return Response({'error': 'Avatar not found'}, status=status.HTTP_404_NOT_FOUND)
+            response = HttpResponse(content, content_type='image/jpeg')
+
+        response['ETag'] = etag
+        if request.query_params.get('v') == avatar_hash:
+            patch_cache_control(response, private=True, immutable=True,
+                                max_age=settings.AVATAR_CACHE_MAX_AGE)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
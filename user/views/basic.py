@@ -30,7 +30,8 @@ class AccountDetail(generics.RetrieveUpdateDestroyAPIView):
         Optionally restricts the returned accounts to the user who is the owner.
         """
         user = self.request.user
-        return Account.objects.filter(user=user)
+        # The avatar is served by AccountAvatar, don't load it
+        return Account.objects.filter(user=user).defer('avatar')
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -98,7 +99,8 @@ def device_register_view(request):
                 token, created = Token.objects.get_or_create(user=user)
                 data = {
                     # Serialize the account data
-                    'account': AccountSerializer(account).data,
+                    'account': AccountSerializer(
+                        account, context={'request': request}).data,
                     'token': token.key  # Include the authentication token
                 }
                 return Response(data, status=status.HTTP_201_CREATED)
@@ -130,8 +132,9 @@ def user_details_view(request):
     if request.method == "GET":
         try:
             user = Token.objects.get(key=request.auth.key).user
-            account = Account.objects.get(user=user)
-            serializer = AccountSerializer(account)
+            account = Account.objects.defer('avatar').get(user=user)
+            serializer = AccountSerializer(
+                account, context={'request': request})
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Token.DoesNotExist:
             return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
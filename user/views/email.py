@@ -34,7 +34,7 @@ class VerifyEmail(APIView):
             account.save()
             # Send push notification if expo_push_token is available
             if account.expo_push_token:
-                Util.send_push_message(
+                Util.queue_push_message(
                     token=account.expo_push_token,
                     message="Your email has been successfully verified!",
                     extra={"type": "EMAIL_VERIFIED"}
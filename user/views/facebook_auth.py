@@ -7,10 +7,9 @@ from django.contrib.auth.models import User
 from django.db import transaction
 from user.models import Account
 from user.utils import Util
+from user.serializers import avatar_url
 from book.serializers import BookSerializer
-import requests
 import uuid
-import base64
 import logging
 import jwt
 
@@ -212,20 +211,9 @@ def facebook_auth(request):
                         'error': 'Failed to update account information'
                     }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Update profile picture if available (outside transaction as it's not critical)
+        # Download the profile picture in the background, it isn't needed to log in
         if picture_url:
-            try:
-                response = requests.get(picture_url)
-                if response.status_code == 200:
-                    content_type = response.headers.get(
-                        'content-type', 'image/jpeg')
-                    image_base64 = base64.b64encode(
-                        response.content).decode('utf-8')
-                    base64_image = f"data:{content_type};base64,{image_base64}"
-                    account.avatar = base64_image
-                    account.save()
-            except Exception as e:
-                logger.error(f"Failed to update profile picture: {str(e)}")
+            Util.queue_avatar_download(account.pk, picture_url)
 
         # Get or create token
         token, _ = Token.objects.get_or_create(user=user)
@@ -234,7 +222,8 @@ def facebook_auth(request):
         response_data = {
             'id': account.id,
             'account_id': account.account_id,
-            'avatar': account.avatar,
+            'avatar_url': avatar_url(account, request),
+            'avatar_hash': account.avatar_hash,
             'nickname': account.nickname,
             'account_status': account.account_status,
             'email': user.email,
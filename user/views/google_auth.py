@@ -3,21 +3,23 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from google.oauth2 import id_token
-from google.auth.transport import requests
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import transaction
 from user.models import Account
 from user.utils import Util
+from user.serializers import avatar_url
 from book.serializers import BookSerializer
+from user import jwks
+import jwt
 import requests as http_requests
-import base64
 import logging
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+GOOGLE_ISSUERS = ['accounts.google.com', 'https://accounts.google.com']
+
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -35,12 +37,24 @@ def google_auth(request):
                 'error': 'Missing required fields: accessToken or account_id'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Verify the ID token with Google
-        idinfo = id_token.verify_oauth2_token(
-            id_token_str,
-            requests.Request(),
-            settings.SOCIAL_AUTH_GOOGLE_CLIENT_ID
-        )
+        try:
+            # Verify the ID token with Google's cached public keys
+            idinfo = jwks.decode(
+                id_token_str,
+                jwks.google_keys,
+                audience=settings.SOCIAL_AUTH_GOOGLE_CLIENT_ID,
+                issuer=GOOGLE_ISSUERS
+            )
+        except jwt.InvalidTokenError as e:
+            logger.error(f"Google JWT validation error: {str(e)}")
+            return Response({
+                'error': 'Invalid token'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except http_requests.RequestException as e:
+            logger.error(f"Failed to fetch Google public keys: {str(e)}")
+            return Response({
+                'error': 'Failed to verify Google token'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         # Extract user info from the token
         email = idinfo['email']
@@ -161,21 +175,9 @@ def google_auth(request):
                         'error': 'Failed to update account information'
                     }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Update profile picture if available (outside transaction as it's not critical)
+        # Download the profile picture in the background, it isn't needed to log in
         if picture_url:
-            try:
-                response = http_requests.get(picture_url)
-                if response.status_code == 200:
-                    content_type = response.headers.get(
-                        'content-type', 'image/jpeg')
-                    image_base64 = base64.b64encode(
-                        response.content).decode('utf-8')
-                    base64_image = f"data:{content_type};base64,{image_base64}"
-                    account.avatar = base64_image
-                    account.save()
-            except Exception as e:
-                logger.error(f"Failed to update profile picture: {str(e)}")
-                # Don't return error response as this is not critical
+            Util.queue_avatar_download(account.pk, picture_url)
 
         # Get or create token
         token, _ = Token.objects.get_or_create(user=user)
@@ -184,7 +186,8 @@ def google_auth(request):
         response_data = {
             'id': account.id,
             'account_id': account.account_id,
-            'avatar': account.avatar,
+            'avatar_url': avatar_url(account, request),
+            'avatar_hash': account.avatar_hash,
             'nickname': account.nickname,
             'account_status': account.account_status,
             'email': user.email,
@@ -1,41 +1,105 @@
-from django.core.mail import BadHeaderError
-from rest_framework.decorators import api_view
+import os
+from datetime import datetime
+from celery import chain, states
+from celery.result import AsyncResult
+from django.http import FileResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from rest_framework.response import Response
-from user.utils import Util
+from book.models import Book
+from user.tasks import email_tax_report, render_tax_report
+
+
+def tax_report_args(request):
+    """
+    The (book_id, start_date, end_date) of a tax report request, or an error
+    Response when the book isn't the user's or a day isn't YYYY-MM-DD.
+    """
+    book_id = request.data.get('book_id')
+    start_date = request.data.get('start_date')
+    end_date = request.data.get('end_date')
+
+    if book_id and not Book.objects.filter(pk=book_id, user=request.user).exists():
+        return Response({"error": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        for value in (start_date, end_date):
+            if value:
+                datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return Response({"error": "Invalid date format. Use YYYY-MM-DD."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    return book_id, start_date, end_date
 
 
 @api_view(http_method_names=["POST"])
+@permission_classes([IsAuthenticated])
 def tax_return_view(request):
+    """
+    Render the tax return PDF like fill-pdf/ and email it to the user once
+    it is ready. tax-report/<task_id>/ tells when it has been rendered.
+    """
     if request.method == "POST":
-        try:
-            Util.send_email({
-                "email_subject": 'With attachment',
-                "email_body": 'Hello world',
-                "to_email": 'mythnan@gmail.com',
-                'email_attachment': 'doc/new.pdf'
-            })
-        except BadHeaderError:
-            return Response({"error": "Invalid header found."}, status=status.HTTP_400_BAD_REQUEST)
-        return Response({"details": "Send successfully."}, status=status.HTTP_200_OK)
+        if not request.user.email:
+            return Response({"error": "No email address to send the report to."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        args = tax_report_args(request)
+        if isinstance(args, Response):
+            return args
 
-    if request.method == "POST":
-        try:
-            Util.send_email({
-                "email_subject": 'No attachment',
-                "email_body": 'Hello world',
-                "to_email": 'mythnan@gmail.com',
-            })
-        except BadHeaderError:
-            return Response({"error": "Invalid header found."}, status=status.HTTP_400_BAD_REQUEST)
-        return Response({"details": "Send successfully."}, status=status.HTTP_200_OK)
+        result = chain(render_tax_report.s(request.user.pk, *args),
+                       email_tax_report.s()).delay()
+        return Response({"task_id": result.parent.id}, status=status.HTTP_202_ACCEPTED)
 
 
 @api_view(http_method_names=["POST"])
+@permission_classes([IsAuthenticated])
 def fill_pdf_view(request):
+    """
+    Start rendering the tax return PDF in the background, optionally from
+    the tax-marked records of book_id between start_date and end_date.
+    Poll tax-report/<task_id>/ for the result.
+    """
     if request.method == "POST":
-        try:
-            Util.fill_pdf()
-        except BadHeaderError:
-            return Response({"error": "Invalid file."}, status=status.HTTP_400_BAD_REQUEST)
-        return Response({"details": "Send successfully."}, status=status.HTTP_200_OK)
+        args = tax_report_args(request)
+        if isinstance(args, Response):
+            return args
+
+        task = render_tax_report.delay(request.user.pk, *args)
+        return Response({"task_id": task.id}, status=status.HTTP_202_ACCEPTED)
+
+
+def own_tax_report(request, task_id):
+    """The result of a finished tax report task of the user, or None."""
+    result = AsyncResult(task_id)
+    if result.state == states.SUCCESS and \
+            isinstance(result.result, dict) and result.result.get('user_id') == request.user.pk:
+        return result.result
+    return None
+
+
+@api_view(http_method_names=["GET"])
+@permission_classes([IsAuthenticated])
+def tax_report_view(request, task_id):
+    report = own_tax_report(request, task_id)
+    if report:
+        return Response({"status": "ready", "summary": report['summary']},
+                        status=status.HTTP_200_OK)
+
+    state = AsyncResult(task_id).state
+    if state == states.SUCCESS:
+        # Another user's report
+        return Response({"error": "Report not found."}, status=status.HTTP_404_NOT_FOUND)
+    if state in states.READY_STATES:
+        return Response({"status": "failed"}, status=status.HTTP_200_OK)
+    return Response({"status": "pending"}, status=status.HTTP_200_OK)
+
+
+@api_view(http_method_names=["GET"])
+@permission_classes([IsAuthenticated])
+def tax_report_download_view(request, task_id):
+    report = own_tax_report(request, task_id)
+    if not report or not os.path.exists(report['path']):
+        return Response({"error": "Report not found."}, status=status.HTTP_404_NOT_FOUND)
+    return FileResponse(open(report['path'], 'rb'), as_attachment=True,
+                        filename='tax-report.pdf', content_type='application/pdf')